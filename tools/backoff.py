@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import random
+import time
+
+# Delay in seconds before an endpoint is dialed again after its first failure
+DEFAULT_BASE_DELAY = 300
+
+# Longest delay in seconds between two attempts
+DEFAULT_MAX_DELAY = 24 * 3600
+
+# Random spread applied to every delay, 0.2 means +/- 20%
+DEFAULT_JITTER = 0.2
+
+DEFAULT_NEGATIVE_CACHE_FILE = 'negative_cache.json'
+
+
+class NegativeCache:
+    """
+    Unreachable endpoints with a per-endpoint exponential backoff.
+    The delay doubles with every consecutive failure, up to max_delay, and is
+    spread with jitter so dead peers don't all come back in the same run.
+    A successful connection removes the endpoint again.
+    """
+
+    def __init__(self, path=None, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, jitter=DEFAULT_JITTER):
+        """
+        :param path: Optional JSON file the cache is loaded from and saved to
+        :param base_delay: Delay in seconds after the first failure
+        :param max_delay: Maximum delay in seconds
+        :param jitter: Relative random spread of every delay
+        """
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        # "ip:port" -> [consecutive failures, time of the next allowed attempt]
+        self.entries = {}
+        self.skipped = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable negative cache {path}: {e}")
+
+    def should_probe(self, ip, port, now=None):
+        """
+        Check whether the endpoint may be dialed now.
+        :param ip: IP address
+        :param port: Port number
+        :param now: Current time, defaults to time.time()
+        :return: False while the endpoint is backing off
+        """
+        entry = self.entries.get(f"{ip}:{port}")
+        if entry is None or entry[1] <= (now or time.time()):
+            return True
+        self.skipped += 1
+        return False
+
+    def record_failure(self, ip, port, now=None):
+        """
+        Back off the endpoint after a failed connection.
+        :param ip: IP address
+        :param port: Port number
+        :param now: Current time, defaults to time.time()
+        """
+        key = f"{ip}:{port}"
+        failures = self.entries.get(key, [0, 0])[0] + 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.entries[key] = [failures, (now or time.time()) + delay]
+
+    def record_success(self, ip, port):
+        """
+        Re-admit an endpoint that answered again.
+        :param ip: IP address
+        :param port: Port number
+        """
+        self.entries.pop(f"{ip}:{port}", None)
+
+    def save(self):
+        """
+        Write the cache to its file, dropping endpoints nobody has retried for max_delay.
+        """
+        if not self.path:
+            return
+        now = time.time()
+        self.entries = {key: entry for key, entry in self.entries.items() if entry[1] > now - self.max_delay}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+        logging.info(f"Skipped {self.skipped} endpoints in backoff, {len(self.entries)} saved to {self.path}.")
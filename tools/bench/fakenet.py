@@ -0,0 +1,558 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import struct
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# The stand-in P2P handshake uses the implementation of the tools
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import p2p
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+P2P_PORT = 26656
+RPC_PORT = 26657
+CHAIN_ID = 'initiation-1'
+
+# Go's net/http switches to chunked encoding for bodies larger than this
+CHUNKED_ABOVE = 2048
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+async def read_frame(reader):
+    """
+    Read one masked client frame.
+    :return: Opcode and unmasked payload
+    """
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if head[1] & 0x80 else b'\0\0\0\0'
+    payload = await reader.readexactly(length)
+    return head[0] & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def frame(payload, opcode=1):
+    """
+    :return: Unmasked server frame
+    """
+    if len(payload) < 126:
+        return struct.pack('!BB', 0x80 | opcode, len(payload)) + payload
+    if len(payload) < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, len(payload)) + payload
+    return struct.pack('!BBQ', 0x80 | opcode, 127, len(payload)) + payload
+
+
+class FakeNode:
+    """
+    One simulated CometBFT node listening on its own loopback address.
+    kind is one of:
+      ok        - serves P2P and RPC normally
+      refused   - nothing listens, connects are refused
+      blackhole - the P2P and RPC listeners never accept, connects time out once the backlog is full
+      hang      - accepts connections but never answers RPC requests
+    """
+
+    def __init__(self, index, ip, node_id, kind, latency, lag, catching_up, stalled_at, batch=True, rate=1.0):
+        self.index = index
+        self.ip = ip
+        self.node_id = node_id
+        self.kind = kind
+        self.latency = latency
+        self.lag = lag
+        self.catching_up = catching_up
+        self.stalled_at = stalled_at
+        # Whether JSON-RPC POSTs reach the node, False simulates a GET-only proxy
+        self.batch = batch
+        # Share of the network block rate the node syncs at
+        self.rate = rate
+        # Ed25519 key answering the P2P handshake, None to only accept TCP
+        self.p2p_key = None
+        # Bytes per second the RPC responses are sent at, None for no limit
+        self.bandwidth = None
+        # Blocks a pruned node keeps below its height, None to keep all
+        self.retain = None
+        # Whether the node is on a fork and reports other block hashes
+        self.forked = False
+        # Port the RPC listens on and announces in rpc_address, not always the P2P port + 1
+        self.rpc_port = RPC_PORT
+        self.peers = []
+
+    @property
+    def key(self):
+        return f"{self.node_id}@{self.ip}:{P2P_PORT}"
+
+
+class FakeNetwork:
+    """
+    A fleet of stand-in CometBFT nodes on 127.0.0.0/8 serving /status, /net_info
+    and an open P2P port, plus a control server publishing peers.txt.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.start_time = time.time()
+        self.nodes = []
+        self.servers = []
+        self.blackhole_sockets = []
+        self.connection_statuses = {}
+        # /24 network -> (second, requests answered in that second), and requests answered with 429
+        self.subnet_requests = {}
+        self.rate_limited = 0
+        base_ip = ipaddress.IPv4Address(args.base_ip)
+        kinds = ['refused', 'blackhole', 'hang', 'ok']
+        weights = [args.refuse, args.blackhole, args.hang, max(0.0, 1 - args.refuse - args.blackhole - args.hang)]
+        for i in range(args.nodes):
+            kind = self.rng.choices(kinds, weights)[0]
+            latency = max(0.0, self.rng.gauss(args.latency, args.jitter))
+            lag = 0 if self.rng.random() >= args.lagging else self.rng.randint(1, args.max_lag)
+            catching_up = self.rng.random() < args.catching_up
+            stalled_at = self.tip() - lag if self.rng.random() < args.stalled else None
+            node_id = '%040x' % self.rng.getrandbits(160)
+            batch = self.rng.random() >= args.no_batch
+            # Only drawn for --slow so default fleets stay the same
+            rate = args.slow_rate if args.slow and self.rng.random() < args.slow else 1.0
+            node = FakeNode(i, str(base_ip + i), node_id, kind, latency, lag, catching_up, stalled_at, batch, rate)
+            if args.throttled and self.rng.random() < args.throttled:
+                node.bandwidth = args.bandwidth
+            if args.pruned and self.rng.random() < args.pruned:
+                node.retain = args.retain
+            if args.forked and self.rng.random() < args.forked:
+                node.forked = True
+            if args.custom_rpc and self.rng.random() < args.custom_rpc:
+                node.rpc_port = args.custom_rpc_port
+            if args.handshake:
+                # The node ID is derived from the key, an impostor answers with the key of another node
+                key = p2p.node_key_from_seed(hashlib.sha256(node_id.encode()).digest())
+                node.node_id = p2p.node_id_from_key(p2p.public_key_bytes(key))
+                impostor = self.rng.random() < args.impostor
+                node.p2p_key = p2p.node_key_from_seed(hashlib.sha256(b'impostor' + node_id.encode()).digest()) if impostor else key
+            self.nodes.append(node)
+        self.build_graph()
+
+    def build_graph(self):
+        """
+        Connect the nodes as a random graph, a scale-free graph (preferential attachment) or a ring.
+        """
+        n = len(self.nodes)
+        degree = min(self.args.degree, n - 1)
+        edges = set()
+        if self.args.graph == 'ring':
+            for i in range(n):
+                for step in range(1, degree // 2 + 1):
+                    edges.add((i, (i + step) % n))
+        elif self.args.graph == 'scalefree':
+            m = max(1, degree // 2)
+            targets = list(range(min(m, n)))
+            repeated = []
+            for i in range(len(targets), n):
+                for t in set(targets):
+                    edges.add((i, t))
+                repeated.extend(targets)
+                repeated.extend([i] * m)
+                targets = [self.rng.choice(repeated) for _ in range(m)]
+        else:
+            for i in range(n):
+                for j in self.rng.sample(range(n), degree):
+                    if j != i:
+                        edges.add((i, j))
+        for a, b in edges:
+            self.nodes[a].peers.append(b)
+            self.nodes[b].peers.append(a)
+
+    def tip(self):
+        return self.args.start_height + int((time.time() - self.start_time) / self.args.block_time)
+
+    def height(self, node):
+        if node.stalled_at is not None:
+            return node.stalled_at
+        if node.rate != 1.0:
+            return self.args.start_height + int((time.time() - self.start_time) * node.rate / self.args.block_time) - node.lag
+        return self.tip() - node.lag
+
+    def earliest(self, node):
+        if node.retain is None:
+            return 1
+        return max(1, self.height(node) - node.retain + 1)
+
+    @staticmethod
+    def block_hash(node, height):
+        return '%064X' % (height ^ (0xF0F0F0F0 if node.forked else 0))
+
+    def node_info(self, node):
+        return {
+            'protocol_version': {'p2p': '8', 'block': '11', 'app': '0'},
+            'id': node.node_id,
+            'listen_addr': f'tcp://0.0.0.0:{P2P_PORT}',
+            'network': CHAIN_ID,
+            'version': '0.38.7',
+            'channels': '40202122233038606100',
+            'moniker': f'fake-{node.index}',
+            'other': {'tx_index': 'on', 'rpc_address': f'tcp://0.0.0.0:{node.rpc_port}'},
+        }
+
+    def status(self, node):
+        height = self.height(node)
+        block_time = self.start_time + (height - self.args.start_height) * self.args.block_time
+        return {'jsonrpc': '2.0', 'id': -1, 'result': {
+            'node_info': self.node_info(node),
+            'sync_info': {
+                'latest_block_hash': self.block_hash(node, height),
+                'latest_app_hash': '%064X' % (height * 7),
+                'latest_block_height': str(height),
+                'latest_block_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(block_time)) + '.000000000Z',
+                'earliest_block_height': str(self.earliest(node)),
+                'catching_up': node.catching_up,
+            },
+            'validator_info': {'address': node.node_id[:40].upper(), 'voting_power': '0'},
+        }}
+
+    def connection_status(self, peer):
+        """
+        :return: connection_status block laid out like CometBFT's, the bulk of a /net_info entry
+        """
+        cached = self.connection_statuses.get(peer.index)
+        if cached is not None:
+            return cached
+
+        # Own generator, so the blocks do not change the random sequence of the fleet
+        rng = random.Random(peer.index)
+
+        def monitor():
+            return {'Start': '2024-05-01T10:00:00.000Z', 'Bytes': str(rng.randrange(10 ** 9)), 'Samples': str(rng.randrange(10 ** 5)),
+                    'InstRate': '1024', 'CurRate': '2048', 'AvgRate': '1536', 'PeakRate': '40960', 'BytesRem': '0',
+                    'Duration': str(rng.randrange(10 ** 12)), 'Idle': '20000000', 'TimeRem': '0', 'Progress': 0, 'Active': True}
+        status = {'Duration': str(rng.randrange(10 ** 12)), 'SendMonitor': monitor(), 'RecvMonitor': monitor(),
+                  'Channels': [{'ID': channel, 'SendQueueCapacity': '100', 'SendQueueSize': '0', 'Priority': '5', 'RecentlySent': '0'}
+                               for channel in (64, 32, 33, 34, 35, 48, 56, 96, 97, 0)]}
+        if self.args.status_bytes:
+            status['Padding'] = 'x' * self.args.status_bytes
+        self.connection_statuses[peer.index] = status
+        return status
+
+    def net_info(self, node):
+        peers = []
+        for index in node.peers:
+            peer = self.nodes[index]
+            peers.append({
+                'node_info': self.node_info(peer),
+                'is_outbound': peer.index % 2 == 0,
+                'connection_status': self.connection_status(peer),
+                'remote_ip': peer.ip,
+            })
+        return {'jsonrpc': '2.0', 'id': -1, 'result': {
+            'listening': True, 'listeners': [f'Listener(@0.0.0.0:{P2P_PORT})'],
+            'n_peers': str(len(peers)), 'peers': peers}}
+
+    def requested_height(self, node, query):
+        """
+        :return: Height of a /block or /commit request, or the status code and error payload if the node does not store it
+        """
+        height = self.height(node)
+        try:
+            requested = int(query.get('height', [height])[0])
+        except ValueError:
+            requested = 0
+        if not 1 <= requested <= height:
+            return 500, {'jsonrpc': '2.0', 'id': -1, 'error': {'code': -32603, 'message': 'Internal error',
+                         'data': f'height {requested} must be less than or equal to the current blockchain height {height}'}}
+        earliest = self.earliest(node)
+        if requested < earliest:
+            return 500, {'jsonrpc': '2.0', 'id': -1, 'error': {'code': -32603, 'message': 'Internal error',
+                         'data': f'height {requested} is not available, lowest height is {earliest}'}}
+        return requested
+
+    def block(self, node, query):
+        requested = self.requested_height(node, query)
+        if isinstance(requested, tuple):
+            return requested
+        # Transactions padding the block to about --block-bytes
+        txs = ['A' * 340] * (self.args.block_bytes // 340)
+        return 200, {'jsonrpc': '2.0', 'id': -1, 'result': {
+            'block_id': {'hash': self.block_hash(node, requested)},
+            'block': {'header': {'chain_id': CHAIN_ID, 'height': str(requested)}, 'data': {'txs': txs}}}}
+
+    def commit(self, node, query):
+        requested = self.requested_height(node, query)
+        if isinstance(requested, tuple):
+            return requested
+        return 200, {'jsonrpc': '2.0', 'id': -1, 'result': {
+            'signed_header': {
+                'header': {'chain_id': CHAIN_ID, 'height': str(requested)},
+                'commit': {'height': str(requested), 'round': 0, 'block_id': {'hash': self.block_hash(node, requested)}, 'signatures': []}},
+            'canonical': True}}
+
+    def route(self, node, path, query):
+        """
+        :return: Status code and JSON payload for the request
+        """
+        if path == '/status':
+            return 200, self.status(node)
+        if path == '/net_info':
+            return 200, self.net_info(node)
+        if path == '/block':
+            return self.block(node, query)
+        if path == '/commit':
+            return self.commit(node, query)
+        return 404, {'jsonrpc': '2.0', 'id': -1, 'error': {'code': -32601, 'message': 'Method not found'}}
+
+    def route_post(self, node, body):
+        """
+        Answer a JSON-RPC request or batch POSTed to /.
+        :return: Status code and JSON payload
+        """
+        if not node.batch:
+            return 405, {'error': 'method not allowed'}
+        try:
+            requests = json.loads(body)
+        except ValueError:
+            return 200, {'jsonrpc': '2.0', 'id': -1, 'error': {'code': -32700, 'message': 'Parse error'}}
+        responses = []
+        for request in requests if isinstance(requests, list) else [requests]:
+            status, payload = self.route(node, '/' + str(request.get('method')), {})
+            responses.append(dict(payload, id=request.get('id')))
+        return 200, responses if isinstance(requests, list) else responses[0]
+
+    def over_limit(self, node):
+        """
+        Count a request like a provider firewall counting per /24 network.
+        :return: Whether the /24 of the node is over --subnet-limit requests in the current second
+        """
+        if not self.args.subnet_limit:
+            return False
+        subnet = node.ip.rpartition('.')[0]
+        second = int(time.monotonic())
+        window, count = self.subnet_requests.get(subnet, (second, 0))
+        if window != second:
+            window, count = second, 0
+        self.subnet_requests[subnet] = (window, count + 1)
+        if count < self.args.subnet_limit:
+            return False
+        self.rate_limited += 1
+        return True
+
+    def rpc_handler(self, node):
+        async def handle(reader, writer):
+            try:
+                while True:
+                    request_line = await reader.readline()
+                    if not request_line:
+                        break
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    body = await reader.readexactly(int(headers['content-length'])) if 'content-length' in headers else b''
+                    if node.kind == 'hang':
+                        await asyncio.sleep(3600)
+                    if node.latency:
+                        await asyncio.sleep(node.latency)
+                    method, target = request_line.decode('latin-1').split()[:2]
+                    url = urlsplit(target)
+                    if self.over_limit(node):
+                        status, payload = 429, {'error': 'Too Many Requests'}
+                    elif headers.get('upgrade', '').lower() == 'websocket':
+                        await self.websocket(node, headers, reader, writer)
+                        break
+                    elif method == 'POST':
+                        status, payload = self.route_post(node, body)
+                    else:
+                        status, payload = self.route(node, url.path, parse_qs(url.query))
+                    data = json.dumps(payload).encode()
+                    head = f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                    if len(data) > CHUNKED_ABOVE:
+                        response = [f"{head}Transfer-Encoding: chunked\r\n\r\n".encode()]
+                        for offset in range(0, len(data), 4096):
+                            chunk = data[offset:offset + 4096]
+                            response.append(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        response.append(b'0\r\n\r\n')
+                    else:
+                        response = [f"{head}Content-Length: {len(data)}\r\n\r\n".encode() + data]
+                    for part in response:
+                        writer.write(part)
+                        if node.bandwidth:
+                            await writer.drain()
+                            await asyncio.sleep(len(part) / node.bandwidth)
+                    await writer.drain()
+                    if headers.get('connection', '').lower() == 'close':
+                        break
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+        return handle
+
+    async def websocket(self, node, headers, reader, writer):
+        """
+        Serve a /websocket subscription with one NewBlockHeader event per new height.
+        Nodes behind a GET-only proxy refuse the upgrade, stalled nodes send no events.
+        """
+        if not node.batch:
+            writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            return
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        _, payload = await read_frame(reader)
+        request = json.loads(payload)
+        writer.write(frame(json.dumps({'jsonrpc': '2.0', 'id': request.get('id'), 'result': {}}).encode()))
+        await writer.drain()
+        height = self.height(node)
+        while True:
+            await asyncio.sleep(min(1.0, self.args.block_time / 4))
+            current = self.height(node)
+            if current <= height:
+                continue
+            height = current
+            event = {'jsonrpc': '2.0', 'id': request.get('id'), 'result': {
+                'query': "tm.event='NewBlockHeader'",
+                'data': {'type': 'tendermint/event/NewBlockHeader', 'value': {'header': {
+                    'chain_id': CHAIN_ID, 'height': str(height), 'time': self.status(node)['result']['sync_info']['latest_block_time']}}}}}
+            writer.write(frame(json.dumps(event).encode()))
+            await writer.drain()
+
+    def p2p_handler(self, node):
+        async def handle(reader, writer):
+            try:
+                if node.p2p_key is None or node.kind == 'hang':
+                    # Keep the connection open briefly like a node waiting for the handshake
+                    await asyncio.wait_for(reader.read(1), 5)
+                    return
+                conn, _ = await asyncio.wait_for(p2p.secret_handshake(reader, writer, node.p2p_key), 5)
+                conn.write_delimited(p2p.encode_node_info(self.node_info(node)))
+                await writer.drain()
+                # A node waits for the NodeInfo of the other side, a probe closes instead
+                await asyncio.wait_for(conn.read_delimited(p2p.MAX_NODE_INFO_BYTES), 5)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) + p2p.HANDSHAKE_ERRORS:
+                pass
+            finally:
+                writer.close()
+        return handle
+
+    def peers_txt(self):
+        seeds = self.rng.sample(self.nodes, min(self.args.seeds, len(self.nodes)))
+        return ','.join(node.key for node in seeds)
+
+    async def control_handler(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request_line.decode('latin-1').split()[1]
+            if path == '/peers.txt':
+                data = self.peers_txt().encode()
+            elif path == '/nodes.json':
+                data = json.dumps([{'key': n.key, 'rpc_port': n.rpc_port, 'kind': n.kind, 'height': self.height(n), 'latency': n.latency,
+                                    'catching_up': n.catching_up, 'bandwidth': n.bandwidth, 'impostor': n.p2p_key is not None and
+                                    p2p.node_id_from_key(p2p.public_key_bytes(n.p2p_key)) != n.node_id} for n in self.nodes]).encode()
+            elif path == '/stats.json':
+                data = json.dumps({'rate_limited': self.rate_limited}).encode()
+            else:
+                data = b''
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % len(data) + data)
+            await writer.drain()
+        except (OSError, ValueError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        for node in self.nodes:
+            if node.kind == 'refused':
+                continue
+            if node.kind == 'blackhole':
+                # Listen without ever accepting, the kernel drops SYNs once the backlog is full
+                for port in (P2P_PORT, node.rpc_port):
+                    sock = socket.socket()
+                    sock.bind((node.ip, port))
+                    sock.listen(0)
+                    self.blackhole_sockets.append(sock)
+                continue
+            self.servers.append(await asyncio.start_server(self.p2p_handler(node), node.ip, P2P_PORT))
+            self.servers.append(await asyncio.start_server(self.rpc_handler(node), node.ip, node.rpc_port))
+        control = await asyncio.start_server(self.control_handler, '127.0.0.1', self.args.control_port)
+        self.servers.append(control)
+        counts = {}
+        for node in self.nodes:
+            counts[node.kind] = counts.get(node.kind, 0) + 1
+        ok_nodes = [node for node in self.nodes if node.kind == 'ok']
+        print(json.dumps({
+            'ready': True,
+            'control': f"http://127.0.0.1:{control.sockets[0].getsockname()[1]}",
+            'rpc': f"http://{ok_nodes[0].ip}:{ok_nodes[0].rpc_port}" if ok_nodes else None,
+            'nodes': len(self.nodes),
+            'kinds': counts,
+        }), flush=True)
+
+
+async def main(args):
+    network = FakeNetwork(args)
+    await network.start()
+    await asyncio.Event().wait()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Simulated CometBFT fleet on loopback for benchmarks.')
+    parser.add_argument('--nodes', type=int, default=1000, help='Number of simulated nodes')
+    parser.add_argument('--base-ip', default='127.1.0.1', help='Address of the first node, the others follow')
+    parser.add_argument('--graph', choices=['random', 'scalefree', 'ring'], default='random', help='Shape of the peer graph')
+    parser.add_argument('--degree', type=int, default=20, help='Average number of peers per node')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean RPC response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Standard deviation of the RPC delay')
+    parser.add_argument('--refuse', type=float, default=0.2, help='Share of nodes refusing connections')
+    parser.add_argument('--blackhole', type=float, default=0.05, help='Share of nodes whose connects time out')
+    parser.add_argument('--hang', type=float, default=0.05, help='Share of nodes that accept but never answer RPC')
+    parser.add_argument('--no-batch', type=float, default=0.1, help='Share of nodes rejecting JSON-RPC POSTs like a GET-only proxy')
+    parser.add_argument('--lagging', type=float, default=0.2, help='Share of nodes behind the tip')
+    parser.add_argument('--max-lag', type=int, default=50, help='Maximum number of blocks a lagging node is behind')
+    parser.add_argument('--catching-up', type=float, default=0.05, help='Share of nodes reporting catching_up')
+    parser.add_argument('--stalled', type=float, default=0.05, help='Share of nodes whose height never advances')
+    parser.add_argument('--slow', type=float, default=0.0, help='Share of nodes syncing slower than the network')
+    parser.add_argument('--block-bytes', type=int, default=20000, help='Approximate size of a block served on /block')
+    parser.add_argument('--throttled', type=float, default=0.0, help='Share of nodes sending RPC responses at --bandwidth')
+    parser.add_argument('--bandwidth', type=float, default=50000, help='Bytes per second a throttled node sends at')
+    parser.add_argument('--slow-rate', type=float, default=0.5, help='Share of the network block rate a slow node syncs at')
+    parser.add_argument('--handshake', action='store_true', help='Answer the P2P secret connection handshake, needs the cryptography package')
+    parser.add_argument('--impostor', type=float, default=0.05, help='Share of nodes whose P2P port answers with the key of another node, with --handshake')
+    parser.add_argument('--subnet-limit', type=float, default=0, help='RPC requests per second a /24 answers before replying 429, 0 for no limit')
+    parser.add_argument('--pruned', type=float, default=0.0, help='Share of nodes keeping only the last --retain blocks')
+    parser.add_argument('--retain', type=int, default=1000, help='Blocks a pruned node keeps')
+    parser.add_argument('--forked', type=float, default=0.0, help='Share of nodes on a fork, reporting other block hashes')
+    parser.add_argument('--custom-rpc', type=float, default=0.0, help='Share of nodes whose RPC listens on --custom-rpc-port instead of the P2P port + 1')
+    parser.add_argument('--custom-rpc-port', type=int, default=36657, help='RPC port of the nodes picked by --custom-rpc')
+    parser.add_argument('--start-height', type=int, default=1000000, help='Block height at start')
+    parser.add_argument('--block-time', type=float, default=2.0, help='Seconds per block')
+    parser.add_argument('--status-bytes', type=int, default=0, help='Extra padding in every connection_status of /net_info')
+    parser.add_argument('--seeds', type=int, default=200, help='Number of nodes listed in peers.txt')
+    parser.add_argument('--control-port', type=int, default=0, help='Port of the control server, 0 for any')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    return parser
+
+
+# Example: Start 2000 nodes, 30% of them unreachable, with a scale-free peer graph
+if __name__ == '__main__':
+    try:
+        asyncio.run(main(build_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TOOLS_DIR = os.path.dirname(BENCH_DIR)
+
+# Seconds between two checks of a running tool
+POLL_INTERVAL = 0.05
+
+TOOLS = ['peerscheck_with_height', 'peers_from_nodeinfo', 'peers_from_rpc']
+
+
+def start_fleet(fleet_args):
+    """
+    Start fakenet.py and wait until all nodes listen.
+    :param fleet_args: Command line arguments passed to fakenet.py
+    :return: Fleet process and its ready message
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fakenet.py')] + fleet_args,
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError(f"fakenet.py exited with code {process.wait()}")
+    return process, json.loads(line)
+
+
+def tool_command(tool, fleet, top_n, depth, concurrency, processes=1, sample=0):
+    """
+    :return: Command line running the tool against the fleet and the name of its output file
+    """
+    common = ['--stream', '--jsonl', 'probe_results.jsonl', '--negative-cache', '', '--flush-every', '1']
+    if concurrency:
+        common += ['--concurrency', str(concurrency)]
+    if sample:
+        common += ['--sample', str(sample)]
+    if tool == 'peerscheck_with_height':
+        return [str(top_n), 'top.txt', '--url', f"{fleet['control']}/peers.txt"] + common, 'top.txt'
+    if tool == 'peers_from_nodeinfo':
+        return [str(top_n), 'top.txt', '--depth', str(depth), '--processes', str(processes)] + common, 'top.txt'
+    return [fleet['rpc'], 'top_ips_ports.txt', str(depth), str(top_n), '--processes', str(processes)] + common, 'top_peers_from_rpc.txt'
+
+
+def count_entries(path):
+    try:
+        with open(path) as file:
+            content = file.read().strip()
+    except OSError:
+        return 0
+    return len(content.split(',')) if content else 0
+
+
+def run_tool(tool, fleet, seeds, top_n, depth, concurrency, timeout, processes=1, sample=0):
+    """
+    Run one tool in a scratch directory and measure it.
+    :param tool: Script name without .py
+    :param fleet: Ready message of the fleet
+    :param seeds: Content of peers.txt, written as top_ips_ports.txt for the tools reading a file
+    :param top_n: Number of connections the tool keeps
+    :param depth: Number of /net_info hops for the crawling tools
+    :param concurrency: Concurrency passed to the tool, None for its default
+    :param timeout: Seconds before the tool is killed
+    :param processes: Worker processes passed to the crawling tools
+    :param sample: Seconds of sync rate sampling passed to the tools, 0 to disable
+    :return: Dictionary of measurements
+    """
+    workdir = tempfile.mkdtemp(prefix=f'bench-{tool}-')
+    try:
+        with open(os.path.join(workdir, 'top_ips_ports.txt'), 'w') as file:
+            file.write(seeds)
+        args, output_file = tool_command(tool, fleet, top_n, depth, concurrency, processes, sample)
+        output_path = os.path.join(workdir, output_file)
+        with open(os.path.join(workdir, 'tool.log'), 'w') as log:
+            start_time = time.perf_counter()
+            process = subprocess.Popen([sys.executable, os.path.join(TOOLS_DIR, f'{tool}.py')] + args,
+                                       cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            time_to_first = None
+            time_to_top_n = None
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                elapsed = time.perf_counter() - start_time
+                if time_to_top_n is None:
+                    entries = count_entries(output_path)
+                    if entries and time_to_first is None:
+                        time_to_first = elapsed
+                    if entries >= top_n:
+                        time_to_top_n = elapsed
+                if pid:
+                    break
+                if elapsed > timeout:
+                    process.kill()
+                    pid, status, usage = os.wait4(process.pid, 0)
+                    break
+                time.sleep(POLL_INTERVAL)
+            wall_time = time.perf_counter() - start_time
+            # Reaped by wait4, let Popen know
+            process.returncode = os.waitstatus_to_exitcode(status)
+        with open(os.path.join(workdir, 'probe_results.jsonl')) as file:
+            # Sync sampling records are not probes of the crawl
+            records = [record for record in map(json.loads, filter(str.strip, file)) if not record.get('sync') and not record.get('throughput')]
+        return {
+            'tool': tool,
+            'exit_code': process.returncode,
+            'wall_time': round(wall_time, 3),
+            'probes': len(records),
+            'reachable': sum(1 for r in records if r.get('ok')),
+            'probes_per_second': round(len(records) / wall_time, 1) if wall_time else 0.0,
+            'time_to_first_output': round(time_to_first, 3) if time_to_first is not None else None,
+            'time_to_top_n': round(time_to_top_n, 3) if time_to_top_n is not None else None,
+            'top_n_found': count_entries(output_path),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def summarize(runs):
+    """
+    Reduce repeated runs of one tool to their medians.
+    :param runs: List of measurement dictionaries of the same tool
+    :return: Dictionary of median measurements
+    """
+    summary = {'tool': runs[0]['tool'], 'runs': len(runs), 'exit_code': max(r['exit_code'] for r in runs)}
+    for key in ['wall_time', 'probes', 'reachable', 'probes_per_second', 'time_to_first_output', 'time_to_top_n', 'top_n_found', 'peak_rss_mb']:
+        values = [r[key] for r in runs if r[key] is not None]
+        summary[key] = statistics.median(values) if values else None
+    return summary
+
+
+def print_table(summaries):
+    columns = [('tool', 'tool', 24), ('probes', 'probes', 8), ('reachable', 'ok', 6), ('wall_time', 'wall s', 8),
+               ('probes_per_second', 'probes/s', 9), ('time_to_first_output', 'first s', 8),
+               ('time_to_top_n', 'top-N s', 8), ('top_n_found', 'top-N', 6), ('peak_rss_mb', 'RSS MB', 7)]
+    print(''.join(title.ljust(width) for _, title, width in columns))
+    for summary in summaries:
+        print(''.join(('-' if summary[key] is None else str(summary[key])).ljust(width) for key, _, width in columns))
+
+
+# Example: Benchmark all tools against 2000 simulated nodes, 3 runs each, and save the medians to bench.json
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the peer tools against a simulated CometBFT fleet. '
+                    'Arguments after -- are passed to fakenet.py, e.g. -- --nodes 2000 --graph scalefree')
+    parser.add_argument('--tools', nargs='+', choices=TOOLS, default=TOOLS, help='Tools to benchmark')
+    parser.add_argument('--top-n', type=int, default=40, help='Number of connections each tool keeps')
+    parser.add_argument('--depth', type=int, default=2, help='Number of /net_info hops for the crawling tools')
+    parser.add_argument('--concurrency', type=int, default=None, help='Concurrency passed to the tools')
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes passed to the crawling tools, 0 for one per CPU core')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per tool, the median is reported')
+    parser.add_argument('--sample', type=float, default=0, help='Seconds of sync rate sampling passed to the tools, 0 to disable')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds before a tool run is killed')
+    parser.add_argument('--json', default=None, help='File receiving the results as JSON')
+    parser.add_argument('fleet_args', nargs=argparse.REMAINDER, help='Arguments for fakenet.py')
+    args = parser.parse_args()
+    fleet_args = args.fleet_args[1:] if args.fleet_args[:1] == ['--'] else args.fleet_args
+    fleet_process, fleet = start_fleet(fleet_args)
+    try:
+        logging.info(f"Fleet ready: {fleet['nodes']} nodes {fleet['kinds']}")
+        seeds = requests.get(f"{fleet['control']}/peers.txt").text
+        summaries = []
+        for tool in args.tools:
+            runs = []
+            for i in range(args.repeat):
+                result = run_tool(tool, fleet, seeds, args.top_n, args.depth, args.concurrency, args.timeout, args.processes, args.sample)
+                logging.info(f"{tool} run {i + 1}: {result}")
+                runs.append(result)
+            summaries.append(summarize(runs))
+        print_table(summaries)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump({'fleet': fleet, 'fleet_args': fleet_args, 'top_n': args.top_n, 'depth': args.depth,
+                           'results': summaries}, file, indent=2)
+    finally:
+        fleet_process.terminate()
+        fleet_process.wait()
@@ -0,0 +1,168 @@
+from backoff import DEFAULT_NEGATIVE_CACHE_FILE, NegativeCache
+from crawler import DEFAULT_TARGET_LAG, DEFAULT_TARGET_RTT, QualityTarget
+from newblock import BlockWatcher
+from output import DEFAULT_FLUSH_EVERY, DEFAULT_FLUSH_INTERVAL, DEFAULT_JSONL_FILE, StreamingOutput
+from peerdb import DEFAULT_FRESH_FOR
+from prefixes import DEFAULT_PREFIX_CAP, DiversitySelector, PrefixIndex
+from probe import DEFAULT_CONCURRENCY
+from scheduler import DEFAULT_HOST_RATE, DEFAULT_SUBNET_RATE, RateLimits
+from seeds import DEFAULT_SEED_CACHE_FILE
+from statesync import DEFAULT_SERVERS, DEFAULT_TRUST_OFFSET, StateSyncFinder
+from syncrate import DEFAULT_CANDIDATE_FACTOR, DEFAULT_SAMPLE_INTERVAL, SyncSampler
+from throughput import DEFAULT_BLOCKS, DEFAULT_MAX_BYTES, ThroughputProbe
+from tracing import PhaseRecorder
+
+# Command line options shared by the tools. Each add_*_arguments() function defines one
+# group of options and the matching *_from_args() functions build its objects.
+
+
+def add_probe_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --concurrency, --negative-cache and the rate limits
+    """
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Number of peers probed at the same time')
+    parser.add_argument('--negative-cache', default=DEFAULT_NEGATIVE_CACHE_FILE, help='File of unreachable peers kept in exponential backoff, empty to disable')
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_HOST_RATE, help='Network operations per second towards one IP address, 0 for no limit')
+    parser.add_argument('--subnet-rate', type=float, default=DEFAULT_SUBNET_RATE, help='Network operations per second towards one /24 or /48 network, 0 for no limit')
+    parser.add_argument('--global-rate', type=float, default=0, help='Network operations per second in total, 0 for no limit')
+
+
+def limits_from_args(args):
+    """
+    :param args: Parsed arguments of add_probe_arguments()
+    :return: RateLimits
+    """
+    return RateLimits(args.host_rate, args.subnet_rate, args.global_rate)
+
+
+def negative_cache_from_args(args):
+    """
+    :param args: Parsed arguments of add_probe_arguments()
+    :return: NegativeCache, or None if disabled
+    """
+    return NegativeCache(args.negative_cache) if args.negative_cache else None
+
+
+def add_scan_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --seed-cache, --deadline, --db and --fresh
+    """
+    parser.add_argument('--seed-cache', default=DEFAULT_SEED_CACHE_FILE, help='File keeping the ETag and body of downloaded peer lists, empty to disable')
+    parser.add_argument('--deadline', type=float, default=None, help='Time budget in seconds, then the best peers found so far are saved')
+    parser.add_argument('--db', default=None, help='Peer database file, enables incremental re-probing')
+    parser.add_argument('--fresh', type=int, default=DEFAULT_FRESH_FOR, help='Seconds before a peer in the database is probed again')
+
+
+def add_trace_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --phases and --trace
+    """
+    parser.add_argument('--phases', action='store_true', help='Time every probe phase and log per-phase histograms at the end')
+    parser.add_argument('--trace', default=None, help='Trace file of every probe phase, Chrome trace format for .json, JSONL otherwise')
+
+
+def recorder_from_args(args):
+    """
+    :param args: Parsed arguments of add_trace_arguments()
+    :return: PhaseRecorder, or None if the phases are not timed
+    """
+    return PhaseRecorder(keep_spans=bool(args.trace)) if args.phases or args.trace else None
+
+
+def add_stream_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --stream, --jsonl and the flush settings
+    """
+    parser.add_argument('--stream', action='store_true', help='Write results while probing instead of only at the end')
+    parser.add_argument('--jsonl', default=DEFAULT_JSONL_FILE, help='JSONL file receiving one record per probed peer in streaming mode')
+    parser.add_argument('--flush-interval', type=float, default=DEFAULT_FLUSH_INTERVAL, help='Seconds between rewrites of the output file in streaming mode')
+    parser.add_argument('--flush-every', type=int, default=DEFAULT_FLUSH_EVERY, help='New results that trigger a rewrite of the output file in streaming mode')
+
+
+def stream_from_args(args, output_filename, top_n, selector=None):
+    """
+    :param args: Parsed arguments of add_stream_arguments()
+    :param output_filename: PEERS file rewritten while probing
+    :param top_n: Number of connections kept in the PEERS file
+    :param selector: Optional DiversitySelector spreading the PEERS file over networks
+    :return: StreamingOutput, or None without --stream
+    """
+    if not args.stream:
+        return None
+    return StreamingOutput(output_filename, top_n, args.jsonl, args.flush_interval, args.flush_every, selector=selector)
+
+
+def add_handshake_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --handshake and the NodeInfo checks
+    """
+    parser.add_argument('--handshake', action='store_true', help='Verify peers with the P2P secret connection handshake and use its duration as latency, needs the cryptography package')
+    parser.add_argument('--chain-id', default=None, help='Chain ID peers must report in the handshake, any if not set')
+    parser.add_argument('--block-version', type=int, default=None, help='Block protocol version peers must report in the handshake, e.g. 11, any if not set')
+
+
+def add_diversity_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving the per-network caps
+    """
+    parser.add_argument('--prefix-cap', type=int, default=DEFAULT_PREFIX_CAP, help='Peers saved per /24 or /48 network, 0 for no cap')
+    parser.add_argument('--asn-cap', type=int, default=None, help='Peers saved per autonomous system, needs --asn-db, defaults to a quarter of top_n')
+    parser.add_argument('--asn-db', default=None, help='Offline prefix to AS dataset, pyasn ipasn.dat or iptoasn.com TSV, optionally gzipped')
+
+
+def selector_from_args(args):
+    """
+    :param args: Parsed arguments of add_diversity_arguments()
+    :return: DiversitySelector, or None without caps
+    """
+    if not args.prefix_cap and not args.asn_db:
+        return None
+    return DiversitySelector(PrefixIndex.from_file(args.asn_db) if args.asn_db else None, args.prefix_cap, args.asn_cap)
+
+
+def add_target_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving --target and its thresholds
+    """
+    parser.add_argument('--target', type=int, default=0, help='Stop crawling once this many peers are close to the tip with a low latency, 0 to crawl everything')
+    parser.add_argument('--target-lag', type=int, default=DEFAULT_TARGET_LAG, help='Blocks behind the tip a peer counting towards --target may be')
+    parser.add_argument('--target-rtt', type=float, default=DEFAULT_TARGET_RTT * 1000, help='Round trip time in milliseconds a peer counting towards --target may not exceed')
+
+
+def target_from_args(args):
+    """
+    :param args: Parsed arguments of add_target_arguments()
+    :return: QualityTarget, or None without --target
+    """
+    return QualityTarget(args.target, args.target_lag, args.target_rtt / 1000) if args.target else None
+
+
+def add_pass_arguments(parser):
+    """
+    :param parser: ArgumentParser receiving the options of the passes after the scan: sync rate
+                   sampling, throughput, state sync discovery and --watch
+    """
+    parser.add_argument('--sample', type=float, default=0, help='Seconds over which the sync rate of the best candidates is sampled, 0 to disable')
+    parser.add_argument('--sample-interval', type=float, default=DEFAULT_SAMPLE_INTERVAL, help='Seconds between two /status polls of a sampled peer')
+    parser.add_argument('--throughput', action='store_true', help='Download recent blocks from the best candidates and rank them by throughput')
+    parser.add_argument('--throughput-blocks', type=int, default=DEFAULT_BLOCKS, help='Recent blocks downloaded from each candidate')
+    parser.add_argument('--throughput-bytes', type=int, default=DEFAULT_MAX_BYTES, help='Bytes downloaded per run over all candidates')
+    parser.add_argument('--statesync', default=None, help='Test the best RPC servers for state sync and write a [statesync] block to this file')
+    parser.add_argument('--trust-offset', type=int, default=DEFAULT_TRUST_OFFSET, help='Blocks below the tip the state sync trust height is taken at')
+    parser.add_argument('--statesync-servers', type=int, default=DEFAULT_SERVERS, help='RPC servers written to the [statesync] block')
+    parser.add_argument('--watch', action='store_true', help='After the scan, keep the best set current through NewBlock subscriptions until interrupted')
+
+
+def passes_from_args(args, output_filename, top_n, selector=None):
+    """
+    :param args: Parsed arguments of add_pass_arguments() and add_probe_arguments()
+    :param output_filename: PEERS file --watch rewrites
+    :param top_n: Number of connections saved
+    :param selector: Optional DiversitySelector spreading the watched peers over networks
+    :return: Tuple of SyncSampler, ThroughputProbe, StateSyncFinder and BlockWatcher, None for the disabled ones
+    """
+    sampler = SyncSampler(DEFAULT_CANDIDATE_FACTOR * top_n, args.sample, args.sample_interval, args.concurrency) if args.sample else None
+    throughput = ThroughputProbe(DEFAULT_CANDIDATE_FACTOR * top_n, args.throughput_blocks, args.throughput_bytes) if args.throughput else None
+    statesync = StateSyncFinder(args.statesync, trust_offset=args.trust_offset, servers=args.statesync_servers) if args.statesync else None
+    watcher = BlockWatcher(output_filename, top_n, selector=selector) if args.watch else None
+    return sampler, throughput, statesync, watcher
@@ -0,0 +1,453 @@
+import asyncio
+import itertools
+import logging
+import math
+from array import array
+from urllib.parse import urlsplit
+from peerdb import DEFAULT_FRESH_FOR
+from endpoints import parse_peer
+from peers import Peer, PeerTable, pack_ip
+from ranking import LAG_WEIGHT_MS, UNKNOWN_RTT_MS, connection_fields, peer_goodness
+from scheduler import PRIORITY
+from seeds import read_peer_source
+
+# Frontier priority of seeds and of peers learned from endpoints without a score, in score milliseconds
+UNKNOWN_PRIORITY = UNKNOWN_RTT_MS
+
+# Defaults of a QualityTarget: blocks behind the tip and round trip time in seconds
+DEFAULT_TARGET_LAG = 2
+DEFAULT_TARGET_RTT = 0.2
+
+
+def load_peer_list(source, fetcher=None):
+    """
+    Read a peer list separated by commas or newlines from a file or an http(s) URL such as peers.txt,
+    or the peers of an addrbook.json.
+    :param source: File path or URL
+    :param fetcher: Optional PeerListFetcher downloading URLs with conditional requests
+    :return: List of non-empty peer entries
+    """
+    return list(read_peer_source(source, fetcher))
+
+
+async def probe_peer(engine, ip, rpc_port, expand_only=False, expand=False):
+    """
+    Probe one RPC endpoint over a single keep-alive connection.
+    :param engine: ProbeEngine used for the network calls
+    :param ip: IP address
+    :param rpc_port: RPC port
+    :param expand_only: Only fetch /net_info, not /status
+    :param expand: Also fetch /net_info
+    :return: Whether the endpoint accepted the connection, the connection time, the status dictionary or None and the list of its Peers
+    """
+    success, response_time = await engine.check_rpc(ip, rpc_port)
+    if not success:
+        return False, None, None, []
+    try:
+        if expand_only:
+            status, peer_info = None, await engine.get_peer_info(ip, rpc_port)
+        elif expand:
+            # /status and /net_info in one round trip where the endpoint supports batches
+            status, peer_info = await engine.get_status_and_peers(ip, rpc_port)
+        else:
+            status, peer_info = await engine.get_status(ip, rpc_port), []
+    finally:
+        engine.close_host(ip, rpc_port)
+    return True, response_time, status, peer_info
+
+
+class QualityTarget:
+    """
+    Stop condition of a crawl: enough peers close to the tip with a low latency.
+    Peers are counted as they are reached; the count is only rebuilt when a higher
+    tip is seen, which happens a few times per crawl.
+    """
+
+    def __init__(self, count, max_lag=DEFAULT_TARGET_LAG, max_rtt=DEFAULT_TARGET_RTT):
+        """
+        :param count: Number of good peers after which the crawl stops
+        :param max_lag: Blocks a good peer may be behind the highest height seen
+        :param max_rtt: Round trip time in seconds a good peer may not exceed
+        """
+        self.count = count
+        self.max_lag = max_lag
+        self.max_rtt = max_rtt
+        self.tip = 0
+        self.good = 0
+        # Heights of the fast peers not catching up that may still be close enough to the tip
+        self._heights = []
+
+    @property
+    def met(self):
+        return self.good >= self.count
+
+    def add(self, height, rtt, catching_up=False):
+        """
+        Count a reached peer.
+        :param height: Latest block height
+        :param rtt: Round trip time in seconds or None if unknown
+        :param catching_up: Whether the peer reports catching_up
+        :return: Whether the target is met
+        """
+        if height > self.tip:
+            self.tip = height
+            self._heights = [h for h in self._heights if h >= height - self.max_lag]
+            self.good = len(self._heights)
+        if rtt is not None and rtt <= self.max_rtt and not catching_up and height >= self.tip - self.max_lag:
+            self._heights.append(height)
+            self.good += 1
+        return self.met
+
+
+class Crawler:
+    """
+    Best-first crawl of the peer graph through /net_info.
+    Peers are taken from a frontier priority queue by a pool of workers, so probing
+    and expanding run at the same time. Peers learned from a node are prioritised by
+    the score of that node, so the neighbourhood of peers at tip with a low latency
+    is explored first; with a QualityTarget the crawl stops as soon as enough good
+    peers were found. Every endpoint is probed at most once: the
+    frontier is deduplicated on node ID and on both the RPC and P2P ip:port.
+    Peers live in a PeerTable and the frontier and result lists only hold row
+    indices; id@ip:port strings are built when a result is written out.
+    """
+
+    def __init__(self, engine, max_depth=1, max_peers=None, db=None, fresh_for=DEFAULT_FRESH_FOR, stream=None, target=None):
+        """
+        :param engine: ProbeEngine used for all network calls
+        :param max_depth: Number of /net_info hops to expand from the seeds
+        :param max_peers: Maximum number of peers admitted to the frontier, None for no limit
+        :param db: Optional PeerDB, its known peers are seeds and fresh entries are not probed again
+        :param fresh_for: Freshness window in seconds for entries of the database
+        :param stream: Optional StreamingOutput receiving every result as soon as it is known
+        :param target: Optional QualityTarget, the crawl stops once it is met
+        """
+        self.engine = engine
+        self.max_depth = max_depth
+        self.max_peers = max_peers
+        self.db = db
+        self.fresh_for = fresh_for
+        self.stream = stream
+        self.target = target
+        self.table = PeerTable()
+        # Binary node IDs and packed endpoint keys already admitted, they never compare equal
+        # so one set serves both and costs less than two
+        self.seen = set()
+        # Row indices of the reached and unreachable peers, in the order they were probed
+        self.successful = array('L')
+        self.failed = array('L')
+        self.admitted = 0
+        self.visited = 0
+        self.cached = 0
+        # Peers listed by host name whose address was already probed
+        self.duplicates = 0
+        # Row index -> address of the peers listed by host name
+        self.resolved = {}
+        # Whether the crawl was stopped by the deadline of the engine
+        self.expired = False
+        # Whether the crawl was stopped because the target was met
+        self.satisfied = False
+        # Highest block height seen, the scores of the frontier are relative to it
+        self.tip = 0
+        # Number of peers visited at the same time
+        self.parallel = engine.concurrency
+        self._seeds = []
+        self._queue = None
+        self._done = None
+        # Tie-breaker keeping the frontier first in, first out within one priority
+        self._order = itertools.count()
+
+    @property
+    def successful_connections(self):
+        """
+        :return: List of (peer, block height, rtt, catching_up, failure rate) tuples
+        """
+        return [self.table.connection(i) for i in self.successful]
+
+    def rpc_endpoints(self):
+        """
+        :return: Dictionary of id@ip:port -> (ip, rpc_port) of the peers that were reached
+        """
+        endpoints = {}
+        for i in self.successful:
+            peer = self.table.peer(i)
+            endpoints[peer.key] = (self.resolved.get(i, peer.address), peer.rpc_port)
+        return endpoints
+
+    @property
+    def failed_connections(self):
+        """
+        :return: List of id@ip:port of the peers that could not be reached
+        """
+        return [self.table.key(i) for i in self.failed]
+
+    def add_seed(self, line):
+        """
+        Add a peer entry of the form id@host:port, see endpoints.parse_peer(). Its RPC port is assumed to be port + 1.
+        :param line: Peer entry
+        :return: Whether the entry could be parsed
+        """
+        split = parse_peer(line)
+        if split is None or split[0] is None:
+            return False
+        node_id, host, port = split
+        peer = Peer.parse(node_id, host, port + 1, port)
+        if peer is None:
+            return False
+        self._seeds.append((peer, False))
+        return True
+
+    def add_peer(self, peer):
+        """
+        Add a peer whose RPC port is known, e.g. from an earlier crawl.
+        :param peer: Peer, None is ignored
+        :return: Whether the peer was added
+        """
+        if peer is None:
+            return False
+        self._seeds.append((peer, False))
+        return True
+
+    def add_rpc_seed(self, ip, rpc_port):
+        """
+        Add an RPC endpoint, e.g. the local node, that is only expanded and not ranked itself.
+        :param ip: IP address or host name
+        :param rpc_port: RPC port
+        :return: Whether the endpoint is valid
+        """
+        peer = Peer.parse(None, ip, rpc_port) if ip else None
+        if peer is None:
+            logging.warning(f"Ignoring invalid RPC endpoint {ip}:{rpc_port}.")
+            return False
+        self._seeds.append((peer, True))
+        return True
+
+    def add_rpc_url(self, rpc_url):
+        """
+        Add an RPC endpoint given as URL, see add_rpc_seed().
+        :param rpc_url: RPC URL, e.g. http://localhost:26657, the port defaults to 26657
+        :return: Whether the URL is valid
+        """
+        url = urlsplit(rpc_url)
+        try:
+            rpc_port = url.port or 26657
+        except ValueError:
+            logging.warning(f"Ignoring RPC URL {rpc_url} with an invalid port.")
+            return False
+        if not url.hostname:
+            logging.warning(f"Ignoring RPC URL {rpc_url} without a host.")
+            return False
+        return self.add_rpc_seed(url.hostname, rpc_port)
+
+    def _admit(self, peer, expand_only, depth, priority=UNKNOWN_PRIORITY):
+        """
+        Put a peer on the frontier unless it was already seen or the peer budget is spent.
+        :param peer: Peer
+        :param expand_only: Only expand the peer, do not rank it
+        :param depth: Number of /net_info hops from the seeds
+        :param priority: Frontier priority, lower is probed first
+        :return: Whether the peer was admitted
+        """
+        if self.expired or self.satisfied:
+            return False
+        seen = self.seen
+        if peer.node_id is not None and peer.node_id in seen:
+            return False
+        endpoints = peer.endpoints()
+        for endpoint in endpoints:
+            if endpoint in seen:
+                return False
+        if self.max_peers is not None and self.admitted >= self.max_peers:
+            return False
+        if peer.node_id is not None:
+            seen.add(peer.node_id)
+        seen.update(endpoints)
+        self.admitted += 1
+        self._queue.put_nowait((priority, next(self._order), self.table.add(peer, depth, expand_only)))
+        return True
+
+    def _priority(self, index):
+        """
+        :param index: Row index of a reached peer
+        :return: Frontier priority of the peers it announced: its score against the current tip
+        """
+        if self.table.expand_only(index):
+            return UNKNOWN_PRIORITY
+        conn = connection_fields(self.table.connection(index))
+        return self.tip * LAG_WEIGHT_MS - peer_goodness(*conn[1:])
+
+    def _reached(self, index):
+        """
+        Record a peer that was reached with a block height and stop the crawl if the target is met.
+        :param index: Row index
+        """
+        self.successful.append(index)
+        table = self.table
+        height = table.heights[index]
+        self.tip = max(self.tip, height)
+        if self.target is not None and not self.satisfied:
+            _, _, rtt, catching_up = table.connection(index)[:4]
+            if self.target.add(height, rtt, catching_up):
+                self.satisfied = True
+                logging.info(f"Found {self.target.good} peers within {self.target.max_lag} blocks of tip under {self.target.max_rtt * 1000:.0f}ms "
+                             f"after {self.visited + 1} peers, stopping the crawl.")
+                self._done.set()
+
+    async def crawl(self):
+        """
+        Crawl from the seeds until the frontier is empty, the target is met or the deadline of the engine expires.
+        :return: List of (peer, block height, rtt, catching_up, failure rate) tuples
+        """
+        self._queue = asyncio.PriorityQueue()
+        self._done = asyncio.Event()
+        for peer, expand_only in self._seeds:
+            # RPC seeds are only there to be expanded, so they go first
+            self._admit(peer, expand_only, 0, -1 if expand_only else UNKNOWN_PRIORITY)
+        if self.db is not None:
+            for row in self.db.peers():
+                if row['node_id'] and row['rpc_port']:
+                    peer = Peer.parse(row['node_id'], row['ip'], row['rpc_port'], row['p2p_port'])
+                    if peer is not None:
+                        self._admit(peer, False, 0)
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.parallel)]
+        joined = asyncio.ensure_future(self._queue.join())
+        done = asyncio.ensure_future(self._done.wait())
+        try:
+            await asyncio.wait([joined, done], timeout=self.engine.remaining(), return_when=asyncio.FIRST_COMPLETED)
+            if not joined.done():
+                # Out of time or good enough, drop the frontier and the probes in flight and keep what was found
+                if not self.satisfied:
+                    self.expired = True
+                    logging.warning(f"Deadline of {self.engine.deadline}s reached after {self.visited} peers, {self._queue.qsize()} left in the frontier.")
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                # Stop the workers with sentinels as well, behind any item still being put
+                for _ in workers:
+                    self._queue.put_nowait((math.inf, next(self._order), None))
+        finally:
+            joined.cancel()
+            done.cancel()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        return self.successful_connections
+
+    def run(self):
+        """
+        Blocking wrapper around crawl() for the command line tools.
+        :return: List of (peer, block height, rtt, catching_up, failure rate) tuples
+        """
+        return self.engine.run_async(self.crawl())
+
+    async def _worker(self):
+        while True:
+            priority, _, item = await self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            # The network operations of the peer are scheduled with its frontier priority
+            PRIORITY.set(priority)
+            try:
+                await self._visit(item)
+            except Exception as e:
+                logging.error(f"Failed to crawl {self.table.key(item)}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _visit(self, index):
+        table = self.table
+        peer = table.peer(index)
+        ip, node_id, rpc_port, p2p_port = peer.address, peer.id_hex, peer.rpc_port, peer.p2p_port
+        expand_only = table.expand_only(index)
+        depth = table.hops[index]
+        if isinstance(peer.ip, str):
+            ip = await self._resolve(index, peer)
+            if ip is None:
+                self.visited += 1
+                return
+        db = self.db if not expand_only else None
+        if db is not None and not db.needs_probe(ip, p2p_port, self.fresh_for):
+            # Probed recently, reuse the stored result without expanding again
+            alive, block_height, response_time = db.cached_result(ip, p2p_port)
+            if alive and block_height is not None:
+                median_rtt, catching_up, failure_rate = db.history(ip, p2p_port)
+                table.set_result(index, block_height, median_rtt, catching_up, failure_rate)
+                self._reached(index)
+            elif not alive:
+                self.failed.append(index)
+            self._emit(index, alive and block_height is not None, ok=alive, cached=True, height=block_height, rtt=response_time)
+            self.cached += 1
+            self.visited += 1
+            return
+        # One keep-alive connection serves the check, /status and /net_info
+        expand = depth < self.max_depth
+        success, response_time, status, peer_info = await self._probe(ip, rpc_port, expand_only, expand)
+        if not success:
+            if not expand_only:
+                self.failed.append(index)
+                self._emit(index, ok=False)
+            if db is not None:
+                db.record_failure(ip, p2p_port, node_id, rpc_port)
+        else:
+            block_height = None
+            if not expand_only:
+                status = status or {}
+                block_height = status.get('height')
+                if db is not None:
+                    db.record_success(ip, p2p_port, node_id, rpc_port, status.get('moniker'), block_height, response_time, status.get('catching_up'))
+                if block_height is not None:
+                    logging.info(f"block_height {status['moniker']}   {ip}:{rpc_port} with {block_height}")
+                    if db is not None:
+                        # Median latency and failure rate over the stored history
+                        table.set_result(index, block_height, *db.history(ip, p2p_port))
+                    else:
+                        table.set_result(index, block_height, response_time, status['catching_up'])
+                    self._reached(index)
+                self._emit(index, block_height is not None, ok=block_height is not None, rtt=response_time, **status)
+            if expand and (expand_only or block_height is not None):
+                priority = self._priority(index)
+                for remote in peer_info:
+                    self._admit(remote, False, depth + 1, priority)
+        self.visited += 1
+        logging.info(f"Processed {self.visited}/{self.admitted} entries, hop {depth}, {self._queue.qsize()} in frontier.")
+
+    async def _resolve(self, index, peer):
+        """
+        Resolve a peer listed by host name, unless its address was already admitted.
+        :param index: Row index
+        :param peer: Peer of the row
+        :return: Address to probe, or None if the peer is not probed
+        """
+        ip = await self.engine.resolve(peer.address)
+        if ip is None:
+            logging.warning(f"Could not resolve {peer.address}.")
+            if not self.table.expand_only(index):
+                self.failed.append(index)
+                self._emit(index, ok=False, error='unresolvable')
+            return None
+        endpoints = Peer(peer.node_id, pack_ip(ip), peer.rpc_port, peer.p2p_port).endpoints()
+        if any(endpoint in self.seen for endpoint in endpoints):
+            logging.info(f"{peer.address} resolves to {ip}, which is already probed.")
+            self.duplicates += 1
+            return None
+        self.seen.update(endpoints)
+        self.resolved[index] = ip
+        return ip
+
+    async def _probe(self, ip, rpc_port, expand_only, expand):
+        return await probe_peer(self.engine, ip, rpc_port, expand_only, expand)
+
+    def _emit(self, index, reached=False, **fields):
+        """
+        Write one result to the stream, if any.
+        :param index: Row index of the peer
+        :param reached: Whether the peer is ranked with its connection tuple
+        :param fields: Probe result fields of the record
+        """
+        if self.stream is None:
+            return
+        peer = self.table.peer(index)
+        record = {'peer': peer.key, 'ip': peer.address, 'rpc_port': peer.rpc_port, 'p2p_port': peer.p2p_port, 'hop': self.table.hops[index]}
+        record.update(fields)
+        self.stream.add(record, self.table.connection(index) if reached else None)
@@ -0,0 +1,184 @@
+import asyncio
+import re
+import socket
+import time
+from collections import OrderedDict
+
+# Seconds a resolved host name is reused; getaddrinfo() does not report the TTL of the records
+DEFAULT_DNS_TTL = 300
+
+# Seconds a host name that did not resolve is not looked up again
+DEFAULT_NEGATIVE_DNS_TTL = 30
+
+# Host names cached, the least recently resolved are forgotten first
+MAX_CACHED_HOSTS = 65536
+
+# One label of a host name: letters, digits and inner hyphens, at most 63 characters
+HOST_LABEL = re.compile(r'(?!-)[a-z0-9_-]{1,63}(?<!-)$')
+
+# Entries of a peer list are separated by commas, whitespace or both
+PEER_LIST_SEPARATOR = re.compile(r'[,\s]+')
+
+
+def is_ip(host):
+    """
+    :param host: Host string
+    :return: 4 or 6 for an IPv4 or IPv6 address literal, None for anything else
+    """
+    for family, version in ((socket.AF_INET, 4), (socket.AF_INET6, 6)):
+        try:
+            socket.inet_pton(family, host)
+            return version
+        except OSError:
+            pass
+    return None
+
+
+def valid_hostname(host):
+    """
+    :param host: Lower case host name without a trailing dot
+    :return: Whether the name is a syntactically valid DNS name that is not an IPv4-like number
+    """
+    if not host or len(host) > 253:
+        return False
+    labels = host.split('.')
+    # A dotted all-numeric name is a malformed IPv4 address, not a host name
+    if labels[-1].isdigit():
+        return False
+    return all(HOST_LABEL.match(label) for label in labels)
+
+
+def split_host_port(address):
+    """
+    Split host:port, with the host an IPv4 address, an IPv6 address in brackets or a host name.
+    An IPv6 address without brackets is rejected, its port cannot be told apart.
+    :param address: Address string
+    :return: Tuple of (host, port) with host names in lower case, or None if the address is invalid
+    """
+    if address.startswith('['):
+        host, bracket, port = address[1:].partition(']')
+        if not bracket or not port.startswith(':') or is_ip(host) != 6:
+            return None
+        port = port[1:]
+    else:
+        host, colon, port = address.rpartition(':')
+        if not colon or ':' in host:
+            return None
+        if is_ip(host) is None:
+            host = host.lower().rstrip('.')
+            if not valid_hostname(host):
+                return None
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        return None
+    return host, int(port)
+
+
+def parse_peer(entry):
+    """
+    Parse a peer entry of the form [id@]host:port, e.g. from peers.txt or persistent_peers.
+    Surrounding whitespace and a tcp:// scheme are ignored.
+    :param entry: Peer entry
+    :return: Tuple of (node ID or None, host, port), or None if the entry is invalid
+    """
+    entry = entry.strip()
+    if entry.startswith('tcp://'):
+        entry = entry[6:]
+    node_id, at, address = entry.rpartition('@')
+    if at and not node_id:
+        return None
+    address = split_host_port(address)
+    if address is None:
+        return None
+    return (node_id if at else None,) + address
+
+
+def format_host_port(host, port):
+    """
+    :param host: IP address or host name
+    :param port: Port number
+    :return: host:port, with IPv6 addresses in brackets
+    """
+    return f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+
+def split_peer_list(text):
+    """
+    :param text: Peer list separated by commas, whitespace or newlines
+    :return: List of the non-empty entries
+    """
+    return [entry for entry in PEER_LIST_SEPARATOR.split(text) if entry]
+
+
+class DnsCache:
+    """
+    Resolve host names on the event loop and keep the answers for a TTL.
+    Concurrent lookups of one name share a single getaddrinfo() call and failures
+    are cached for a shorter time, so a list with many entries of the same host costs
+    one resolver round trip. Address literals are returned without a lookup.
+    """
+
+    def __init__(self, ttl=DEFAULT_DNS_TTL, negative_ttl=DEFAULT_NEGATIVE_DNS_TTL):
+        """
+        :param ttl: Seconds a resolved name is reused
+        :param negative_ttl: Seconds a name that did not resolve is not looked up again
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.lookups = 0
+        # Host -> (time.monotonic() it expires, tuple of addresses)
+        self._entries = OrderedDict()
+        # Host -> task of the lookup in flight
+        self._pending = {}
+
+    def reset(self):
+        """
+        Forget the lookups in flight of a finished event loop; the cached answers are kept.
+        """
+        self._pending = {}
+
+    def cached(self, host):
+        """
+        :param host: Host name or IP address
+        :return: Whether resolve() answers without a lookup
+        """
+        if is_ip(host):
+            return True
+        entry = self._entries.get(host)
+        return entry is not None and entry[0] > time.monotonic()
+
+    async def resolve(self, host):
+        """
+        :param host: Host name or IP address
+        :return: Tuple of the addresses of the host, IPv4 first, empty if it does not resolve
+        """
+        if is_ip(host):
+            return (host,)
+        entry = self._entries.get(host)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        task = self._pending.get(host)
+        if task is None:
+            task = self._pending[host] = asyncio.ensure_future(self._lookup(host))
+        # A cancelled caller does not cancel the lookup other callers wait for
+        return await asyncio.shield(task)
+
+    async def _lookup(self, host):
+        self.lookups += 1
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+            addresses = tuple(sorted(dict.fromkeys(info[4][0] for info in infos), key=lambda ip: ':' in ip))
+        except (OSError, UnicodeError):
+            addresses = ()
+        finally:
+            self._pending.pop(host, None)
+        self._entries[host] = (time.monotonic() + (self.ttl if addresses else self.negative_ttl), addresses)
+        self._entries.move_to_end(host)
+        if len(self._entries) > MAX_CACHED_HOSTS:
+            self._entries.popitem(last=False)
+        return addresses
+
+
+# Shared by all probe engines of a process, so names resolved by one scan are reused by the next
+SHARED_DNS_CACHE = DnsCache()
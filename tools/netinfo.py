@@ -0,0 +1,192 @@
+import codecs
+import json
+import logging
+import re
+from peers import Peer
+
+# Largest /net_info response read, the peers found up to this point are kept
+MAX_NET_INFO_BYTES = 16 * 1024 * 1024
+
+# Characters of one peer entry after which its end is no longer waited for
+MAX_PEER_CHARS = 256 * 1024
+
+# Characters a short token may still be missing because it is in transit
+LOOKAHEAD = 256
+
+# Characters kept while looking for the peers array, enough for its key split across two reads
+SEEK_OVERLAP = 64
+
+PEERS_START = re.compile(r'"peers"\s*:\s*\[')
+PEER_START = re.compile(r'\s*\{\s*"node_info"\s*:\s*')
+ARRAY_END = re.compile(r'\s*\]')
+SEPARATOR = re.compile(r'\s*([,\]])')
+# remote_ip is the last field of a CometBFT peer entry
+REMOTE_IP = re.compile(r'"remote_ip"\s*:\s*"([^"\\]*)"\s*\}')
+
+# Parser states of NetInfoExtractor
+SEEK, PEERS, AFTER, PASS, SKIP = range(5)
+
+_decoder = json.JSONDecoder()
+
+
+def peer_from_node_info(node_info, remote_ip):
+    """
+    Build a Peer from the fields of one /net_info peer entry.
+    :param node_info: Decoded node_info object of the entry
+    :param remote_ip: remote_ip of the entry
+    :return: Peer, or None if the entry is invalid
+    """
+    try:
+        rpc_port = int(node_info["other"]["rpc_address"].split(":")[-1])
+        p2p_port = int(node_info["listen_addr"].split(":")[-1])
+        node_id = node_info["id"]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        logging.error(f"Invalid RPC or p2p port received for peer at {remote_ip}. Skipping.")
+        return None
+    peer = Peer.parse(node_id, remote_ip, rpc_port, p2p_port)
+    if peer is None:
+        logging.error(f"Invalid node ID or port received for peer at {remote_ip}. Skipping.")
+    return peer
+
+
+class NetInfoExtractor:
+    """
+    Incremental parser of a /net_info response, or of a JSON-RPC batch containing one.
+    It is fed the body as it arrives and decodes only the node_info and remote_ip of
+    every peer, skipping the connection_status blocks that make up most of the bytes.
+    Text outside the peers array is kept as the residual, the document with an empty
+    peers list, so the rest of a batch can still be decoded. A response whose first
+    entry is not laid out like CometBFT's, node_info first and remote_ip last, is
+    passed through whole for a full parse.
+    """
+
+    def __init__(self):
+        self.peers = []
+        # Whether the peers were taken from the stream, else the residual is the whole body
+        self.extracted = False
+        # Whether the whole body was seen and the residual is a complete document
+        self.complete = False
+        self._utf8 = codecs.getincrementaldecoder('utf-8')('replace')
+        self._state = SEEK
+        self._text = ''
+        self._pos = 0
+        self._residual = []
+        # Decoded node_info and its end position while the rest of the entry is in transit
+        self._node_info = None
+        self._expect_separator = False
+
+    @property
+    def residual(self):
+        return ''.join(self._residual)
+
+    def feed(self, chunk):
+        """
+        Parse the next part of the body.
+        :param chunk: Body bytes
+        """
+        self._feed(self._utf8.decode(chunk), final=False)
+
+    def close(self, complete=True):
+        """
+        Finish parsing.
+        :param complete: Whether the whole body was fed, False if it was cut
+        """
+        self._feed(self._utf8.decode(b'', True), final=True)
+        if self._state == SEEK:
+            self._residual.append(self._text)
+        self._text = ''
+        self.complete = complete and self._state in (SEEK, AFTER, PASS)
+
+    def _feed(self, text, final):
+        if self._state in (AFTER, PASS):
+            self._residual.append(text)
+            return
+        if self._state == SKIP:
+            return
+        # Drop what was consumed, positions are relative to the start of the text
+        pos = self._pos
+        self._text = self._text[pos:] + text
+        self._pos = 0
+        if self._node_info is not None:
+            self._node_info = (self._node_info[0], self._node_info[1] - pos)
+        if self._state == SEEK:
+            self._seek()
+        if self._state == PEERS:
+            self._peers(final)
+
+    def _seek(self):
+        text = self._text
+        match = PEERS_START.search(text)
+        if match is None:
+            keep = max(0, len(text) - SEEK_OVERLAP)
+            self._residual.append(text[:keep])
+            self._text = text[keep:]
+            return
+        self._residual.append(text[:match.end()])
+        self._pos = match.end()
+        self._state = PEERS
+
+    def _peers(self, final):
+        text = self._text
+        while True:
+            pos = self._pos
+            if self._node_info is None:
+                if self._expect_separator:
+                    match = SEPARATOR.match(text, pos)
+                    if match is None:
+                        return self._stuck(final, len(text) - pos < LOOKAHEAD)
+                    if match.group(1) == ']':
+                        return self._end_array(match.end())
+                    self._pos = match.end()
+                    self._expect_separator = False
+                    continue
+                match = ARRAY_END.match(text, pos)
+                if match is not None:
+                    return self._end_array(match.end())
+                match = PEER_START.match(text, pos)
+                if match is None:
+                    return self._stuck(final, len(text) - pos < LOOKAHEAD)
+                try:
+                    self._node_info = _decoder.raw_decode(text, match.end())
+                except ValueError:
+                    return self._stuck(final, len(text) - pos < MAX_PEER_CHARS)
+            node_info, end = self._node_info
+            # connection_status is skipped by searching for the remote_ip that closes the entry
+            match = REMOTE_IP.search(text, end)
+            next_entry = text.find('"node_info"', end)
+            if match is None or (next_entry != -1 and next_entry < match.start()):
+                return self._stuck(final, match is None and next_entry == -1 and len(text) - end < MAX_PEER_CHARS)
+            peer = peer_from_node_info(node_info, match.group(1))
+            if peer is not None:
+                self.peers.append(peer)
+            self.extracted = True
+            self._node_info = None
+            self._expect_separator = True
+            self._pos = match.end()
+
+    def _end_array(self, end):
+        self._residual.append(']')
+        self._residual.append(self._text[end:])
+        self._text = ''
+        self._pos = 0
+        self._state = AFTER
+
+    def _stuck(self, final, waiting):
+        """
+        Handle input the parser cannot continue with.
+        :param final: Whether no more input follows
+        :param waiting: Whether the input may just be incomplete
+        """
+        if waiting and not final:
+            return
+        if not self.extracted:
+            # Nothing consumed yet, hand the whole document to the full parser
+            self._residual.append(self._text[self._pos:])
+            self._state = PASS
+        else:
+            if not waiting:
+                logging.warning(f"Unexpected /net_info layout after {len(self.peers)} peers, ignoring the rest.")
+            self._state = SKIP
+        self._text = ''
+        self._pos = 0
+        self._node_info = None
@@ -0,0 +1,413 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import statistics
+import struct
+import time
+from collections import deque
+from output import write_atomic
+from ranking import connection_fields, rank_connections
+
+# Appended to the handshake key by the server, RFC 6455 section 1.3
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Query of the subscription; NewBlockHeader fires with every NewBlock but without the transactions
+NEW_BLOCK_QUERY = "tm.event='NewBlockHeader'"
+
+# Largest WebSocket message read, larger messages close the subscription
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+
+# Seconds to connect, upgrade and subscribe
+DEFAULT_HANDSHAKE_TIMEOUT = 5
+
+# Seconds between two checks of the watched peers
+DEFAULT_CHECK_INTERVAL = 5
+
+# Block times without a new block after which a watched peer counts as stalled
+STALL_BLOCKS = 5
+
+# Lower bound of the stall timeout in seconds, also used while the block time is unknown
+MIN_STALL_SECONDS = 30
+
+# Blocks a watched peer may fall behind the highest height seen before it is replaced
+MAX_WATCH_LAG = 5
+
+# Seconds before a replaced peer may be watched again
+RETRY_AFTER = 300
+
+# Block intervals kept per watched peer to estimate the block time
+INTERVAL_SAMPLES = 20
+
+# WebSocket opcodes
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0, 1, 2, 8, 9, 10
+
+
+def websocket_accept(key):
+    """
+    :param key: Sec-WebSocket-Key of the handshake
+    :return: Sec-WebSocket-Accept the server has to answer with
+    """
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+
+
+def mask_payload(payload, mask):
+    """
+    XOR a payload with a 4 byte mask, in one big int operation instead of a byte loop.
+    :param payload: Payload bytes
+    :param mask: 4 byte mask
+    :return: Masked, or unmasked, payload
+    """
+    size = len(payload)
+    if not size:
+        return payload
+    key = (mask * (size // 4 + 1))[:size]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(size, 'big')
+
+
+async def read_head(reader):
+    """
+    Read the status line and headers of an HTTP response.
+    :param reader: asyncio StreamReader
+    :return: Tuple of (status code, dictionary of lower-case header names to values)
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise asyncio.IncompleteReadError(b'', None)
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+class WebSocket:
+    """
+    Minimal RFC 6455 client: masked text frames out, fragmented messages, ping and
+    close in, no extensions.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port, path='/websocket', timeout=DEFAULT_HANDSHAKE_TIMEOUT):
+        """
+        Open a connection and upgrade it to a WebSocket.
+        :param host: IP address or host name
+        :param port: Port number
+        :param path: Request path of the endpoint
+        :param timeout: Timeout in seconds for the connection and the upgrade
+        :return: Open WebSocket
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+            status, headers = await asyncio.wait_for(read_head(reader), timeout)
+            if status != 101 or headers.get('sec-websocket-accept') != websocket_accept(key):
+                raise ValueError(f"WebSocket upgrade refused with status {status}")
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer)
+
+    def send(self, payload, opcode=OP_TEXT):
+        """
+        Queue one frame, masked as required for clients.
+        :param payload: Text or bytes
+        :param opcode: Frame opcode
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        size = len(payload)
+        if size < 126:
+            head = struct.pack('!BB', 0x80 | opcode, 0x80 | size)
+        elif size < 65536:
+            head = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, size)
+        else:
+            head = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, size)
+        mask = os.urandom(4)
+        self.writer.write(head + mask + mask_payload(payload, mask))
+
+    async def receive(self):
+        """
+        Read the next message, answering pings on the way.
+        :return: Message text
+        """
+        fragments = []
+        size = 0
+        while True:
+            head = await self.reader.readexactly(2)
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            mask = await self.reader.readexactly(4) if head[1] & 0x80 else None
+            if opcode < OP_CLOSE:
+                size += length
+                if size > MAX_MESSAGE_BYTES:
+                    raise ValueError(f"WebSocket message larger than {MAX_MESSAGE_BYTES} bytes")
+            payload = await self.reader.readexactly(length)
+            if mask is not None:
+                payload = mask_payload(payload, mask)
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+                await self.writer.drain()
+            elif opcode == OP_CLOSE:
+                raise ConnectionError("WebSocket closed by the server")
+            elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+                fragments.append(payload)
+                if head[0] & 0x80:
+                    return b''.join(fragments).decode('utf-8', 'replace')
+
+    def close(self):
+        try:
+            self.send(b'', OP_CLOSE)
+        except (OSError, RuntimeError):
+            pass
+        self.writer.close()
+
+
+async def subscribe_new_blocks(host, port, timeout=DEFAULT_HANDSHAKE_TIMEOUT):
+    """
+    Open a /websocket subscription to the new blocks of a CometBFT node.
+    :param host: IP address or host name
+    :param port: RPC port
+    :param timeout: Timeout in seconds for the connection, the upgrade and the subscription
+    :return: WebSocket receiving the events
+    """
+    ws = await WebSocket.connect(host, port, timeout=timeout)
+    try:
+        ws.send(json.dumps({'jsonrpc': '2.0', 'method': 'subscribe', 'id': 0, 'params': {'query': NEW_BLOCK_QUERY}}))
+        reply = json.loads(await asyncio.wait_for(ws.receive(), timeout))
+        if reply.get('error'):
+            raise ValueError(f"Subscription refused: {reply['error'].get('message', reply['error'])}")
+    except BaseException:
+        ws.close()
+        raise
+    return ws
+
+
+def event_height(message):
+    """
+    :param message: Text of a subscription message
+    :return: Height of the block of a NewBlock or NewBlockHeader event, None for other messages
+    """
+    try:
+        value = json.loads(message)['result']['data']['value']
+        header = value['header'] if 'header' in value else value['block']['header']
+        return int(header['height'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class WatchedPeer:
+    """
+    Subscription state of one peer of the best set.
+    """
+    __slots__ = ('conn', 'endpoint', 'height', 'events', 'last_block', 'intervals', 'task', 'ws', 'error')
+
+    def __init__(self, conn, endpoint):
+        self.conn = conn
+        self.endpoint = endpoint
+        # Height of the snapshot until the first event arrives
+        self.height = conn[1]
+        self.events = 0
+        self.last_block = time.monotonic()
+        self.intervals = deque(maxlen=INTERVAL_SAMPLES)
+        self.task = None
+        self.ws = None
+        self.error = None
+
+    def connection(self):
+        """
+        :return: Connection tuple with the latest height seen
+        """
+        return (self.conn[0], self.height) + connection_fields(self.conn)[2:]
+
+
+class BlockWatcher:
+    """
+    Keep the best peer set current through NewBlock subscriptions instead of new scans.
+    The best peers of a scan get a /websocket subscription each and their heights are
+    tracked from the events, so no peer is polled. A peer whose events stop, that
+    falls behind the highest height seen or whose subscription fails is replaced by
+    the next candidate of the scan, and the output file is rewritten whenever the set
+    changes. Replaced peers go back to the candidates after RETRY_AFTER seconds.
+    With a DiversitySelector the candidates that fit the network caps are watched first.
+    """
+
+    def __init__(self, output_filename, top_n, check_interval=DEFAULT_CHECK_INTERVAL, handshake_timeout=DEFAULT_HANDSHAKE_TIMEOUT, selector=None):
+        """
+        :param output_filename: PEERS file rewritten whenever the best set changes
+        :param top_n: Number of peers watched
+        :param check_interval: Seconds between two checks of the watched peers
+        :param handshake_timeout: Timeout in seconds for opening a subscription
+        :param selector: Optional DiversitySelector spreading the watched peers over networks
+        """
+        self.output_filename = output_filename
+        self.top_n = top_n
+        self.check_interval = check_interval
+        self.handshake_timeout = handshake_timeout
+        self.selector = selector
+        self.watched = {}
+        self.candidates = deque()
+        # (time, connection tuple, endpoint) of replaced peers, oldest first
+        self.benched = deque()
+        self.tip = 0
+        self.replaced = 0
+
+    def run(self, connections, endpoints, duration=None):
+        """
+        Watch until interrupted or for the given duration.
+        :param connections: List of connection tuples of the scan
+        :param endpoints: Dictionary of peer -> (ip, rpc_port), peers without an entry are not watched
+        :param duration: Optional seconds to watch for
+        :return: List of connection tuples, the watched peers with their latest heights first
+        """
+        try:
+            asyncio.run(self.watch(connections, endpoints, duration))
+        except KeyboardInterrupt:
+            logging.info("Stopped watching.")
+        watched = [peer.connection() for peer in self.watched.values()]
+        keys = set(self.watched)
+        self.watched = {}
+        return watched + [conn for conn in connections if conn[0] not in keys]
+
+    async def watch(self, connections, endpoints, duration=None):
+        """
+        :param connections: List of connection tuples of the scan
+        :param endpoints: Dictionary of peer -> (ip, rpc_port)
+        :param duration: Optional seconds to watch for
+        """
+        ranked = rank_connections(connections, len(connections)).best()
+        self.candidates = deque((conn, endpoints[conn[0]]) for conn in ranked if conn[0] in endpoints)
+        self.tip = max((conn[1] for conn in ranked), default=0)
+        changed = asyncio.Event()
+        end = None if duration is None else time.monotonic() + duration
+        logging.info(f"Watching the best {self.top_n} of {len(self.candidates)} peers through NewBlock subscriptions.")
+        try:
+            self._fill(changed)
+            self._write()
+            while end is None or time.monotonic() < end:
+                timeout = self.check_interval if end is None else min(self.check_interval, max(0.0, end - time.monotonic()))
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                changed.clear()
+                replaced = self._check()
+                if self._fill(changed) or replaced:
+                    self._write()
+        finally:
+            for peer in self.watched.values():
+                self._stop(peer)
+
+    async def _follow(self, peer, changed):
+        """
+        Subscribe to one peer and track its height until the subscription ends.
+        :param peer: WatchedPeer
+        :param changed: Event set when the subscription fails
+        """
+        ip, rpc_port = peer.endpoint
+        try:
+            peer.ws = await subscribe_new_blocks(ip, rpc_port, self.handshake_timeout)
+            while True:
+                height = event_height(await peer.ws.receive())
+                # The snapshot height may be old, the first event replaces it unconditionally
+                if height is None or (peer.events and height <= peer.height):
+                    continue
+                now = time.monotonic()
+                if peer.events:
+                    peer.intervals.append((now - peer.last_block) / (height - peer.height))
+                peer.height = height
+                peer.events += 1
+                peer.last_block = now
+                if height > self.tip:
+                    self.tip = height
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            peer.error = f"subscription failed: {e.__class__.__name__} {e}".strip()
+            changed.set()
+
+    def block_time(self):
+        """
+        :return: Median seconds per block over the watched peers, None while unknown
+        """
+        intervals = [interval for peer in self.watched.values() for interval in peer.intervals]
+        return statistics.median(intervals) if len(intervals) >= 3 else None
+
+    def _check(self):
+        """
+        Replace watched peers that stalled, fell behind or lost their subscription.
+        :return: Whether the set changed
+        """
+        now = time.monotonic()
+        block_time = self.block_time()
+        stall_after = MIN_STALL_SECONDS if block_time is None else max(MIN_STALL_SECONDS, STALL_BLOCKS * block_time)
+        changed = False
+        for key, peer in list(self.watched.items()):
+            reason = peer.error
+            if reason is None and now - peer.last_block > stall_after:
+                reason = f"no new block for {now - peer.last_block:.0f}s"
+            if reason is None and peer.events and self.tip - peer.height > MAX_WATCH_LAG:
+                reason = f"{self.tip - peer.height} blocks behind"
+            if reason is None:
+                continue
+            logging.info(f"Replacing {key} at height {peer.height}: {reason}.")
+            self._stop(peer)
+            del self.watched[key]
+            self.benched.append((now, peer.connection(), peer.endpoint))
+            self.replaced += 1
+            changed = True
+        return changed
+
+    def _fill(self, changed):
+        """
+        Watch the next candidates until top_n peers are watched.
+        :param changed: Event set when a subscription fails
+        :return: Whether a peer was added
+        """
+        now = time.monotonic()
+        added = False
+        if self.selector is not None and self.candidates and len(self.watched) < self.top_n:
+            # Move the candidates the caps pick next to the watched peers to the front
+            watched = [peer.connection() for peer in self.watched.values()]
+            picked = {conn[0] for conn in self.selector.select(watched + [conn for conn, _ in self.candidates], self.top_n)}
+            self.candidates = deque(sorted(self.candidates, key=lambda candidate: candidate[0][0] not in picked))
+        while len(self.watched) < self.top_n:
+            if self.candidates:
+                conn, endpoint = self.candidates.popleft()
+            elif self.benched and now - self.benched[0][0] >= RETRY_AFTER:
+                _, conn, endpoint = self.benched.popleft()
+            else:
+                break
+            if conn[0] in self.watched:
+                continue
+            peer = self.watched[conn[0]] = WatchedPeer(conn, endpoint)
+            peer.task = asyncio.ensure_future(self._follow(peer, changed))
+            added = True
+        return added
+
+    def _stop(self, peer):
+        if peer.task is not None:
+            peer.task.cancel()
+        if peer.ws is not None:
+            peer.ws.close()
+
+    def _write(self):
+        ranking = rank_connections([peer.connection() for peer in self.watched.values()], self.top_n)
+        write_atomic(self.output_filename, ','.join(conn[0] for conn in ranking.best()))
+        logging.info(f"Best set of {len(ranking)} peers written to {self.output_filename}, tip {self.tip}, {self.replaced} replaced so far.")
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import sys
+import time
+from ranking import TopN
+
+# Rewrite the top-N file at least this often in seconds while new results arrive
+DEFAULT_FLUSH_INTERVAL = 10
+
+# Rewrite the top-N file after this many new successful results
+DEFAULT_FLUSH_EVERY = 50
+
+DEFAULT_JSONL_FILE = 'probe_results.jsonl'
+
+
+def write_atomic(path, text):
+    """
+    Replace a file in one step, so readers never see a partially written file.
+    :param path: Output file name
+    :param text: New content
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+class StreamingOutput:
+    """
+    Write results while the probes are still running.
+    Every probe is appended to a JSONL file as soon as it completes and the top-N
+    PEERS file is rewritten atomically every flush_interval seconds or after
+    flush_every new results, so a killed or stuck run still leaves usable output.
+    With a DiversitySelector every result is kept, so the network caps can pick from
+    all of them instead of only the top N.
+    """
+
+    def __init__(self, output_filename, top_n=40, jsonl_filename=None, flush_interval=DEFAULT_FLUSH_INTERVAL, flush_every=DEFAULT_FLUSH_EVERY, selector=None):
+        """
+        :param output_filename: Top-N PEERS file, comma separated id@ip:port
+        :param top_n: Number of connections kept in the PEERS file
+        :param jsonl_filename: Optional JSONL file receiving one record per probed peer
+        :param flush_interval: Seconds between two rewrites of the PEERS file
+        :param flush_every: Number of new results that triggers a rewrite
+        :param selector: Optional DiversitySelector spreading the PEERS file over networks
+        """
+        self.output_filename = output_filename
+        self.top_n = top_n
+        self.selector = selector
+        self.top = TopN(top_n if selector is None else sys.maxsize)
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.records = 0
+        self._new = 0
+        self._last_write = time.time()
+        self._jsonl = open(jsonl_filename, 'a', buffering=1) if jsonl_filename else None
+
+    def add(self, record, conn=None):
+        """
+        Emit the record of one probe.
+        :param record: JSON serializable dictionary describing the probe
+        :param conn: Connection tuple to rank if the probe succeeded
+        """
+        record.setdefault('time', round(time.time(), 3))
+        self.records += 1
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(record) + '\n')
+        if conn is not None:
+            self.top.push(conn)
+            self._new += 1
+        if self._new and (self._new >= self.flush_every or time.time() - self._last_write >= self.flush_interval):
+            self.write_peers()
+
+    def write_peers(self):
+        """
+        Atomically rewrite the PEERS file with the best connections seen so far.
+        """
+        top_connections = self.top.best()
+        if self.selector is not None:
+            top_connections = self.selector.select(top_connections, self.top_n)
+        write_atomic(self.output_filename, ','.join(conn[0] for conn in top_connections))
+        logging.info(f"Updated {self.output_filename} with {len(top_connections)} connections after {self.records} probes.")
+        self._new = 0
+        self._last_write = time.time()
+
+    def close(self):
+        if self._new:
+            self.write_peers()
+        if self._jsonl is not None:
+            self._jsonl.close()
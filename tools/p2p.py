@@ -0,0 +1,502 @@
+import asyncio
+import hashlib
+import hmac
+import struct
+import time
+from tracing import span
+
+try:
+    from cryptography.exceptions import InvalidSignature, InvalidTag
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:
+    ChaCha20Poly1305 = None
+
+# Whether the secret connection handshake can be run, it needs the cryptography package
+HANDSHAKE_AVAILABLE = ChaCha20Poly1305 is not None
+
+# Seconds for the handshake and the NodeInfo exchange after the TCP connection is open
+DEFAULT_HANDSHAKE_TIMEOUT = 5
+
+# P2P protocol version of CometBFT and of Tendermint since 0.34
+P2P_PROTOCOL_VERSION = 8
+
+# Channels of a full node: block sync, consensus, mempool, evidence, state sync and PEX
+NODE_CHANNELS = bytes.fromhex('40202122233038606100')
+
+# Largest NodeInfo accepted, as in CometBFT
+MAX_NODE_INFO_BYTES = 10240
+
+# Largest handshake message accepted, as in CometBFT
+MAX_HANDSHAKE_MESSAGE_BYTES = 1024 * 1024
+
+# Secret connection framing: 4 byte little-endian length and up to 1024 data bytes,
+# padded and sealed with ChaCha20-Poly1305
+DATA_LEN_SIZE = 4
+DATA_MAX_SIZE = 1024
+SEALED_FRAME_SIZE = DATA_LEN_SIZE + DATA_MAX_SIZE + 16
+
+# Merlin transcript and key derivation labels of the CometBFT secret connection
+TRANSCRIPT_LABEL = b'TENDERMINT_SECRET_CONNECTION_TRANSCRIPT_HASH'
+LABEL_EPHEMERAL_LOWER = b'EPHEMERAL_LOWER_PUBLIC_KEY'
+LABEL_EPHEMERAL_UPPER = b'EPHEMERAL_UPPER_PUBLIC_KEY'
+LABEL_DH_SECRET = b'DH_SECRET'
+LABEL_SECRET_CONNECTION_MAC = b'SECRET_CONNECTION_MAC'
+KEY_AND_CHALLENGE_GEN = b'TENDERMINT_SECRET_CONNECTION_KEY_AND_CHALLENGE_GEN'
+
+KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+
+# Rotation offsets of the rho step, by lane index x + 5 * y
+KECCAK_ROTATIONS = [0, 1, 62, 28, 27, 36, 44, 6, 55, 20, 3, 10, 43, 25, 39, 41, 45, 15, 21, 8, 18, 2, 61, 56, 14]
+
+# Target lane of the pi step, by lane index
+KECCAK_PI = [y + 5 * ((2 * x + 3 * y) % 5) for y in range(5) for x in range(5)]
+
+MASK64 = (1 << 64) - 1
+
+# (lane, target lane, left rotation, right shift, column) of the rho and pi steps
+KECCAK_STEPS = [(i, KECCAK_PI[i], KECCAK_ROTATIONS[i], 64 - KECCAK_ROTATIONS[i], i % 5) for i in range(25)]
+
+KECCAK_STATE = struct.Struct('<25Q')
+
+STROBE_R = 166
+FLAG_I, FLAG_A, FLAG_C, FLAG_T, FLAG_M, FLAG_K = 1, 2, 4, 8, 16, 32
+
+
+def keccak_f1600(state):
+    """
+    Keccak-f[1600] permutation, with theta unrolled as it runs once per handshake message.
+    :param state: bytearray of 200 bytes, permuted in place
+    """
+    lanes = list(KECCAK_STATE.unpack(state))
+    b = [0] * 25
+    for rc in KECCAK_ROUND_CONSTANTS:
+        c0 = lanes[0] ^ lanes[5] ^ lanes[10] ^ lanes[15] ^ lanes[20]
+        c1 = lanes[1] ^ lanes[6] ^ lanes[11] ^ lanes[16] ^ lanes[21]
+        c2 = lanes[2] ^ lanes[7] ^ lanes[12] ^ lanes[17] ^ lanes[22]
+        c3 = lanes[3] ^ lanes[8] ^ lanes[13] ^ lanes[18] ^ lanes[23]
+        c4 = lanes[4] ^ lanes[9] ^ lanes[14] ^ lanes[19] ^ lanes[24]
+        d = (c4 ^ (((c1 << 1) | (c1 >> 63)) & MASK64), c0 ^ (((c2 << 1) | (c2 >> 63)) & MASK64),
+             c1 ^ (((c3 << 1) | (c3 >> 63)) & MASK64), c2 ^ (((c4 << 1) | (c4 >> 63)) & MASK64),
+             c3 ^ (((c0 << 1) | (c0 >> 63)) & MASK64))
+        # rho and pi
+        for i, target, left, right, x in KECCAK_STEPS:
+            lane = lanes[i] ^ d[x]
+            b[target] = ((lane << left) | (lane >> right)) & MASK64
+        # chi
+        for y in (0, 5, 10, 15, 20):
+            b0, b1, b2, b3, b4 = b[y], b[y + 1], b[y + 2], b[y + 3], b[y + 4]
+            lanes[y] = b0 ^ (~b1 & b2)
+            lanes[y + 1] = b1 ^ (~b2 & b3)
+            lanes[y + 2] = b2 ^ (~b3 & b4)
+            lanes[y + 3] = b3 ^ (~b4 & b0)
+            lanes[y + 4] = b4 ^ (~b0 & b1)
+        lanes[0] ^= rc
+    state[:] = KECCAK_STATE.pack(*lanes)
+
+
+class Strobe128:
+    """
+    The subset of STROBE-128 used by Merlin transcripts: meta-AD, AD and PRF.
+    """
+
+    def __init__(self, protocol_label):
+        self.state = bytearray(200)
+        self.state[0:6] = bytes([1, STROBE_R + 2, 1, 0, 1, 96])
+        self.state[6:18] = b'STROBEv1.0.2'
+        keccak_f1600(self.state)
+        self.pos = 0
+        self.pos_begin = 0
+        self.cur_flags = 0
+        self.meta_ad(protocol_label, False)
+
+    def meta_ad(self, data, more):
+        self._begin_op(FLAG_M | FLAG_A, more)
+        self._absorb(data)
+
+    def ad(self, data, more):
+        self._begin_op(FLAG_A, more)
+        self._absorb(data)
+
+    def prf(self, size, more):
+        self._begin_op(FLAG_I | FLAG_A | FLAG_C, more)
+        return self._squeeze(size)
+
+    def _run_f(self):
+        self.state[self.pos] ^= self.pos_begin
+        self.state[self.pos + 1] ^= 0x04
+        self.state[STROBE_R + 1] ^= 0x80
+        keccak_f1600(self.state)
+        self.pos = 0
+        self.pos_begin = 0
+
+    def _absorb(self, data):
+        for byte in data:
+            self.state[self.pos] ^= byte
+            self.pos += 1
+            if self.pos == STROBE_R:
+                self._run_f()
+
+    def _squeeze(self, size):
+        out = bytearray()
+        for _ in range(size):
+            out.append(self.state[self.pos])
+            self.state[self.pos] = 0
+            self.pos += 1
+            if self.pos == STROBE_R:
+                self._run_f()
+        return bytes(out)
+
+    def _begin_op(self, flags, more):
+        if more:
+            return
+        old_begin = self.pos_begin
+        self.pos_begin = self.pos + 1
+        self.cur_flags = flags
+        self._absorb(bytes([old_begin, flags]))
+        if flags & (FLAG_C | FLAG_K) and self.pos != 0:
+            self._run_f()
+
+
+class Transcript:
+    """
+    Merlin transcript, https://merlin.cool, as used by the CometBFT secret connection.
+    """
+
+    def __init__(self, label):
+        self.strobe = Strobe128(b'Merlin v1.0')
+        self.append_message(b'dom-sep', label)
+
+    def append_message(self, label, message):
+        self.strobe.meta_ad(label, False)
+        self.strobe.meta_ad(struct.pack('<I', len(message)), True)
+        self.strobe.ad(message, False)
+
+    def challenge_bytes(self, label, size):
+        self.strobe.meta_ad(label, False)
+        self.strobe.meta_ad(struct.pack('<I', size), True)
+        return self.strobe.prf(size, False)
+
+
+def hkdf_sha256(key_material, info, size, salt=b''):
+    """
+    HKDF with SHA-256, RFC 5869.
+    :return: size bytes of output key material
+    """
+    prk = hmac.new(salt or bytes(32), key_material, hashlib.sha256).digest()
+    output = b''
+    block = b''
+    counter = 1
+    while len(output) < size:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:size]
+
+
+def uvarint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def proto_field(number, value):
+    """
+    Encode one protobuf field: ints as varints, bytes and str as length-delimited.
+    """
+    if isinstance(value, int):
+        return uvarint(number << 3) + uvarint(value)
+    if isinstance(value, str):
+        value = value.encode()
+    return uvarint(number << 3 | 2) + uvarint(len(value)) + value
+
+
+def proto_fields(data):
+    """
+    Decode the fields of a protobuf message.
+    :param data: Message bytes
+    :return: Dictionary of field number -> last value, ints for varints and bytes for length-delimited fields
+    """
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = read_uvarint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            fields[number], pos = read_uvarint(data, pos)
+        elif wire_type == 2:
+            size, pos = read_uvarint(data, pos)
+            if pos + size > len(data):
+                raise ValueError("Truncated protobuf field")
+            fields[number] = data[pos:pos + size]
+            pos += size
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+    return fields
+
+
+def read_uvarint(data, pos):
+    """
+    :return: Tuple of (value, position after it)
+    """
+    value = 0
+    for shift in range(0, 64, 7):
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+    raise ValueError("Varint too long")
+
+
+def node_id_from_key(public_key):
+    """
+    :param public_key: Raw 32 byte Ed25519 public key
+    :return: Node ID as 40 lower-case hex characters, the first 20 bytes of its SHA-256
+    """
+    return hashlib.sha256(public_key).digest()[:20].hex()
+
+
+def encode_node_info(info):
+    """
+    :param info: NodeInfo dictionary laid out like node_info of /status
+    :return: DefaultNodeInfo protobuf bytes
+    """
+    version = info['protocol_version']
+    other = info.get('other', {})
+    return b''.join([
+        proto_field(1, proto_field(1, int(version['p2p'])) + proto_field(2, int(version['block'])) + proto_field(3, int(version['app']))),
+        proto_field(2, info['id']),
+        proto_field(3, info['listen_addr']),
+        proto_field(4, info['network']),
+        proto_field(5, info['version']),
+        proto_field(6, bytes.fromhex(info['channels'])),
+        proto_field(7, info['moniker']),
+        proto_field(8, proto_field(1, other.get('tx_index', '')) + proto_field(2, other.get('rpc_address', ''))),
+    ])
+
+
+def decode_node_info(data):
+    """
+    :param data: DefaultNodeInfo protobuf bytes
+    :return: NodeInfo dictionary laid out like node_info of /status
+    """
+    fields = proto_fields(data)
+    version = proto_fields(fields.get(1, b''))
+    other = proto_fields(fields.get(8, b''))
+    return {
+        'protocol_version': {'p2p': version.get(1, 0), 'block': version.get(2, 0), 'app': version.get(3, 0)},
+        'id': fields.get(2, b'').decode('utf-8', 'replace'),
+        'listen_addr': fields.get(3, b'').decode('utf-8', 'replace'),
+        'network': fields.get(4, b'').decode('utf-8', 'replace'),
+        'version': fields.get(5, b'').decode('utf-8', 'replace'),
+        'channels': fields.get(6, b'').hex(),
+        'moniker': fields.get(7, b'').decode('utf-8', 'replace'),
+        'other': {'tx_index': other.get(1, b'').decode('utf-8', 'replace'), 'rpc_address': other.get(2, b'').decode('utf-8', 'replace')},
+    }
+
+
+async def read_delimited(read, max_size):
+    """
+    Read one uvarint length-prefixed message.
+    :param read: Coroutine function reading exactly n bytes
+    :param max_size: Largest message accepted
+    :return: Message bytes
+    """
+    size = 0
+    for shift in range(0, 64, 7):
+        byte = (await read(1))[0]
+        size |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+    if size > max_size:
+        raise ValueError(f"Message of {size} bytes exceeds {max_size} bytes")
+    return await read(size)
+
+
+class SecretConnection:
+    """
+    Encrypted framing of a CometBFT P2P connection after the handshake.
+    """
+
+    def __init__(self, reader, writer, send_key, recv_key):
+        self.reader = reader
+        self.writer = writer
+        self.send_aead = ChaCha20Poly1305(send_key)
+        self.recv_aead = ChaCha20Poly1305(recv_key)
+        self.send_nonce = 0
+        self.recv_nonce = 0
+        self.buffer = bytearray()
+
+    def write(self, data):
+        for offset in range(0, max(len(data), 1), DATA_MAX_SIZE):
+            chunk = data[offset:offset + DATA_MAX_SIZE]
+            frame = struct.pack('<I', len(chunk)) + chunk + bytes(DATA_MAX_SIZE - len(chunk))
+            nonce = bytes(4) + struct.pack('<Q', self.send_nonce)
+            self.send_nonce += 1
+            self.writer.write(self.send_aead.encrypt(nonce, frame, None))
+
+    async def read(self, size):
+        while len(self.buffer) < size:
+            sealed = await self.reader.readexactly(SEALED_FRAME_SIZE)
+            nonce = bytes(4) + struct.pack('<Q', self.recv_nonce)
+            self.recv_nonce += 1
+            frame = self.recv_aead.decrypt(nonce, sealed, None)
+            length = struct.unpack_from('<I', frame)[0]
+            if length > DATA_MAX_SIZE:
+                raise ValueError("Secret connection frame length out of range")
+            self.buffer += frame[DATA_LEN_SIZE:DATA_LEN_SIZE + length]
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def write_delimited(self, message):
+        self.write(uvarint(len(message)) + message)
+
+    async def read_delimited(self, max_size):
+        return await read_delimited(self.read, max_size)
+
+
+async def secret_handshake(reader, writer, node_key):
+    """
+    Run the CometBFT secret connection handshake: exchange ephemeral X25519 keys,
+    derive the session keys, and prove the node keys by signing the transcript
+    challenge. Both sides run the same steps.
+    :param reader: asyncio StreamReader of the TCP connection
+    :param writer: asyncio StreamWriter of the TCP connection
+    :param node_key: Ed25519PrivateKey of the local node
+    :return: Tuple of (SecretConnection, raw Ed25519 public key of the remote node)
+    """
+    ephemeral = X25519PrivateKey.generate()
+    local_ephemeral = public_key_bytes(ephemeral)
+    writer.write(uvarint(34) + proto_field(1, local_ephemeral))
+
+    async def read_plain(size):
+        return await reader.readexactly(size)
+
+    remote_ephemeral = proto_fields(await read_delimited(read_plain, MAX_HANDSHAKE_MESSAGE_BYTES)).get(1, b'')
+    if len(remote_ephemeral) != 32:
+        raise ValueError("Invalid ephemeral key")
+    low, high = sorted([local_ephemeral, remote_ephemeral])
+    transcript = Transcript(TRANSCRIPT_LABEL)
+    transcript.append_message(LABEL_EPHEMERAL_LOWER, low)
+    transcript.append_message(LABEL_EPHEMERAL_UPPER, high)
+    dh_secret = ephemeral.exchange(X25519PublicKey.from_public_bytes(remote_ephemeral))
+    if not any(dh_secret):
+        raise ValueError("Shared secret is zero")
+    transcript.append_message(LABEL_DH_SECRET, dh_secret)
+    keys = hkdf_sha256(dh_secret, KEY_AND_CHALLENGE_GEN, 64)
+    if local_ephemeral == low:
+        recv_key, send_key = keys[:32], keys[32:]
+    else:
+        send_key, recv_key = keys[:32], keys[32:]
+    challenge = transcript.challenge_bytes(LABEL_SECRET_CONNECTION_MAC, 32)
+    conn = SecretConnection(reader, writer, send_key, recv_key)
+    conn.write_delimited(proto_field(1, proto_field(1, public_key_bytes(node_key))) + proto_field(2, node_key.sign(challenge)))
+    auth = proto_fields(await conn.read_delimited(MAX_HANDSHAKE_MESSAGE_BYTES))
+    remote_key = proto_fields(auth.get(1, b'')).get(1, b'')
+    if len(remote_key) != 32:
+        raise ValueError("Remote node key is not an Ed25519 key")
+    Ed25519PublicKey.from_public_bytes(remote_key).verify(auth.get(2, b''), challenge)
+    return conn, remote_key
+
+
+def generate_node_key():
+    """
+    :return: New Ed25519PrivateKey for the probe to authenticate with
+    """
+    return Ed25519PrivateKey.generate()
+
+
+def node_key_from_seed(seed):
+    """
+    :param seed: 32 byte private key seed
+    :return: Ed25519PrivateKey
+    """
+    return Ed25519PrivateKey.from_private_bytes(seed)
+
+
+def public_key_bytes(node_key):
+    """
+    :param node_key: Ed25519PrivateKey or X25519PrivateKey
+    :return: Raw 32 byte public key
+    """
+    return node_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+
+def check_node_info(node_info, authenticated_id, node_id=None, network=None, block_version=None, p2p_version=P2P_PROTOCOL_VERSION):
+    """
+    Check what a peer proved in the handshake against what we expect of it.
+    Like CometBFT, a peer sharing no channel with a full node is rejected.
+    :param node_info: NodeInfo dictionary sent by the peer
+    :param authenticated_id: Node ID derived from the key the peer signed with
+    :param node_id: Expected node ID, from the id@ prefix of the peer entry
+    :param network: Expected chain ID, None to accept any
+    :param block_version: Expected block protocol version, None to accept any
+    :param p2p_version: Expected P2P protocol version, None to accept any
+    :return: None if the peer passes, else the reason it does not
+    """
+    if node_id is not None and authenticated_id != node_id.lower():
+        return f"node ID {authenticated_id} instead of {node_id.lower()}"
+    if node_info['id'] != authenticated_id:
+        return f"NodeInfo claims ID {node_info['id']} but the key is {authenticated_id}"
+    if network is not None and node_info['network'] != network:
+        return f"network {node_info['network']} instead of {network}"
+    if block_version is not None and node_info['protocol_version']['block'] != block_version:
+        return f"block protocol {node_info['protocol_version']['block']} instead of {block_version}"
+    if p2p_version is not None and node_info['protocol_version']['p2p'] != p2p_version:
+        return f"P2P protocol {node_info['protocol_version']['p2p']} instead of {p2p_version}"
+    if not set(bytes.fromhex(node_info['channels'])) & set(NODE_CHANNELS):
+        return "no channels in common"
+    return None
+
+
+async def p2p_handshake(ip, port, node_key, connect_timeout, timeout=DEFAULT_HANDSHAKE_TIMEOUT, recorder=None):
+    """
+    Connect to a P2P port, run the secret connection handshake and read the NodeInfo
+    of the peer. Our own NodeInfo is not sent, so the probe never becomes a peer.
+    :param ip: IP address
+    :param port: P2P port
+    :param node_key: Ed25519PrivateKey the probe authenticates with
+    :param connect_timeout: Timeout in seconds for the TCP connection
+    :param timeout: Timeout in seconds for the handshake and the NodeInfo
+    :param recorder: Optional PhaseRecorder timing the connect, the handshake and the NodeInfo
+    :return: Tuple of (NodeInfo dictionary, authenticated node ID, connect time, handshake time),
+             times in seconds from the start of the connection
+    """
+    start_time = time.perf_counter()
+    with span(recorder, 'connect', ip):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), connect_timeout)
+    connect_time = time.perf_counter() - start_time
+    try:
+        with span(recorder, 'handshake', ip):
+            conn, remote_key = await asyncio.wait_for(secret_handshake(reader, writer, node_key), timeout)
+        with span(recorder, 'ttfb', ip):
+            data = await asyncio.wait_for(conn.read_delimited(MAX_NODE_INFO_BYTES), timeout)
+        with span(recorder, 'parse', ip):
+            node_info = decode_node_info(data)
+        return node_info, node_id_from_key(remote_key), connect_time, time.perf_counter() - start_time
+    finally:
+        writer.close()
+
+
+# Errors of a failed or rejected handshake
+HANDSHAKE_ERRORS = (ValueError, KeyError, IndexError, UnicodeDecodeError) + ((InvalidSignature, InvalidTag) if HANDSHAKE_AVAILABLE else ())
@@ -0,0 +1,187 @@
+import json
+import logging
+import sqlite3
+import statistics
+import time
+
+# Default freshness window in seconds, peers probed more recently are not probed again
+DEFAULT_FRESH_FOR = 300
+
+# Number of latency samples kept per peer
+MAX_LATENCY_SAMPLES = 16
+
+# Number of writes between two commits
+COMMIT_EVERY = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS peers (
+    ip TEXT NOT NULL,
+    p2p_port INTEGER NOT NULL,
+    node_id TEXT,
+    rpc_port INTEGER,
+    moniker TEXT,
+    last_height INTEGER,
+    latency_samples TEXT NOT NULL DEFAULT '[]',
+    last_seen REAL,
+    last_failed REAL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    catching_up INTEGER,
+    probes INTEGER NOT NULL DEFAULT 0,
+    probe_failures INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip, p2p_port)
+);
+CREATE INDEX IF NOT EXISTS peers_node_id ON peers (node_id);
+'''
+
+# Columns added after the first release of the schema, with their definitions
+MIGRATIONS = [
+    ('catching_up', 'INTEGER'),
+    ('probes', 'INTEGER NOT NULL DEFAULT 0'),
+    ('probe_failures', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+class PeerDB:
+    """
+    SQLite store of every peer the tools have probed, so a run only re-probes
+    peers whose last probe is older than the freshness window.
+    """
+
+    def __init__(self, path='peers.db'):
+        """
+        :param path: Path of the SQLite database file
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(peers)')}
+        for name, definition in MIGRATIONS:
+            if name not in columns:
+                self.conn.execute(f'ALTER TABLE peers ADD COLUMN {name} {definition}')
+        self._pending = 0
+
+    def get(self, ip, p2p_port):
+        """
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :return: sqlite3.Row of the peer or None if unknown
+        """
+        return self.conn.execute('SELECT * FROM peers WHERE ip = ? AND p2p_port = ?', (ip, p2p_port)).fetchone()
+
+    def needs_probe(self, ip, p2p_port, fresh_for=DEFAULT_FRESH_FOR, now=None):
+        """
+        Check whether the peer is unknown or its last probe is older than the freshness window.
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :param fresh_for: Freshness window in seconds
+        :param now: Current time, defaults to time.time()
+        :return: Whether the peer should be probed again
+        """
+        row = self.get(ip, p2p_port)
+        if row is None:
+            return True
+        last_probed = max(row['last_seen'] or 0, row['last_failed'] or 0)
+        return last_probed < (now or time.time()) - fresh_for
+
+    def cached_result(self, ip, p2p_port):
+        """
+        Result of the last probe of a peer.
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :return: Whether the peer was reachable, its last block height and its median latency
+        """
+        row = self.get(ip, p2p_port)
+        if row is None or (row['last_seen'] or 0) < (row['last_failed'] or 0):
+            return False, None, None
+        samples = json.loads(row['latency_samples'])
+        return True, row['last_height'], statistics.median(samples) if samples else None
+
+    def history(self, ip, p2p_port):
+        """
+        Long term statistics of a peer used for ranking.
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :return: Median latency or None, last catching_up flag and share of failed probes
+        """
+        row = self.get(ip, p2p_port)
+        if row is None:
+            return None, False, 0.0
+        samples = json.loads(row['latency_samples'])
+        failure_rate = row['probe_failures'] / row['probes'] if row['probes'] else 0.0
+        return statistics.median(samples) if samples else None, bool(row['catching_up']), failure_rate
+
+    def record_success(self, ip, p2p_port, node_id=None, rpc_port=None, moniker=None, height=None, latency=None, catching_up=None):
+        """
+        Store a successful probe and append its latency sample.
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :param node_id: Node ID
+        :param rpc_port: RPC port
+        :param moniker: Moniker reported by /status
+        :param height: Latest block height
+        :param latency: Connection time in seconds
+        :param catching_up: catching_up flag reported by /status
+        """
+        row = self.get(ip, p2p_port)
+        samples = json.loads(row['latency_samples']) if row else []
+        if latency is not None:
+            samples = (samples + [round(latency, 6)])[-MAX_LATENCY_SAMPLES:]
+        self.conn.execute('''
+            INSERT INTO peers (ip, p2p_port, node_id, rpc_port, moniker, last_height, latency_samples, last_seen, failures, catching_up, probes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, 1)
+            ON CONFLICT (ip, p2p_port) DO UPDATE SET
+                node_id = COALESCE(excluded.node_id, node_id),
+                rpc_port = COALESCE(excluded.rpc_port, rpc_port),
+                moniker = COALESCE(excluded.moniker, moniker),
+                last_height = COALESCE(excluded.last_height, last_height),
+                latency_samples = excluded.latency_samples,
+                last_seen = excluded.last_seen,
+                failures = 0,
+                catching_up = COALESCE(excluded.catching_up, catching_up),
+                probes = probes + 1
+        ''', (ip, p2p_port, node_id, rpc_port, moniker, height, json.dumps(samples), time.time(), catching_up))
+        self._written()
+
+    def record_failure(self, ip, p2p_port, node_id=None, rpc_port=None):
+        """
+        Store a failed probe.
+        :param ip: IP address
+        :param p2p_port: P2P port
+        :param node_id: Node ID
+        :param rpc_port: RPC port
+        """
+        self.conn.execute('''
+            INSERT INTO peers (ip, p2p_port, node_id, rpc_port, last_failed, failures, probes, probe_failures)
+            VALUES (?, ?, ?, ?, ?, 1, 1, 1)
+            ON CONFLICT (ip, p2p_port) DO UPDATE SET
+                node_id = COALESCE(excluded.node_id, node_id),
+                rpc_port = COALESCE(excluded.rpc_port, rpc_port),
+                last_failed = excluded.last_failed,
+                failures = failures + 1,
+                probes = probes + 1,
+                probe_failures = probe_failures + 1
+        ''', (ip, p2p_port, node_id, rpc_port, time.time()))
+        self._written()
+
+    def peers(self):
+        """
+        :return: All stored peers as sqlite3.Row objects
+        """
+        return self.conn.execute('SELECT * FROM peers').fetchall()
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+        logging.info(f"Saved peer database {self.path}.")
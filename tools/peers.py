@@ -0,0 +1,200 @@
+import struct
+from array import array
+from collections import namedtuple
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
+from endpoints import format_host_port
+
+# Packed IPv6 addresses carry this bit so they never collide with IPv4 addresses
+IPV6_FLAG = 1 << 128
+
+# Converts IPv4 addresses to ints, faster than int.from_bytes() on the hot path of /net_info parsing
+IPV4 = struct.Struct('!I')
+
+# Bits of PeerTable.flags
+EXPAND_ONLY = 1
+CATCHING_UP = 2
+
+# Stored in PeerTable.heights while the height of a peer is unknown
+UNKNOWN_HEIGHT = -1
+
+
+def pack_ip(ip):
+    """
+    Pack an address into an int, which takes a fraction of the memory of its string.
+    :param ip: IPv4 or IPv6 address, or host name
+    :return: Packed address, host names are returned unchanged
+    """
+    try:
+        return IPV4.unpack(inet_pton(AF_INET, ip))[0]
+    except OSError:
+        pass
+    try:
+        return IPV6_FLAG | int.from_bytes(inet_pton(AF_INET6, ip), 'big')
+    except OSError:
+        return ip
+
+
+def unpack_ip(packed):
+    """
+    :param packed: Address packed by pack_ip()
+    :return: Address string
+    """
+    if isinstance(packed, str):
+        return packed
+    if packed & IPV6_FLAG:
+        return inet_ntop(AF_INET6, (packed ^ IPV6_FLAG).to_bytes(16, 'big'))
+    return inet_ntop(AF_INET, IPV4.pack(packed))
+
+
+def node_id_bytes(node_id):
+    """
+    :param node_id: Node ID as 40 hex characters, in any case
+    :return: The 20 byte binary node ID, or None if it is not a valid node ID
+    """
+    try:
+        raw = bytes.fromhex(node_id)
+    except (TypeError, ValueError):
+        return None
+    return raw if len(raw) == 20 else None
+
+
+class Peer(namedtuple('Peer', ['node_id', 'ip', 'rpc_port', 'p2p_port'], defaults=[None])):
+    """
+    Identity of one peer: 20 byte node ID or None, address packed by pack_ip(), RPC port
+    and P2P port or None. A slotted tuple, which is cheap to build for every /net_info
+    entry and is not tracked by the garbage collector. The id@ip:port form is only
+    built when a peer is written out.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, node_id, ip, rpc_port, p2p_port=None):
+        """
+        Build a peer from its textual fields.
+        :param node_id: Node ID as hex, or None for an RPC endpoint without known ID
+        :param ip: IP address or host name
+        :param rpc_port: RPC port
+        :param p2p_port: P2P port or None if unknown
+        :return: Peer, or None if a node ID was given but is invalid or a port is out of range
+        """
+        raw_id = None
+        if node_id is not None:
+            raw_id = node_id_bytes(node_id)
+            if raw_id is None:
+                return None
+        rpc_port = int(rpc_port)
+        p2p_port = int(p2p_port) if p2p_port is not None else None
+        if not 0 < rpc_port < 65536 or (p2p_port is not None and not 0 < p2p_port < 65536):
+            return None
+        return cls(raw_id, pack_ip(ip), rpc_port, p2p_port)
+
+    @property
+    def address(self):
+        return unpack_ip(self.ip)
+
+    @property
+    def id_hex(self):
+        return self.node_id.hex() if self.node_id is not None else None
+
+    @property
+    def key(self):
+        """
+        :return: id@ip:port, or ip:rpc_port for an RPC endpoint without node ID; IPv6 addresses in brackets
+        """
+        if self.node_id is None or self.p2p_port is None:
+            return format_host_port(self.address, self.rpc_port)
+        return f"{self.node_id.hex()}@{format_host_port(self.address, self.p2p_port)}"
+
+    def endpoints(self):
+        """
+        :return: Endpoint keys of the RPC and, if known, the P2P port
+        """
+        ip = self.ip
+        if isinstance(ip, str):
+            keys = [(ip, self.rpc_port)]
+            if self.p2p_port is not None:
+                keys.append((ip, self.p2p_port))
+            return keys
+        ip <<= 16
+        if self.p2p_port is None:
+            return [ip | self.rpc_port]
+        return [ip | self.rpc_port, ip | self.p2p_port]
+
+
+class PeerTable:
+    """
+    Column store of the peers of one crawl, addressed by row index.
+    Node IDs and addresses are kept in lists, ports, hops, flags and probe results
+    in typed arrays, so a row costs a few dozen bytes instead of several tuples and
+    strings.
+    """
+
+    def __init__(self):
+        self.node_ids = []
+        self.ips = []
+        # 0 stands for an unknown port
+        self.rpc_ports = array('H')
+        self.p2p_ports = array('H')
+        self.hops = array('H')
+        self.flags = array('B')
+        self.heights = array('q')
+        self.rtts = array('d')
+        self.failure_rates = array('d')
+
+    def __len__(self):
+        return len(self.flags)
+
+    def add(self, peer, hop=0, expand_only=False):
+        """
+        Append a peer.
+        :param peer: Peer
+        :param hop: Number of /net_info hops from the seeds
+        :param expand_only: Whether the peer is only expanded and not ranked
+        :return: Row index
+        """
+        self.node_ids.append(peer.node_id)
+        self.ips.append(peer.ip)
+        self.rpc_ports.append(peer.rpc_port)
+        self.p2p_ports.append(peer.p2p_port or 0)
+        self.hops.append(hop)
+        self.flags.append(EXPAND_ONLY if expand_only else 0)
+        self.heights.append(UNKNOWN_HEIGHT)
+        self.rtts.append(float('nan'))
+        self.failure_rates.append(0.0)
+        return len(self.flags) - 1
+
+    def peer(self, index):
+        """
+        :param index: Row index
+        :return: Peer of the row
+        """
+        return Peer(self.node_ids[index], self.ips[index], self.rpc_ports[index], self.p2p_ports[index] or None)
+
+    def key(self, index):
+        return self.peer(index).key
+
+    def expand_only(self, index):
+        return bool(self.flags[index] & EXPAND_ONLY)
+
+    def set_result(self, index, height=None, rtt=None, catching_up=False, failure_rate=0.0):
+        """
+        Store the result of a probe that reached the peer.
+        :param index: Row index
+        :param height: Latest block height or None if unknown
+        :param rtt: Latency in seconds or None if unknown
+        :param catching_up: catching_up flag reported by /status
+        :param failure_rate: Share of failed probes in the history of the peer
+        """
+        self.flags[index] = (self.flags[index] & EXPAND_ONLY) | (CATCHING_UP if catching_up else 0)
+        self.heights[index] = UNKNOWN_HEIGHT if height is None else height
+        self.rtts[index] = float('nan') if rtt is None else rtt
+        self.failure_rates[index] = failure_rate or 0.0
+
+    def connection(self, index):
+        """
+        :param index: Row index
+        :return: Connection tuple (id@ip:port, height, rtt or None, catching_up, failure rate)
+        """
+        rtt = self.rtts[index]
+        return (self.key(index), self.heights[index], None if rtt != rtt else rtt,
+                bool(self.flags[index] & CATCHING_UP), self.failure_rates[index])
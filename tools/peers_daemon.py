@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+from cli import add_probe_arguments, limits_from_args, negative_cache_from_args
+from crawler import Crawler, load_peer_list
+from endpoints import parse_peer
+from output import write_atomic
+from peerdb import PeerDB
+from peers import Peer
+from probe import ProbeEngine
+from ranking import connection_fields, rank_connections
+from seeds import PeerListFetcher
+from syncrate import assess, with_sync
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Number of samples kept per peer and series
+DEFAULT_HISTORY = 60
+
+# Seconds between the start of two scans
+DEFAULT_INTERVAL = 120
+
+DEFAULT_LISTEN_PORT = 9110
+
+# Latest height samples of a peer, one per scan, its sync rate is computed over
+DEFAULT_RATE_SAMPLES = 3
+
+
+class PeerSeries:
+    """
+    Recent probe results of one peer, kept in fixed-size ring buffers.
+    """
+    __slots__ = ('heights', 'rtts', 'conn', 'up', 'created', 'last_seen', 'record', 'rpc_port')
+
+    def __init__(self, history):
+        self.heights = deque(maxlen=history)
+        self.rtts = deque(maxlen=history)
+        self.conn = None
+        self.up = False
+        self.created = time.time()
+        self.last_seen = 0
+        self.record = {}
+        # RPC port announced in the rpc_address of the peer, which need not be its P2P port + 1
+        self.rpc_port = None
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PeerMonitor:
+    """
+    Re-probe the peer set on a schedule and serve the results over HTTP.
+    Implements the StreamingOutput add() interface so the crawler reports every
+    probe to it as soon as it completes.
+    """
+
+    def __init__(self, engine, peer_list=None, rpc_url=None, depth=0, interval=DEFAULT_INTERVAL, top_n=40, history=DEFAULT_HISTORY, db=None, output_filename=None):
+        """
+        :param engine: ProbeEngine used for all scans
+        :param peer_list: File or URL of the peer list, re-read before every scan
+        :param rpc_url: Optional RPC URL whose /net_info neighbours are crawled
+        :param depth: Number of /net_info hops crawled from the seeds
+        :param interval: Seconds between the start of two scans
+        :param top_n: Number of peers in the best peer set
+        :param history: Number of samples kept per peer
+        :param db: Optional PeerDB the results are recorded in
+        :param output_filename: Optional PEERS file rewritten after every scan
+        """
+        self.engine = engine
+        self.peer_list = peer_list
+        # Keeps the ETag of a peer list URL, so an unchanged list is not downloaded again every scan
+        self.fetcher = PeerListFetcher()
+        self.rpc_url = rpc_url
+        self.depth = depth
+        self.interval = interval
+        self.top_n = top_n
+        self.history = history
+        self.db = db
+        self.output_filename = output_filename
+        self.series = {}
+        self.sync = {}
+        self.ranking = rank_connections([], top_n)
+        self.scans = 0
+        self.probes = 0
+        self.probe_failures = 0
+        self.last_scan_duration = 0.0
+        self.last_scan_end = 0.0
+
+    def add(self, record, conn=None):
+        """
+        Record the result of one probe.
+        :param record: Probe record emitted by the crawler
+        :param conn: Connection tuple if the probe succeeded
+        """
+        self.probes += 1
+        series = self.series.get(record['peer'])
+        if series is None:
+            series = self.series[record['peer']] = PeerSeries(self.history)
+        series.record = record
+        series.rpc_port = record.get('rpc_port', series.rpc_port)
+        series.up = conn is not None
+        if conn is None:
+            self.probe_failures += 1
+            return
+        now = record.get('time', time.time())
+        _, height, rtt = connection_fields(conn)[:3]
+        series.heights.append((now, height))
+        if rtt is not None:
+            series.rtts.append((now, rtt))
+        series.conn = conn
+        series.last_seen = now
+
+    async def scan(self):
+        """
+        Run one scan of the peer set and rebuild the best peer set.
+        """
+        start_time = time.time()
+        crawler = Crawler(self.engine, max_depth=self.depth, db=self.db, fresh_for=0, stream=self)
+        # Peers found by earlier crawls stay in the peer set, with the RPC port they announced;
+        # they go first, so the guessed port of a peer list entry does not shadow it
+        for peer, series in list(self.series.items()):
+            parsed = parse_peer(peer)
+            if parsed is None:
+                continue
+            node_id, host, port = parsed
+            if node_id is None:
+                crawler.add_peer(Peer.parse(None, host, port))
+            else:
+                crawler.add_peer(Peer.parse(node_id, host, series.rpc_port or port + 1, port))
+        if self.peer_list:
+            try:
+                lines = await asyncio.get_running_loop().run_in_executor(None, load_peer_list, self.peer_list, self.fetcher)
+            except Exception as e:
+                logging.error(f"Failed to read peer list {self.peer_list}: {e}")
+                lines = []
+            for line in lines:
+                crawler.add_seed(line)
+        if self.rpc_url:
+            crawler.add_rpc_url(self.rpc_url)
+        try:
+            await crawler.crawl()
+        finally:
+            self.engine.pool.close()
+        # Forget peers that have not answered for a whole history window
+        expired = start_time - self.history * self.interval
+        for peer in [peer for peer, series in self.series.items() if not series.up and max(series.created, series.last_seen) < expired]:
+            del self.series[peer]
+        self.rank()
+        self.scans += 1
+        self.last_scan_end = time.time()
+        self.last_scan_duration = self.last_scan_end - start_time
+        if self.engine.negative_cache is not None:
+            self.engine.negative_cache.save()
+        if self.db is not None:
+            self.db.commit()
+        if self.output_filename:
+            write_atomic(self.output_filename, ','.join(conn[0] for conn in self.ranking.best()))
+        logging.info(f"Scan {self.scans} probed {crawler.visited} peers in {self.last_scan_duration:.1f}s, {len(self.ranking)} in the best set.")
+
+    def rank(self):
+        """
+        Rebuild the best peer set, with the sync rate of every peer up over its latest scans.
+        """
+        up = {peer: series for peer, series in self.series.items() if series.up and series.conn}
+        self.sync = assess({peer: (list(series.heights)[-DEFAULT_RATE_SAMPLES:], series.record.get('catching_up'), series.record.get('latest_block_time'))
+                            for peer, series in up.items()})
+        self.ranking = rank_connections([with_sync(series.conn, self.sync[peer]) if peer in self.sync else series.conn
+                                         for peer, series in up.items()], self.top_n)
+
+    async def run_forever(self):
+        while True:
+            started = time.time()
+            try:
+                await self.scan()
+            except Exception as e:
+                logging.error(f"Scan failed: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.time() - started)))
+
+    def top(self, n=None):
+        """
+        :param n: Number of peers to return, defaults to top_n
+        :return: List of dictionaries describing the best peers, best first
+        """
+        peers = []
+        for conn in self.ranking.best()[:n or self.top_n]:
+            peer, height, rtt, catching_up, failure_rate, _, stalled, _ = connection_fields(conn)
+            series = self.series.get(peer)
+            sync = self.sync.get(peer, {})
+            peers.append({
+                'peer': peer,
+                'height': height,
+                'rtt': rtt,
+                'catching_up': catching_up,
+                'failure_rate': failure_rate,
+                'blocks_per_second': sync.get('blocks_per_second'),
+                'block_age': sync.get('block_age'),
+                'stalled': stalled,
+                'score': round(self.ranking.score(conn), 1),
+                'moniker': series.record.get('moniker') if series else None,
+                'last_seen': series.last_seen if series else None,
+            })
+        return peers
+
+    def metrics_text(self):
+        """
+        :return: Metrics in the Prometheus text exposition format
+        """
+        lines = [
+            '# HELP peers_scans_total Completed scans.',
+            '# TYPE peers_scans_total counter',
+            f'peers_scans_total {self.scans}',
+            '# HELP peers_probes_total Probes run since start.',
+            '# TYPE peers_probes_total counter',
+            f'peers_probes_total {self.probes}',
+            '# HELP peers_probe_failures_total Failed probes since start.',
+            '# TYPE peers_probe_failures_total counter',
+            f'peers_probe_failures_total {self.probe_failures}',
+            '# HELP peers_scan_duration_seconds Duration of the last scan.',
+            '# TYPE peers_scan_duration_seconds gauge',
+            f'peers_scan_duration_seconds {self.last_scan_duration:.3f}',
+            '# HELP peers_network_tip_height Highest block height seen in the last scan.',
+            '# TYPE peers_network_tip_height gauge',
+            f'peers_network_tip_height {self.ranking.tip}',
+            '# HELP peers_known Peers in the monitored set.',
+            '# TYPE peers_known gauge',
+            f'peers_known {len(self.series)}',
+            '# HELP peer_up Whether the last probe of the peer succeeded.',
+            '# TYPE peer_up gauge',
+        ]
+        heights = ['# HELP peer_height Latest block height of the peer.', '# TYPE peer_height gauge']
+        rtts = ['# HELP peer_rtt_seconds Latest latency sample of the peer.', '# TYPE peer_rtt_seconds gauge']
+        rates = ['# HELP peer_blocks_per_second Sync rate of the peer over its latest scans.', '# TYPE peer_blocks_per_second gauge']
+        for peer, series in self.series.items():
+            label = f'{{peer="{escape_label(peer)}"}}'
+            lines.append(f'peer_up{label} {int(series.up)}')
+            if series.heights:
+                heights.append(f'peer_height{label} {series.heights[-1][1]}')
+            if series.rtts:
+                rtts.append(f'peer_rtt_seconds{label} {series.rtts[-1][1]:.6f}')
+            rate = self.sync.get(peer, {}).get('blocks_per_second')
+            if rate is not None:
+                rates.append(f'peer_blocks_per_second{label} {rate}')
+        return '\n'.join(lines + heights + rtts + rates) + '\n'
+
+    async def handle_http(self, reader, writer):
+        """
+        Serve GET /metrics and GET /peers/top[?n=N].
+        """
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            url = urlsplit(parts[1]) if len(parts) >= 2 else urlsplit('/')
+            if parts and parts[0] != 'GET':
+                status, content_type, body = '405 Method Not Allowed', 'text/plain', 'method not allowed\n'
+            elif url.path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.metrics_text()
+            elif url.path == '/peers/top':
+                try:
+                    n = int(parse_qs(url.query).get('n', [self.top_n])[0])
+                except ValueError:
+                    n = None
+                if n is None or n < 1:
+                    status, content_type, body = '400 Bad Request', 'text/plain', 'n must be a positive integer\n'
+                else:
+                    peers = self.top(n)
+                    payload = {'tip': self.ranking.tip, 'updated': self.last_scan_end, 'peers': peers,
+                               'persistent_peers': ','.join(p['peer'] for p in peers)}
+                    status, content_type, body = '200 OK', 'application/json', json.dumps(payload)
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'not found\n'
+            data = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_http, host, port)
+        logging.info(f"Serving /metrics and /peers/top on http://{host}:{port}")
+        async with server:
+            await self.run_forever()
+
+
+# Example: Re-probe top_ips_ports.txt every 2 minutes and serve the best 40 peers on localhost:9110
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monitor peers continuously and serve metrics and the best peer set.')
+    parser.add_argument('peer_list', nargs='?', default='top_ips_ports.txt', help='Peer list file or URL, or an addrbook.json, re-read before every scan')
+    parser.add_argument('--rpc', default=None, help='RPC URL whose /net_info neighbours are added, e.g. http://localhost:26657')
+    parser.add_argument('--depth', type=int, default=0, help='Number of /net_info hops to crawl on every scan')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='Seconds between the start of two scans')
+    parser.add_argument('--top-n', type=int, default=40, help='Number of peers in the best peer set')
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY, help='Samples kept per peer')
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the HTTP endpoint')
+    parser.add_argument('--port', type=int, default=DEFAULT_LISTEN_PORT, help='Port of the HTTP endpoint')
+    parser.add_argument('--output', default=None, help='PEERS file rewritten after every scan')
+    parser.add_argument('--db', default=None, help='Peer database file the results are recorded in')
+    add_probe_arguments(parser)
+    args = parser.parse_args()
+    db = PeerDB(args.db) if args.db else None
+    engine = ProbeEngine(args.concurrency, negative_cache=negative_cache_from_args(args), limits=limits_from_args(args))
+    monitor = PeerMonitor(engine, args.peer_list, args.rpc, args.depth, args.interval, args.top_n, args.history, db, args.output)
+    try:
+        asyncio.run(monitor.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logging.info("Stopped.")
+    finally:
+        if db is not None:
+            db.close()
@@ -1,173 +1,131 @@
-import socket
-import time
+import argparse
 import logging
-import requests
-import sys
-import json
+from cli import add_diversity_arguments, add_pass_arguments, add_probe_arguments, add_scan_arguments, add_stream_arguments, add_target_arguments, add_trace_arguments, limits_from_args, negative_cache_from_args, passes_from_args, recorder_from_args, selector_from_args, stream_from_args, target_from_args
+from peerdb import DEFAULT_FRESH_FOR, PeerDB
+from probe import DEFAULT_CONCURRENCY, ProbeEngine
+from ranking import rank_connections
+from seeds import PeerListFetcher, SeedCollector
+from sharded import make_crawler
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def check_connection(ip, port, timeout=2):
+def parse_and_check(sources, concurrency=DEFAULT_CONCURRENCY, *, depth=1, max_peers=None, db=None, fresh_for=DEFAULT_FRESH_FOR, negative_cache=None, stream=None, processes=1, deadline=None, sampler=None, throughput=None, watcher=None, recorder=None, target=None, limits=None, rpc_urls=None, fetcher=None, statesync=None):
     """
-    Check if the given IP and port can be connected to and measure the connection time.
-    :param ip: IP address
-    :param port: Port number
-    :param timeout: Timeout in seconds
-    :return: Whether the connection is successful and the connection time in seconds
+    Collect the seeds of the sources and check the connectivity and block height of each peer, then crawl
+    their /net_info neighbours hop by hop.
+    :param sources: Peer list files or URLs and address books, see seeds.read_peer_source()
+    :param concurrency: Number of peers probed at the same time
+    :param depth: Number of /net_info hops to expand from the peers in the file
+    :param max_peers: Maximum number of peers to probe, None for no limit
+    :param db: Optional PeerDB, peers probed within fresh_for seconds are not probed again
+    :param fresh_for: Freshness window in seconds
+    :param negative_cache: Optional NegativeCache, endpoints backing off are not dialed
+    :param stream: Optional StreamingOutput receiving every result as soon as it is known
+    :param processes: Number of worker processes probing in parallel, 0 for one per CPU core
+    :param deadline: Optional time budget in seconds, peers not probed by then are skipped
+    :param sampler: Optional SyncSampler ranking the best candidates by their sync rate
+    :param throughput: Optional ThroughputProbe ranking the best candidates by their block download rate
+    :param watcher: Optional BlockWatcher keeping the best set current after the scan
+    :param recorder: Optional PhaseRecorder timing every phase of the probes
+    :param target: Optional QualityTarget, the crawl stops as soon as it is met
+    :param limits: Optional RateLimits pacing the probes per host, per subnet and in total
+    :param rpc_urls: Optional RPC URLs of nodes whose /net_info neighbours are crawled as well
+    :param fetcher: Optional PeerListFetcher downloading peer lists with conditional requests
+    :param statesync: Optional StateSyncFinder writing a [statesync] block for the best RPC servers
+    :return: List of successfully connected peers with their block heights
     """
-    start_time = time.time()
-    try:
-        with socket.create_connection((ip, port), timeout):
-            end_time = time.time()
-            return True, end_time - start_time
-    except (socket.timeout, socket.error) as e:
-        return False, None
-
-def get_peer_info(ip, rpc_port):
-    """
-    Get the peer information from the specified IP address and RPC port.
-    :param ip: IP address
-    :param rpc_port: RPC port
-    :return: List of peer info dictionaries
-    """
-    url_http = f"http://{ip}:{rpc_port}/net_info"
-    try:
-        response = requests.get(url_http, timeout=1)
-        if response.status_code == 200:
-            result = response.json()
-            peers = result["result"]["peers"]
-            peer_info = []
-            for peer in peers:
-                node_id = peer["node_info"]["id"]
-                remote_ip = peer["remote_ip"]
-                rpc_address = peer["node_info"]["other"]["rpc_address"]
-                rpc_port_str = rpc_address.split(":")[-1]
-                if rpc_port_str:  # Check if rpc_port_str is not empty
-                    rpc_port = int(rpc_port_str)
-                else:
-                    logging.error(f"Invalid RPC port received for peer {node_id} at {remote_ip}. Skipping.")
-                    continue                
-                listen_addr = peer["node_info"]["listen_addr"]
-                if listen_addr:  # Check if rpc_port_str is not empty
-                    p2p_port_str = listen_addr.split(":")[-1]
-                    if p2p_port_str:  # Check if rpc_port_str is not empty
-                        p2p_port = int(p2p_port_str)
-                    else:
-                        logging.error(f"Invalid p2p port received for peer {node_id} at {remote_ip}. Skipping.")
-                        continue                
-                else:
-                    logging.error(f"Invalid p2p port received for peer {node_id} at {remote_ip}. Skipping.")
-                    continue                
-                peer_info.append((node_id, remote_ip, rpc_port, p2p_port))
-            logging.info(f"Number of peers for {ip}:{rpc_port} is {len(peer_info)}")  # Add this line to print the number of peers
-            return peer_info
-    except requests.RequestException as e:
-        pass
-    return []
-
-def parse_and_check(file_path):
-    """
-    Parse the file and check the connectivity and response time of each IP and port.
-    :param file_path: Path to the file to be parsed
-    :return: List of successfully connected IP and port with their response times
-    """
-    successful_connections = []
-    seen_peers = set()
-    failed_connections = []
-    with open(file_path, 'r') as file:
-        lines = file.read().split(',')
-    total_lines = len(lines)
-    unique_lines = list(set(lines))  # Remove duplicates
-    for index, line in enumerate(unique_lines):
-        # Extract IP and port
-        parts = line.split('@')
-        if len(parts) == 2:
-            ip_port = parts[1].split(':')
-            if len(ip_port) == 2:
-                ip = ip_port[0]
-                port = int(ip_port[1])
-                # Check connectivity and response time
-                success, response_time = check_connection(ip, port)
-                if success:
-                    block_height, moniker = get_latest_block_height(ip, port + 1)
-                    if block_height is not None:
-                        logging.info(f"block_height {moniker}   {ip}:{port} with {block_height}")
-                        if line not in seen_peers:
-                            successful_connections.append((line, block_height))
-                            seen_peers.add(line)
-                        # Get peer information and check their connectivity
-                        peer_info = get_peer_info(ip, port + 1)
-                        for node_id, remote_ip, rpc_port, p2p_port in peer_info:
-                            peer_key = f"{node_id}@{remote_ip}:{p2p_port}"
-                            
-                            if peer_key not in seen_peers:
-                                peer_success, peer_response_time = check_connection(remote_ip, rpc_port)
-                                if peer_success:
-                                    peer_block_height, peer_moniker = get_latest_block_height(remote_ip, rpc_port)
-                                    if peer_block_height is not None:
-                                        logging.info(f"block_height {peer_moniker}   {remote_ip}:{rpc_port} with {peer_block_height}")
-                                        successful_connections.append((f"{node_id}@{remote_ip}:{p2p_port}", peer_block_height))
-                                        seen_peers.add(peer_key)
-                                else:
-                                    failed_connections.append(f"{node_id}@{remote_ip}:{p2p_port}")
-                else:
-                    failed_connections.append(line)
-        logging.info(f"Processed {index + 1}/{total_lines} entries.")
+    engine = ProbeEngine(concurrency, negative_cache=negative_cache, deadline=deadline, recorder=recorder, limits=limits)
+    crawler = make_crawler(engine, processes, max_depth=depth, max_peers=max_peers, db=db, fresh_for=fresh_for, stream=stream, target=target)
+    for line in SeedCollector(fetcher).collect(sources):
+        crawler.add_seed(line)
+    for rpc_url in rpc_urls or ():
+        crawler.add_rpc_url(rpc_url)
+    successful_connections = crawler.run()
+    if sampler is not None:
+        successful_connections = sampler.run(successful_connections, crawler.rpc_endpoints(), stream, engine)
+    if throughput is not None:
+        successful_connections = throughput.run(successful_connections, crawler.rpc_endpoints(), stream, engine)
+    if statesync is not None:
+        statesync.run(successful_connections, crawler.rpc_endpoints(), engine)
+    if stream is not None:
+        stream.close()
     # Write failed connections to file
     with open('failed_connections.txt', 'w') as file:
-        for line in failed_connections:
+        for line in crawler.failed_connections:
             file.write(line + '\n')
+    if watcher is not None:
+        successful_connections = watcher.run(successful_connections, crawler.rpc_endpoints())
     return successful_connections
 
-def get_latest_block_height(ip, rpc_port):
-    """
-    Get the latest block height from the specified IP address and RPC port.
-    :param ip: IP address
-    :param rpc_port: RPC port
-    :return: Latest block height (int) or None if failed
-    """
-    url_http = f"http://{ip}:{rpc_port}/status"
-    try:
-        response = requests.get(url_http, timeout=1)
-        if response.status_code == 200:
-            result = response.json()
-            latest_block_height = int(result["result"]["sync_info"]["latest_block_height"])
-            moniker = result["result"]["node_info"]["moniker"]
-            return latest_block_height, moniker
-    except requests.RequestException as e:
-        pass   
-    return None, ""
-
-def save_top_connections(connections, output_filename, top_n=40):
+def save_top_connections(connections, output_filename, top_n=40, selector=None):
     """
-    Save the top N connections with the highest block heights to the specified file.
-    :param connections: List of IP and port with their block heights
+    Save the top N connections by composite score to the specified file.
+    The score combines the height lag from the network tip, the median latency,
+    the catching_up status and the failure history of each peer.
+    :param connections: List of (peer, block height, rtt, catching_up, failure rate) tuples
     :param output_filename: Output file name
     :param top_n: Number of connections to save
+    :param selector: Optional DiversitySelector spreading the connections over networks
     """
-    # Sort by block height in descending order
-    connections.sort(key=lambda x: x[1], reverse=True)
     # Keep the top N connections
-    top_connections = connections[:top_n]
+    if selector is None:
+        ranking = rank_connections(connections, top_n)
+        top_connections = ranking.best()
+    else:
+        ranking = rank_connections(connections, len(connections))
+        top_connections = selector.select(ranking.best(), top_n)
     # Write to file
     logging.info(f"Saved top {top_n} connections to {output_filename}.")
     with open(output_filename, 'w') as file:
         first_entry = True
         for conn in top_connections:
-            logging.info(f"Connection: {conn[0]}, Block Height: {conn[1]}")
+            logging.info(f"Connection: {conn[0]}, Block Height: {conn[1]}, Score: {ranking.score(conn):.0f}")
             if first_entry:
                 file.write(conn[0])
                 first_entry = False
             else:
                 file.write(',' + conn[0])
 
-# Example: Read from the URL, keep the top 40 with the highest block heights, and save to 'top_ips_ports.txt'
-try:
-    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
-    output_filename = sys.argv[2] if len(sys.argv) > 2 else 'top_ips_ports_nodinfo.txt'    
-    connections = parse_and_check('top_ips_ports.txt')
-    save_top_connections(connections, output_filename, top_n)
-    logging.info("Processing completed successfully.")
-except Exception as e:
-    logging.error(f"An error occurred: {e}")
+# Example: Read from the file, keep the top 40 with the highest block heights, and save to 'top_ips_ports_nodinfo.txt'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Expand peers through /net_info and keep the highest block heights.')
+    parser.add_argument('top_n', nargs='?', type=int, default=40, help='Number of connections to save')
+    parser.add_argument('output_filename', nargs='?', default='top_ips_ports_nodinfo.txt', help='Output file name')
+    parser.add_argument('--seeds', action='append', default=None, help='Peer list file or URL, or an addrbook.json; may be repeated, defaults to top_ips_ports.txt')
+    parser.add_argument('--rpc', action='append', default=None, help='RPC URL whose /net_info neighbours are crawled as well, e.g. http://localhost:26657; may be repeated')
+    parser.add_argument('--depth', type=int, default=1, help='Number of /net_info hops to crawl')
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes probing in parallel, 0 for one per CPU core')
+    parser.add_argument('--max-peers', type=int, default=None, help='Stop admitting new peers after this many')
+    add_probe_arguments(parser)
+    add_scan_arguments(parser)
+    add_target_arguments(parser)
+    add_pass_arguments(parser)
+    add_diversity_arguments(parser)
+    add_trace_arguments(parser)
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    db = PeerDB(args.db) if args.db else None
+    negative_cache = negative_cache_from_args(args)
+    selector = selector_from_args(args)
+    sampler, throughput, statesync, watcher = passes_from_args(args, args.output_filename, args.top_n, selector)
+    target = target_from_args(args)
+    limits = limits_from_args(args)
+    fetcher = PeerListFetcher(args.seed_cache or None)
+    recorder = recorder_from_args(args)
+    stream = stream_from_args(args, args.output_filename, args.top_n, selector)
+    try:
+        connections = parse_and_check(
+            args.seeds or ['top_ips_ports.txt'], args.concurrency, depth=args.depth, max_peers=args.max_peers, db=db,
+            fresh_for=args.fresh, negative_cache=negative_cache, stream=stream, processes=args.processes, deadline=args.deadline,
+            sampler=sampler, throughput=throughput, watcher=watcher, recorder=recorder, target=target, limits=limits,
+            rpc_urls=args.rpc, fetcher=fetcher, statesync=statesync)
+        save_top_connections(connections, args.output_filename, args.top_n, selector)
+        logging.info("Processing completed successfully.")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+    finally:
+        if recorder is not None:
+            recorder.finish(args.trace)
+        if db is not None:
+            db.close()
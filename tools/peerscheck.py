@@ -1,70 +1,111 @@
-import socket
-import time
+import argparse
+import json
 import logging
-import requests
+from cli import add_handshake_arguments, add_probe_arguments, add_scan_arguments, add_stream_arguments, add_trace_arguments, limits_from_args, negative_cache_from_args, recorder_from_args, stream_from_args
+from peerdb import DEFAULT_FRESH_FOR, PeerDB
+from p2p import HANDSHAKE_AVAILABLE
+from endpoints import parse_peer
+from probe import DEFAULT_CONCURRENCY, ProbeEngine
+from ranking import rank_connections
+from seeds import PeerListFetcher, SeedCollector
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def check_connection(ip, port, timeout=5):
+def parse_and_check(sources, concurrency=DEFAULT_CONCURRENCY, *, db=None, fresh_for=DEFAULT_FRESH_FOR, negative_cache=None, stream=None, deadline=None, handshake=False, network=None, block_version=None, recorder=None, limits=None, rpc_urls=None, fetcher=None):
     """
-    Check if the given IP and port can be connected to and measure the connection time.
-    :param ip: IP address
-    :param port: Port number
-    :param timeout: Timeout in seconds
-    :return: Whether the connection is successful and the connection time in seconds
-    """
-    start_time = time.time()
-    try:
-        with socket.create_connection((ip, port), timeout):
-            end_time = time.time()
-            return True, end_time - start_time
-    except (socket.timeout, socket.error) as e:
-        return False, None
-
-def parse_and_check(url):
-    """
-    Parse the file from the URL and check the connectivity and response time of each IP and port.
-    :param url: URL of the file to be parsed
-    :return: List of successfully connected IP and port with their response times
+    Collect the peers of the seed sources and check the connectivity and response time of each IP and port.
+    :param sources: Peer list URLs or files and address books, see seeds.read_peer_source()
+    :param concurrency: Number of connections checked at the same time
+    :param db: Optional PeerDB, peers probed within fresh_for seconds are not probed again
+    :param fresh_for: Freshness window in seconds
+    :param negative_cache: Optional NegativeCache, endpoints backing off are not dialed
+    :param stream: Optional StreamingOutput receiving every result as soon as it is known
+    :param deadline: Optional time budget in seconds, peers not probed by then are skipped
+    :param handshake: Verify each peer with the P2P handshake instead of a TCP connect
+    :param network: Chain ID the handshake expects, None to accept any
+    :param block_version: Block protocol version the handshake expects, None to accept any
+    :param recorder: Optional PhaseRecorder timing every phase of the probes
+    :param limits: Optional RateLimits pacing the probes per host, per subnet and in total
+    :param rpc_urls: Optional RPC URLs whose /net_info peers are added to the seeds
+    :param fetcher: Optional PeerListFetcher downloading peer lists with conditional requests
+    :return: List of (peer, 0, rtt[, catching_up, failure rate]) connection tuples of the reachable peers;
+             all share height 0, so the ranking orders them by latency and failure history
     """
     successful_connections = []
-    response = requests.get(url)
-    if response.status_code == 200:
-        lines = response.text.split(',')
-        total_lines = len(lines)
-        for index, line in enumerate(lines):
-            # Extract IP and port
-            parts = line.split('@')
-            if len(parts) == 2:
-                ip_port = parts[1].split(':')
-                if len(ip_port) == 2:
-                    ip = ip_port[0]
-                    port = int(ip_port[1])
-                    # Check connectivity and response time
-                    success, response_time = check_connection(ip, port)
-                    if success:
-                        logging.info(f"Successfully connected to {ip}:{port} with response time {response_time:.4f} seconds.")
-                        successful_connections.append((line, response_time))
-                    else:
-                        logging.warning(f"Failed to connect to {ip}:{port}.")
-            # Print progress information
-            logging.info(f"Processed {index + 1}/{total_lines} entries.")
+    lines = SeedCollector(fetcher).collect(sources, rpc_urls or ())
+    if lines:
+        # (ip, port) of the entries probed so far
+        probed = set()
+        engine = ProbeEngine(concurrency, connect_timeout=5, negative_cache=negative_cache, deadline=deadline, recorder=recorder, limits=limits)
+
+        async def check_line(line):
+            peer = parse_peer(line)
+            if peer is None:
+                logging.warning(f"Skipping invalid peer entry {line}.")
+                return
+            node_id, host, port = peer
+            ip = await engine.resolve(host)
+            if ip is None:
+                logging.warning(f"Could not resolve {host}.")
+                if stream is not None:
+                    stream.add({'peer': line, 'ok': False, 'error': 'unresolvable'})
+                return
+            if (ip, port) in probed:
+                # Another entry, e.g. a host name, already stands for this address
+                logging.info(f"{line} resolves to {ip}:{port}, which is already probed.")
+                return
+            probed.add((ip, port))
+            if db is not None and not db.needs_probe(ip, port, fresh_for):
+                # Probed recently, reuse the stored result
+                alive, _, response_time = db.cached_result(ip, port)
+                result = None
+                if alive and response_time is not None:
+                    result = (line, 0) + db.history(ip, port)
+                    successful_connections.append(result)
+                if stream is not None:
+                    stream.add({'peer': line, 'ok': alive, 'cached': True, 'rtt': response_time}, result)
+                return
+            # Check connectivity and response time
+            if handshake:
+                success, response_time, details = await engine.check_handshake(ip, port, node_id, network, block_version)
+            else:
+                success, response_time = await engine.check_connection(ip, port)
+                details = {}
+            result = None
+            if success:
+                logging.info(f"Successfully connected to {ip}:{port} with response time {response_time:.4f} seconds.")
+                if db is not None:
+                    db.record_success(ip, port, node_id, moniker=details.get('moniker'), latency=response_time)
+                    result = (line, 0) + db.history(ip, port)
+                else:
+                    result = (line, 0, response_time)
+                successful_connections.append(result)
+            else:
+                logging.warning(f"Failed to connect to {ip}:{port}{': ' + details['error'] if 'error' in details else ''}.")
+                if db is not None:
+                    db.record_failure(ip, port, node_id)
+            if stream is not None:
+                stream.add(dict({'peer': line, 'ok': success, 'rtt': response_time}, **details), result)
+
+        engine.run(lines, check_line)
+        if stream is not None:
+            stream.close()
     else:
-        logging.error("Failed to retrieve the file from the URL.")
+        logging.error("No seeds could be read from the sources.")
     return successful_connections
 
 def save_top_connections(connections, output_filename, top_n=40):
     """
-    Save the top N connections with the lowest response times to the specified file.
-    :param connections: List of IP and port with their response times
+    Save the top N connections by composite score to the specified file.
+    All peers share height 0, so the score combines the median connect time
+    and the failure history of each peer.
+    :param connections: List of (peer, 0, rtt[, catching_up, failure rate]) tuples
     :param output_filename: Output file name
     :param top_n: Number of connections to save
     """
-    # Sort by response time
-    connections.sort(key=lambda x: x[1])
     # Keep the top N connections
-    top_connections = connections[:top_n]
+    top_connections = rank_connections(connections, top_n).best()
     # Write to file
     with open(output_filename, 'w') as file:
         file.write(','.join([conn[0] for conn in top_connections]))
@@ -80,10 +121,40 @@ def get_moniker_from_json(json_str):
             return "Moniker not found"
     except json.JSONDecodeError:
         return "Invalid JSON"
-# Example: Read from the URL, keep the top 40 with the lowest response times, and save to 'top_ips_ports.txt'
-try:
-    connections = parse_and_check('https://rpc-initia-testnet.trusted-point.com/peers.txt')
-    save_top_connections(connections, 'top_ips_ports.txt', top_n=40)
-    logging.info("Processing completed successfully.")
-except Exception as e:
-    logging.error(f"An error occurred: {e}")
+# Example: Read from the URL, keep the top 40 by connect time and failure history, and save to 'top_ips_ports.txt'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the peers with the lowest connect time.')
+    parser.add_argument('output_filename', nargs='?', default='top_ips_ports.txt', help='Output file name')
+    parser.add_argument('--top-n', type=int, default=40, help='Number of connections to save')
+    parser.add_argument('--url', default='https://rpc-initia-testnet.trusted-point.com/peers.txt', help='URL of the comma separated peer list, empty for none')
+    parser.add_argument('--seeds', action='append', default=None, help='Additional peer list URL or file, or an addrbook.json; may be repeated')
+    parser.add_argument('--rpc', action='append', default=None, help='RPC URL whose /net_info peers are added to the seeds, e.g. http://localhost:26657; may be repeated')
+    add_probe_arguments(parser)
+    add_scan_arguments(parser)
+    add_handshake_arguments(parser)
+    add_trace_arguments(parser)
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    if args.handshake and not HANDSHAKE_AVAILABLE:
+        parser.error('--handshake needs the cryptography package: pip install cryptography')
+    db = PeerDB(args.db) if args.db else None
+    negative_cache = negative_cache_from_args(args)
+    limits = limits_from_args(args)
+    sources = ([args.url] if args.url else []) + (args.seeds or [])
+    fetcher = PeerListFetcher(args.seed_cache or None)
+    recorder = recorder_from_args(args)
+    stream = stream_from_args(args, args.output_filename, args.top_n)
+    try:
+        connections = parse_and_check(
+            sources, args.concurrency, db=db, fresh_for=args.fresh, negative_cache=negative_cache, stream=stream,
+            deadline=args.deadline, handshake=args.handshake, network=args.chain_id, block_version=args.block_version,
+            recorder=recorder, limits=limits, rpc_urls=args.rpc, fetcher=fetcher)
+        save_top_connections(connections, args.output_filename, args.top_n)
+        logging.info("Processing completed successfully.")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+    finally:
+        if recorder is not None:
+            recorder.finish(args.trace)
+        if db is not None:
+            db.close()
@@ -1,119 +1,136 @@
-import socket
-import time
+import argparse
 import logging
-import requests
-import sys
+from cli import add_diversity_arguments, add_handshake_arguments, add_pass_arguments, add_probe_arguments, add_scan_arguments, add_stream_arguments, add_trace_arguments, limits_from_args, negative_cache_from_args, passes_from_args, recorder_from_args, selector_from_args, stream_from_args
+from peerdb import DEFAULT_FRESH_FOR, PeerDB
+from p2p import HANDSHAKE_AVAILABLE
+from endpoints import parse_peer
+from probe import DEFAULT_CONCURRENCY, ProbeEngine
+from ranking import rank_connections
+from seeds import PeerListFetcher, SeedCollector
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def check_connection(ip, port, timeout=2):
+def parse_and_check(sources, concurrency=DEFAULT_CONCURRENCY, *, db=None, fresh_for=DEFAULT_FRESH_FOR, negative_cache=None, stream=None, deadline=None, sampler=None, throughput=None, watcher=None, handshake=False, network=None, block_version=None, recorder=None, limits=None, rpc_urls=None, fetcher=None, statesync=None):
     """
-    Check if the given IP and port can be connected to and measure the connection time.
-    :param ip: IP address
-    :param port: Port number
-    :param timeout: Timeout in seconds
-    :return: Whether the connection is successful and the connection time in seconds
-    """
-    start_time = time.time()
-    try:
-        with socket.create_connection((ip, port), timeout):
-            end_time = time.time()
-            return True, end_time - start_time
-    except (socket.timeout, socket.error) as e:
-        return False, None
-
-def parse_and_check(url):
-    """
-    Parse the file from the URL and check the connectivity and response time of each IP and port.
-    :param url: URL of the file to be parsed
+    Collect the peers of the seed sources and check the connectivity and response time of each IP and port.
+    :param sources: Peer list URLs or files and address books, see seeds.read_peer_source()
+    :param concurrency: Number of peers probed at the same time
+    :param db: Optional PeerDB, peers probed within fresh_for seconds are not probed again
+    :param fresh_for: Freshness window in seconds
+    :param negative_cache: Optional NegativeCache, endpoints backing off are not dialed
+    :param stream: Optional StreamingOutput receiving every result as soon as it is known
+    :param deadline: Optional time budget in seconds, peers not probed by then are skipped
+    :param sampler: Optional SyncSampler ranking the best candidates by their sync rate
+    :param throughput: Optional ThroughputProbe ranking the best candidates by their block download rate
+    :param watcher: Optional BlockWatcher keeping the best set current after the scan
+    :param handshake: Verify each peer with the P2P handshake instead of a TCP connect
+    :param network: Chain ID the handshake expects, None to accept any
+    :param block_version: Block protocol version the handshake expects, None to accept any
+    :param recorder: Optional PhaseRecorder timing every phase of the probes
+    :param limits: Optional RateLimits pacing the probes per host, per subnet and in total
+    :param rpc_urls: Optional RPC URLs whose /net_info peers are added to the seeds
+    :param fetcher: Optional PeerListFetcher downloading peer lists with conditional requests
+    :param statesync: Optional StateSyncFinder writing a [statesync] block for the best RPC servers
     :return: List of successfully connected IP and port with their response times
     """
     successful_connections = []
-    response = requests.get(url)
-    if response.status_code == 200:
-        lines = response.text.split(',')
-        total_lines = len(lines)
-        for index, line in enumerate(lines):
-            # Extract IP and port
-            parts = line.split('@')
-            if len(parts) == 2:
-                ip_port = parts[1].split(':')
-                if len(ip_port) == 2:
-                    ip = ip_port[0]
-                    port = int(ip_port[1])
-                    # Check connectivity and response time
-                    success, response_time = check_connection(ip, port)
-                    if success:
-                        #logging.info(f"Successfully connected to {ip}:{port} with response time {response_time:.4f} seconds.")
-                        block_height,moniker = get_latest_block_height(ip, port+1)
-                        if block_height is not None:
-                            #logging.info(f"block_height {moniker}    {ip}:{port} with {block_height}")
-                            logging.info(f"block_height {moniker}   {ip}:{port} with {block_height}")
-                            successful_connections.append((line,block_height))
-                    #else:
-                        #logging.warning(f"Failed to connect to {ip}:{port}.")
-            # Print progress information
-            logging.info(f"Processed {index + 1}/{total_lines} entries.")
+    # Peer -> (ip, rpc_port) of the peers reached, for sync sampling and watching
+    endpoints = {}
+    lines = SeedCollector(fetcher).collect(sources, rpc_urls or ())
+    if lines:
+        # (ip, port) of the entries probed so far
+        probed = set()
+        engine = ProbeEngine(concurrency, negative_cache=negative_cache, deadline=deadline, recorder=recorder, limits=limits)
+
+        async def check_line(line):
+            peer = parse_peer(line)
+            if peer is None:
+                logging.warning(f"Skipping invalid peer entry {line}.")
+                return
+            node_id, host, port = peer
+            ip = await engine.resolve(host)
+            if ip is None:
+                logging.warning(f"Could not resolve {host}.")
+                if stream is not None:
+                    stream.add({'peer': line, 'ok': False, 'error': 'unresolvable'})
+                return
+            if (ip, port) in probed:
+                # Another entry, e.g. a host name, already stands for this address
+                logging.info(f"{line} resolves to {ip}:{port}, which is already probed.")
+                return
+            probed.add((ip, port))
+            if db is not None and not db.needs_probe(ip, port, fresh_for):
+                # Probed recently, reuse the stored result
+                alive, block_height, response_time = db.cached_result(ip, port)
+                result = None
+                if alive and block_height is not None:
+                    result = (line, block_height) + db.history(ip, port)
+                    successful_connections.append(result)
+                if stream is not None:
+                    stream.add({'peer': line, 'ok': alive, 'cached': True, 'height': block_height, 'rtt': response_time}, result)
+                return
+            # Check connectivity and response time
+            if handshake:
+                success, response_time, details = await engine.check_handshake(ip, port, node_id, network, block_version)
+                if not success:
+                    logging.warning(f"Handshake with {ip}:{port} failed: {details['error']}.")
+            else:
+                success, response_time = await engine.check_connection(ip, port)
+            if success:
+                status = await engine.get_status(ip, port + 1) or {}
+                block_height = status.get('height')
+                if db is not None:
+                    db.record_success(ip, port, node_id, port + 1, status.get('moniker'), block_height, response_time, status.get('catching_up'))
+                result = None
+                if block_height is not None:
+                    logging.info(f"block_height {status['moniker']}   {ip}:{port} with {block_height}")
+                    if db is not None:
+                        result = (line, block_height) + db.history(ip, port)
+                    else:
+                        result = (line, block_height, response_time, status['catching_up'], 0.0)
+                    successful_connections.append(result)
+                    endpoints[line] = (ip, port + 1)
+                if stream is not None:
+                    stream.add(dict({'peer': line, 'ok': block_height is not None, 'rtt': response_time}, **status), result)
+            else:
+                if db is not None:
+                    db.record_failure(ip, port, node_id, port + 1)
+                if stream is not None:
+                    stream.add({'peer': line, 'ok': False})
+
+        engine.run(lines, check_line)
+        if sampler is not None:
+            successful_connections = sampler.run(successful_connections, endpoints, stream, engine)
+        if throughput is not None:
+            successful_connections = throughput.run(successful_connections, endpoints, stream, engine)
+        if statesync is not None:
+            statesync.run(successful_connections, endpoints, engine)
+        if stream is not None:
+            stream.close()
+        if watcher is not None:
+            successful_connections = watcher.run(successful_connections, endpoints)
     else:
-        logging.error("Failed to retrieve the file from the URL.")
+        logging.error("No seeds could be read from the sources.")
     return successful_connections
 
-def get_latest_block_height(ip, rpc_port):
-    """
-    Get the latest block height from the specified IP address and RPC port.
-    Try HTTPS POST request first, and fallback to HTTP GET request if it fails.
-    :param ip: IP address
-    :param rpc_port: RPC port
-    :return: Latest block height (int) or None if failed
-    """
-    url_https = f"https://{ip}:{rpc_port}/status"
-    url_http = f"http://{ip}:{rpc_port}/status"
-    
-    # Try HTTPS POST request
-    #try:
-    #    response = requests.post(url_https, timeout=2)
-    #    if response.status_code == 200:
-    #        result = response.json()
-    #        latest_block_height = int(result["result"]["sync_info"]["latest_block_height"])
-            #logging.info(f"Successfully retrieved latest block height from {ip}:{rpc_port} using HTTPS.")
-    #        return latest_block_height
-        #else:
-            #logging.error(f"Failed to retrieve latest block height from {ip}:{rpc_port} using HTTPS. Status code: {response.status_code}")
-    #except requests.RequestException as e:
-        #logging.error(f"HTTPS request error occurred: {e}")
-     #   aaa=0
-    
-    # Fallback to HTTP GET request
-    try:
-        response = requests.get(url_http, timeout=1)
-        if response.status_code == 200:
-            result = response.json()
-            latest_block_height = int(result["result"]["sync_info"]["latest_block_height"])
-            moniker = result["result"]["node_info"]["moniker"]
-            #node_info = result["result"].get("node_info")
-            #moniker = node_info.get("moniker") if node_info else None
-            #logging.info(f"Successfully retrieved latest block height from {ip}:{rpc_port} using HTTP.")
-            return latest_block_height,moniker
-            #return latest_block_height
-        #else:
-            #logging.error(f"Failed to retrieve latest block height from {ip}:{rpc_port} using HTTP. Status code: {response.status_code}")
-    except requests.RequestException as e:
-        #logging.error(f"HTTP request error occurred: {e}")
-        pass   
-    return None,""
-
-def save_top_connections(connections, output_filename, top_n=40):
+def save_top_connections(connections, output_filename, top_n=40, selector=None):
     """
-    Save the top N connections with the highest block heights to the specified file.
-    :param connections: List of IP and port with their block heights
+    Save the top N connections by composite score to the specified file.
+    The score combines the height lag from the network tip, the median latency,
+    the catching_up status and the failure history of each peer.
+    :param connections: List of (peer, block height, rtt, catching_up, failure rate) tuples
     :param output_filename: Output file name
     :param top_n: Number of connections to save
+    :param selector: Optional DiversitySelector spreading the connections over networks
     """
-    # Sort by block height in descending order
-    connections.sort(key=lambda x: x[1], reverse=True)
     # Keep the top N connections
-    top_connections = connections[:top_n]
+    if selector is None:
+        ranking = rank_connections(connections, top_n)
+        top_connections = ranking.best()
+    else:
+        ranking = rank_connections(connections, len(connections))
+        top_connections = selector.select(ranking.best(), top_n)
     # Write to file
     logging.info(f"Saved top {top_n} connections to {output_filename}.")
     #with open(output_filename, 'w') as file:
@@ -122,31 +139,51 @@ def save_top_connections(connections, output_filename, top_n=40):
     with open(output_filename, 'w') as file:
         first_entry = True
         for conn in top_connections:
-            logging.info(f"Connection: {conn[0]}, Block Height: {conn[1]}")
+            logging.info(f"Connection: {conn[0]}, Block Height: {conn[1]}, Score: {ranking.score(conn):.0f}")
             if first_entry:
                 file.write(conn[0] )
                 first_entry = False
             else:             
                 file.write(','+conn[0] )
-# Example: Read from the URL, keep the top 40 with the lowest response times, and save to 'top_ips_ports.txt'
-try:
-    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
-    output_filename = sys.argv[2] if len(sys.argv) > 2 else 'top_ips_ports.txt'    
-    connections = parse_and_check('https://rpc-initia-testnet.trusted-point.com/peers.txt')
-    save_top_connections(connections, output_filename, top_n)
-    logging.info("Processing completed successfully.")
-except Exception as e:
-    logging.error(f"An error occurred: {e}")
-
-
-
-
-
-
-
-
-
-
-
-
-
+# Example: Read from the URL, keep the top 40 with the highest block heights, and save to 'top_ips_ports.txt'
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep the peers with the highest block heights.')
+    parser.add_argument('top_n', nargs='?', type=int, default=40, help='Number of connections to save')
+    parser.add_argument('output_filename', nargs='?', default='top_ips_ports.txt', help='Output file name')
+    parser.add_argument('--url', default='https://rpc-initia-testnet.trusted-point.com/peers.txt', help='URL of the comma separated peer list, empty for none')
+    parser.add_argument('--seeds', action='append', default=None, help='Additional peer list URL or file, or an addrbook.json; may be repeated')
+    parser.add_argument('--rpc', action='append', default=None, help='RPC URL whose /net_info peers are added to the seeds, e.g. http://localhost:26657; may be repeated')
+    add_probe_arguments(parser)
+    add_scan_arguments(parser)
+    add_handshake_arguments(parser)
+    add_pass_arguments(parser)
+    add_diversity_arguments(parser)
+    add_trace_arguments(parser)
+    add_stream_arguments(parser)
+    args = parser.parse_args()
+    if args.handshake and not HANDSHAKE_AVAILABLE:
+        parser.error('--handshake needs the cryptography package: pip install cryptography')
+    db = PeerDB(args.db) if args.db else None
+    negative_cache = negative_cache_from_args(args)
+    selector = selector_from_args(args)
+    sampler, throughput, statesync, watcher = passes_from_args(args, args.output_filename, args.top_n, selector)
+    limits = limits_from_args(args)
+    sources = ([args.url] if args.url else []) + (args.seeds or [])
+    fetcher = PeerListFetcher(args.seed_cache or None)
+    recorder = recorder_from_args(args)
+    stream = stream_from_args(args, args.output_filename, args.top_n, selector)
+    try:
+        connections = parse_and_check(
+            sources, args.concurrency, db=db, fresh_for=args.fresh, negative_cache=negative_cache, stream=stream,
+            deadline=args.deadline, sampler=sampler, throughput=throughput, watcher=watcher, handshake=args.handshake,
+            network=args.chain_id, block_version=args.block_version, recorder=recorder, limits=limits, rpc_urls=args.rpc,
+            fetcher=fetcher, statesync=statesync)
+        save_top_connections(connections, args.output_filename, args.top_n, selector)
+        logging.info("Processing completed successfully.")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+    finally:
+        if recorder is not None:
+            recorder.finish(args.trace)
+        if db is not None:
+            db.close()
@@ -0,0 +1,251 @@
+import gzip
+import ipaddress
+import logging
+import math
+import socket
+from probe import split_peer
+from timeouts import subnet_key
+
+# Peers kept per /24 (IPv4) or /48 (IPv6) network
+DEFAULT_PREFIX_CAP = 3
+
+# Share of the selected peers that may belong to one autonomous system
+DEFAULT_ASN_SHARE = 0.25
+
+# Index of the child pointers in a trie node [key, length, value, child 0, child 1]
+_CHILD = 3
+
+
+def _common_length(a, b, limit, width):
+    """
+    :return: Number of leading bits a and b share, at most limit
+    """
+    diff = (a ^ b) >> (width - limit) if limit else 0
+    return limit - diff.bit_length()
+
+
+class PrefixTrie:
+    """
+    Path-compressed binary radix trie mapping IP prefixes of one address family to values.
+    Nodes only exist where prefixes branch, so a full routing table of a million prefixes
+    needs at most two million nodes, and a longest-prefix lookup visits one node per branch
+    on the path of the address, at most 33 for IPv4 and 129 for IPv6.
+    """
+
+    def __init__(self, width):
+        """
+        :param width: Address width in bits, 32 for IPv4 and 128 for IPv6
+        """
+        self.width = width
+        self.root = [0, 0, None, None, None]
+        self.size = 0
+
+    def insert(self, key, length, value):
+        """
+        Add or replace a prefix.
+        :param key: Network address as an integer, bits beyond length are ignored
+        :param length: Prefix length in bits
+        :param value: Value returned by lookup() for addresses within the prefix
+        """
+        width = self.width
+        key &= ~((1 << (width - length)) - 1) & ((1 << width) - 1)
+        node = self.root
+        while True:
+            if node[1] == length:
+                if node[2] is None:
+                    self.size += 1
+                node[2] = value
+                return
+            bit = (key >> (width - node[1] - 1)) & 1
+            child = node[_CHILD + bit]
+            if child is None:
+                node[_CHILD + bit] = [key, length, value, None, None]
+                self.size += 1
+                return
+            common = _common_length(child[0], key, min(child[1], length), width)
+            if common == child[1]:
+                node = child
+                continue
+            # Split the edge to the child at the first differing bit or at the new prefix
+            split = [key if common == length else key & ~((1 << (width - common)) - 1), common, value if common == length else None, None, None]
+            split[_CHILD + ((child[0] >> (width - common - 1)) & 1)] = child
+            if common < length:
+                split[_CHILD + ((key >> (width - common - 1)) & 1)] = [key, length, value, None, None]
+            node[_CHILD + bit] = split
+            self.size += 1
+            return
+
+    def lookup(self, address):
+        """
+        :param address: Address as an integer
+        :return: Tuple of (network integer, prefix length, value) of the longest prefix holding the address, or None
+        """
+        width = self.width
+        node = self.root
+        best = None
+        while node is not None:
+            length = node[1]
+            # The bits of the address above the prefix length must equal the node key
+            if length and (node[0] ^ address) >> (width - length):
+                break
+            if node[2] is not None:
+                best = node
+            if length == width:
+                break
+            node = node[_CHILD + ((address >> (width - length - 1)) & 1)]
+        return None if best is None else (best[0], best[1], best[2])
+
+
+class PrefixIndex:
+    """
+    Map IP addresses to the announced prefix and origin AS holding them.
+    Filled from an offline dataset, either lines of `prefix asn` like pyasn's ipasn.dat or
+    tab separated `first_ip last_ip asn ...` ranges like iptoasn.com's ip2asn-combined.tsv,
+    optionally gzipped. Addresses outside the dataset have no AS.
+    """
+
+    def __init__(self):
+        self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        :param filename: Dataset file, see load()
+        :return: PrefixIndex holding the prefixes of the file
+        """
+        index = cls()
+        index.load(filename)
+        return index
+
+    def __len__(self):
+        return self.tries[4].size + self.tries[6].size
+
+    def add(self, network, asn):
+        """
+        :param network: ipaddress.IPv4Network or IPv6Network
+        :param asn: Origin AS number
+        """
+        self.tries[network.version].insert(int(network.network_address), network.prefixlen, asn)
+
+    def load(self, filename):
+        """
+        Add the prefixes of a dataset file; lines that do not parse are skipped.
+        :param filename: Dataset file, gzipped if it ends with .gz
+        :return: Number of prefixes added
+        """
+        added = 0
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt') as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) < 2 or line.startswith((';', '#')):
+                    continue
+                try:
+                    if '/' in fields[0]:
+                        networks, asn = [ipaddress.ip_network(fields[0], strict=False)], int(fields[1])
+                    else:
+                        first, last = ipaddress.ip_address(fields[0]), ipaddress.ip_address(fields[1])
+                        networks, asn = list(ipaddress.summarize_address_range(first, last)), int(fields[2].upper().lstrip('AS'))
+                except (ValueError, TypeError, IndexError):
+                    continue
+                if asn == 0:
+                    # Not routed
+                    continue
+                for network in networks:
+                    self.add(network, asn)
+                    added += 1
+        logging.info(f"Loaded {added} prefixes from {filename}.")
+        return added
+
+    def _match(self, ip):
+        version = 6 if ':' in ip else 4
+        try:
+            packed = socket.inet_pton(socket.AF_INET6 if version == 6 else socket.AF_INET, ip)
+        except OSError:
+            return version, None
+        return version, self.tries[version].lookup(int.from_bytes(packed, 'big'))
+
+    def asn(self, ip):
+        """
+        :param ip: IP address string
+        :return: Origin AS of the longest announced prefix holding the address, or None
+        """
+        match = self._match(ip)[1]
+        return match[2] if match is not None else None
+
+    def lookup(self, ip):
+        """
+        :param ip: IP address string
+        :return: Tuple of (prefix string, origin AS) of the longest announced prefix holding the address, or None
+        """
+        version, match = self._match(ip)
+        if match is None:
+            return None
+        network, length, asn = match
+        network = ipaddress.IPv6Address(network) if version == 6 else ipaddress.IPv4Address(network)
+        return f"{network}/{length}", asn
+
+
+class DiversitySelector:
+    """
+    Pick the best peers while spreading them over independent networks.
+    Peers are taken best first and skipped while their /24 (/48 for IPv6) or their AS
+    already holds its cap, so one provider outage or congested uplink cannot take out a
+    large share of the set. Greedy selection in score order keeps the best peer of every
+    network; if the caps leave the set short, the best skipped peers fill it.
+    """
+
+    def __init__(self, index=None, prefix_cap=DEFAULT_PREFIX_CAP, asn_cap=None):
+        """
+        :param index: Optional PrefixIndex, without one peers are only capped per /24 or /48
+        :param prefix_cap: Peers per /24 or /48 network, None for no cap
+        :param asn_cap: Peers per AS, None for DEFAULT_ASN_SHARE of the selection
+        """
+        self.index = index
+        self.prefix_cap = prefix_cap or None
+        self.asn_cap = asn_cap
+
+    def groups(self, peer):
+        """
+        :param peer: Peer entry of the form id@ip:port
+        :return: Tuple of (subnet, AS or None), or None if the address cannot be parsed
+        """
+        address = split_peer(peer)
+        if address is None:
+            return None
+        ip = address[0]
+        return subnet_key(ip), self.index.asn(ip) if self.index is not None else None
+
+    def select(self, ranked, top_n):
+        """
+        :param ranked: Connection tuples, best first
+        :param top_n: Number of peers to select
+        :return: Selected connection tuples, best first
+        """
+        asn_cap = self.asn_cap or max(1, math.ceil(top_n * DEFAULT_ASN_SHARE))
+        subnets = {}
+        asns = {}
+        selected = []
+        skipped = []
+        for conn in ranked:
+            if len(selected) == top_n:
+                break
+            groups = self.groups(conn[0])
+            if groups is None:
+                selected.append(conn)
+                continue
+            subnet, asn = groups
+            if (self.prefix_cap is not None and subnets.get(subnet, 0) >= self.prefix_cap) or (asn is not None and asns.get(asn, 0) >= asn_cap):
+                skipped.append(conn)
+                continue
+            subnets[subnet] = subnets.get(subnet, 0) + 1
+            if asn is not None:
+                asns[asn] = asns.get(asn, 0) + 1
+            selected.append(conn)
+        if len(selected) < top_n and skipped:
+            logging.info(f"Only {len(selected)} peers fit the network caps, adding {min(len(skipped), top_n - len(selected))} of the best skipped peers.")
+            fill = skipped[:top_n - len(selected)]
+            order = {conn[0]: i for i, conn in enumerate(ranked)}
+            selected = sorted(selected + fill, key=lambda conn: order[conn[0]])
+        logging.info(f"Selected {len(selected)} peers from {len(subnets)} subnets and {len(asns)} known autonomous systems.")
+        return selected
@@ -0,0 +1,827 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from endpoints import SHARED_DNS_CACHE, format_host_port, parse_peer
+from netinfo import NetInfoExtractor, MAX_NET_INFO_BYTES, peer_from_node_info
+from p2p import HANDSHAKE_ERRORS, check_node_info, generate_node_key, p2p_handshake
+from scheduler import THROTTLE_STATUSES, ProbeScheduler
+from timeouts import AdaptiveTimeouts
+from tracing import span
+
+# Default number of probes allowed in flight at the same time
+DEFAULT_CONCURRENCY = 256
+
+# Maximum number of idle keep-alive connections kept open across all hosts
+DEFAULT_MAX_IDLE = 512
+
+# Exceptions raised by a failed or misbehaving peer
+PROBE_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError)
+
+# Largest response body read into memory, larger responses count as failed
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+# Bytes read at a time from a body passed to a sink
+READ_CHUNK = 65536
+
+# Times a request answered with 429 or 503 is sent again, once its host and subnet are paced
+THROTTLE_RETRIES = 1
+
+# JSON-RPC 2.0 batch fetching /status and /net_info in one round trip
+STATUS_NET_INFO_BATCH = json.dumps([
+    {'jsonrpc': '2.0', 'id': 0, 'method': 'status', 'params': {}},
+    {'jsonrpc': '2.0', 'id': 1, 'method': 'net_info', 'params': {}},
+]).encode()
+
+
+def split_peer(line):
+    """
+    Split a peer entry of the form id@host:port into its host and port, see endpoints.parse_peer().
+    :param line: Peer entry
+    :return: Tuple of (host, port) or None if the entry cannot be parsed
+    """
+    peer = parse_peer(line)
+    return peer[1:] if peer is not None else None
+
+
+def parse_status(response):
+    """
+    Extract the sync status from a /status JSON-RPC response.
+    :param response: Decoded JSON-RPC response
+    :return: Dictionary with height, moniker, catching_up, latest_block_time and network, or None if invalid
+    """
+    try:
+        sync_info = response["result"]["sync_info"]
+        node_info = response["result"]["node_info"]
+        return {
+            'height': int(sync_info["latest_block_height"]),
+            'moniker': node_info["moniker"],
+            'catching_up': bool(sync_info.get("catching_up", False)),
+            'latest_block_time': sync_info.get("latest_block_time"),
+            'network': node_info.get("network"),
+        }
+    except PROBE_ERRORS:
+        return None
+
+
+def parse_peer_info(response):
+    """
+    Extract the connected peers from a /net_info JSON-RPC response.
+    :param response: Decoded JSON-RPC response
+    :return: List of Peers
+    """
+    try:
+        peers = response["result"]["peers"]
+    except PROBE_ERRORS:
+        return []
+    peer_info = []
+    for peer in peers:
+        try:
+            node_info, remote_ip = peer["node_info"], peer["remote_ip"]
+        except PROBE_ERRORS:
+            logging.error("Invalid peer entry received. Skipping.")
+            continue
+        entry = peer_from_node_info(node_info, remote_ip)
+        if entry is not None:
+            peer_info.append(entry)
+    return peer_info
+
+
+def parse_batch(status, body, count):
+    """
+    Match the responses of a JSON-RPC batch to its requests.
+    :param status: HTTP status code
+    :param body: Response body
+    :param count: Number of requests in the batch, with ids 0 to count - 1
+    :return: List of responses in request order, or None if the endpoint does not support batches
+    """
+    if status != 200:
+        return None
+    try:
+        responses = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(responses, list):
+        return None
+    by_id = {response.get('id'): response for response in responses if isinstance(response, dict)}
+    if not all(i in by_id for i in range(count)):
+        return None
+    return [by_id[i] for i in range(count)]
+
+
+async def read_http_response(reader, sink=None, max_body=MAX_BODY_BYTES):
+    """
+    Read one HTTP/1.1 response from the stream.
+    Handles Content-Length, chunked and read-until-close bodies.
+    :param reader: asyncio StreamReader
+    :param sink: Optional function receiving the body in chunks as they arrive instead of returning it
+    :param max_body: Largest body in bytes; a longer body raises ValueError, or with a sink is cut there
+    :return: Status code, dictionary of lower-cased headers and the body bytes; with a sink b'', or None if the body was cut
+    """
+    status, headers = await read_http_head(reader)
+    return status, headers, await read_http_body(reader, headers, sink, max_body)
+
+
+async def read_http_head(reader):
+    """
+    Read the status line and headers of an HTTP/1.1 response.
+    :param reader: asyncio StreamReader
+    :return: Status code and dictionary of lower-cased headers
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise asyncio.IncompleteReadError(b'', None)
+    status = int(status_line.split(None, 2)[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def read_http_body(reader, headers, sink=None, max_body=MAX_BODY_BYTES):
+    """
+    Read the body of an HTTP/1.1 response whose head was read, see read_http_response().
+    :return: Body bytes; with a sink b'', or None if the body was cut
+    """
+    chunks = []
+    received = 0
+
+    def take(data):
+        nonlocal received
+        received += len(data)
+        if received > max_body:
+            if sink is None:
+                raise ValueError(f"Response body larger than {max_body} bytes")
+            data = data[:len(data) - (received - max_body)]
+        if sink is None:
+            chunks.append(data)
+        elif data:
+            sink(data)
+        return received <= max_body
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size = int(((await reader.readline()).split(b';')[0]).strip(), 16)
+            if size == 0:
+                # Skip optional trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            while size:
+                data = await reader.readexactly(min(size, READ_CHUNK))
+                size -= len(data)
+                if not take(data):
+                    return None
+            await reader.readexactly(2)
+    elif 'content-length' in headers:
+        size = int(headers['content-length'])
+        if sink is None:
+            if size > max_body:
+                raise ValueError(f"Response body larger than {max_body} bytes")
+            return await reader.readexactly(size)
+        while size:
+            data = await reader.readexactly(min(size, READ_CHUNK))
+            size -= len(data)
+            if not take(data):
+                return None
+    else:
+        while True:
+            data = await reader.read(READ_CHUNK)
+            if not data:
+                break
+            if not take(data):
+                return None
+    return b''.join(chunks)
+
+
+async def hedged(attempt, timeout, hedge_after=None, discard=None):
+    """
+    Run attempt() and, if it is still running after hedge_after seconds, a second
+    attempt in parallel. The first attempt to succeed wins and the other is cancelled.
+    :param attempt: Coroutine function starting one attempt
+    :param timeout: Overall timeout in seconds
+    :param hedge_after: Delay in seconds before the second attempt, None for no hedging
+    :param discard: Optional function called with the result of an attempt that succeeded too late
+    :return: Result of the winning attempt
+    """
+    if hedge_after is None:
+        return await asyncio.wait_for(attempt(), timeout)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    hedge_at = loop.time() + hedge_after
+    tasks = [asyncio.ensure_future(attempt())]
+    try:
+        while True:
+            wait_until = end if hedge_at is None else min(end, hedge_at)
+            done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            error = None
+            # Collect finished attempts before checking the clock, the loop may have been busy
+            for task in done:
+                tasks.remove(task)
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not tasks:
+                # A failed attempt, e.g. a refused connection, is not hedged
+                raise error
+            if loop.time() >= end:
+                raise asyncio.TimeoutError()
+            if hedge_at is not None and loop.time() >= hedge_at:
+                hedge_at = None
+                tasks.append(asyncio.ensure_future(attempt()))
+    finally:
+        for task in tasks:
+            task.cancel()
+            task.add_done_callback(lambda t: _discard_late(t, discard))
+
+
+def _discard_late(task, discard):
+    if task.cancelled() or task.exception() is not None:
+        return
+    if discard is not None:
+        discard(task.result())
+
+
+class RpcConnection:
+    """
+    One keep-alive HTTP/1.1 connection to an RPC endpoint.
+    """
+
+    def __init__(self, ip, port, reader, writer, connect_time, recorder=None):
+        self.ip = ip
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        # Time taken by the TCP handshake, used as the latency sample of the host
+        self.connect_time = connect_time
+        self.reused = False
+        self.reusable = True
+        # Optional PhaseRecorder timing the requests
+        self.recorder = recorder
+
+    @classmethod
+    async def open(cls, ip, port, timeout, recorder=None):
+        """
+        Connect to the endpoint and measure the connection time.
+        :param ip: IP address
+        :param port: Port number
+        :param timeout: Timeout in seconds
+        :param recorder: Optional PhaseRecorder timing the connect and the requests
+        :return: Open RpcConnection
+        """
+        start_time = time.perf_counter()
+        with span(recorder, 'connect', ip):
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        return cls(ip, port, reader, writer, time.perf_counter() - start_time, recorder)
+
+    async def request(self, path, body=None, sink=None, max_body=MAX_BODY_BYTES):
+        """
+        Send a GET request, or a POST if a body is given, and read the response, keeping the connection open.
+        :param path: Request path, e.g. /status
+        :param body: Optional JSON body bytes
+        :param sink: Optional function receiving the response body in chunks, see read_http_response()
+        :param max_body: Largest response body in bytes
+        :return: Status code and body bytes; with a sink b'', or None if the body was cut
+        """
+        with span(self.recorder, 'ttfb', self.ip):
+            if body is None:
+                self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {format_host_port(self.ip, self.port)}\r\n\r\n".encode())
+            else:
+                self.writer.write(f"POST {path} HTTP/1.1\r\nHost: {format_host_port(self.ip, self.port)}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+            status, headers = await read_http_head(self.reader)
+        with span(self.recorder, 'body', self.ip):
+            # The error page of a host asking to slow down does not go to the sink, so the request can be sent again
+            body = await read_http_body(self.reader, headers, sink if status not in THROTTLE_STATUSES else None, max_body)
+        framed = 'content-length' in headers or 'chunked' in headers.get('transfer-encoding', '').lower()
+        # The rest of a cut body is still in the stream
+        if body is None or not framed or headers.get('connection', '').lower() == 'close':
+            self.reusable = False
+        return status, body
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections grouped per host, so the connectivity check,
+    /status and /net_info of one peer share a single TCP handshake.
+    """
+
+    def __init__(self, connect_timeout, max_idle=DEFAULT_MAX_IDLE, recorder=None):
+        """
+        :param connect_timeout: Timeout in seconds for opening a new connection
+        :param max_idle: Maximum number of idle connections, the least recently used are closed first
+        :param recorder: Optional PhaseRecorder timing the connects and requests
+        """
+        self.connect_timeout = connect_timeout
+        self.max_idle = max_idle
+        self.recorder = recorder
+        self._idle = OrderedDict()
+        self._idle_count = 0
+
+    async def acquire(self, ip, port, timeout=None):
+        """
+        Take an idle connection to the host or open a new one.
+        :param ip: IP address
+        :param port: Port number
+        :param timeout: Connect timeout in seconds, defaults to connect_timeout
+        :return: RpcConnection
+        """
+        key = (ip, port)
+        conns = self._idle.get(key)
+        while conns:
+            conn = conns.pop()
+            self._idle_count -= 1
+            if not conns:
+                del self._idle[key]
+            if not conn.reader.at_eof():
+                conn.reused = True
+                return conn
+            conn.close()
+            conns = self._idle.get(key)
+        return await RpcConnection.open(ip, port, timeout or self.connect_timeout, self.recorder)
+
+    def release(self, conn):
+        """
+        Return a connection to the pool, or close it if it cannot be reused.
+        :param conn: RpcConnection
+        """
+        if not conn.reusable:
+            conn.close()
+            return
+        key = (conn.ip, conn.port)
+        self._idle.setdefault(key, []).append(conn)
+        self._idle.move_to_end(key)
+        self._idle_count += 1
+        while self._idle_count > self.max_idle:
+            oldest_key, conns = next(iter(self._idle.items()))
+            conns.pop(0).close()
+            self._idle_count -= 1
+            if not conns:
+                del self._idle[oldest_key]
+
+    def discard(self, ip, port):
+        """
+        Close the idle connections of a host that will not be queried again.
+        :param ip: IP address
+        :param port: Port number
+        """
+        for conn in self._idle.pop((ip, port), []):
+            conn.close()
+            self._idle_count -= 1
+
+    def close(self):
+        for conns in self._idle.values():
+            for conn in conns:
+                conn.close()
+        self._idle.clear()
+        self._idle_count = 0
+
+
+class ProbeEngine:
+    """
+    Probe many peers at once with asyncio.
+    Every network operation holds one slot of a shared ProbeScheduler, so no more than
+    `concurrency` operations are in flight at the same time and hosts and subnets are
+    paced within their rate limits; a hedged connect shares the slot of the connect it
+    backs up.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, connect_timeout=2, http_timeout=1, negative_cache=None, adaptive=True, deadline=None, recorder=None, limits=None, dns=SHARED_DNS_CACHE):
+        """
+        :param concurrency: Maximum number of network operations in flight
+        :param connect_timeout: Timeout in seconds for a TCP connect to an unknown host
+        :param http_timeout: Timeout in seconds for a whole RPC request to an unknown host
+        :param negative_cache: Optional NegativeCache consulted before dialing an endpoint
+        :param adaptive: Learn per-host and per-subnet timeouts from the observed latencies
+        :param deadline: Optional time budget in seconds for the whole run, counted from now
+        :param recorder: Optional PhaseRecorder timing every phase of every probe
+        :param limits: Optional RateLimits per host, per subnet and in total, see scheduler.RateLimits
+        :param dns: DnsCache resolving host names, shared by all engines by default
+        """
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.http_timeout = http_timeout
+        self.negative_cache = negative_cache
+        self.timeouts = AdaptiveTimeouts(connect_timeout, http_timeout) if adaptive else None
+        self.deadline = deadline
+        self.recorder = recorder
+        self.expires_at = time.time() + deadline if deadline else None
+        self.scheduler = ProbeScheduler(concurrency, limits)
+        self.dns = dns
+        self._pool = None
+        self._node_key = None
+        # (ip, rpc_port) -> whether the endpoint answered a JSON-RPC batch
+        self.batch_support = {}
+
+    @asynccontextmanager
+    async def slot(self, ip):
+        """
+        Hold one slot of the scheduler, timing the wait for it as the queue phase.
+        :param ip: Host the operation talks to
+        """
+        with span(self.recorder, 'queue', ip):
+            await self.scheduler.acquire(ip)
+        try:
+            yield
+        finally:
+            self.scheduler.release()
+
+    async def resolve(self, host):
+        """
+        :param host: Host name or IP address
+        :return: First address of the host, IPv4 preferred, or None if it does not resolve
+        """
+        if self.dns.cached(host):
+            addresses = await self.dns.resolve(host)
+        else:
+            with span(self.recorder, 'dns', host):
+                addresses = await self.dns.resolve(host)
+        return addresses[0] if addresses else None
+
+    def spawn(self, concurrency, **kwargs):
+        """
+        New engine for a later pass of the same run, e.g. sync rate sampling, with its own
+        concurrency. It keeps the negative cache, the recorder, the rate limits, the DNS
+        cache and the time left until the deadline.
+        :param concurrency: Maximum number of network operations in flight
+        :param kwargs: Other ProbeEngine arguments, e.g. http_timeout
+        :return: ProbeEngine
+        """
+        return ProbeEngine(concurrency, negative_cache=self.negative_cache, deadline=self.remaining(), recorder=self.recorder,
+                           limits=self.scheduler.limits, dns=self.dns, **kwargs)
+
+    def remaining(self):
+        """
+        :return: Seconds left until the deadline, or None without a deadline
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def _connect_timeouts(self, ip):
+        if self.timeouts is None:
+            return self.connect_timeout, None
+        return self.timeouts.connect(ip)
+
+    def _request_timeout(self, ip):
+        if self.timeouts is None:
+            return self.http_timeout
+        return self.timeouts.request(ip)
+
+    def _observe_connect(self, ip, seconds):
+        if self.timeouts is not None:
+            self.timeouts.connect_times.observe(ip, seconds)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ConnectionPool(self.connect_timeout, recorder=self.recorder)
+        return self._pool
+
+    async def check_connection(self, ip, port):
+        """
+        Check if the given IP and port can be connected to and measure the connection time.
+        :param ip: IP address
+        :param port: Port number
+        :return: Whether the connection is successful and the connection time in seconds
+        """
+        if not self._may_dial(ip, port):
+            return False, None
+
+        async def attempt():
+            start_time = time.perf_counter()
+            with span(self.recorder, 'connect', ip):
+                _, writer = await asyncio.open_connection(ip, port)
+            return writer, time.perf_counter() - start_time
+
+        timeout, hedge_after = self._connect_timeouts(ip)
+        async with self.slot(ip):
+            try:
+                writer, connect_time = await hedged(attempt, timeout, hedge_after, lambda result: result[0].close())
+            except PROBE_ERRORS:
+                self._dial_failed(ip, port)
+                return False, None
+            writer.close()
+            self._observe_connect(ip, connect_time)
+            self._dial_succeeded(ip, port)
+            return True, connect_time
+
+    @property
+    def node_key(self):
+        # One throwaway identity per engine for the P2P handshakes
+        if self._node_key is None:
+            self._node_key = generate_node_key()
+        return self._node_key
+
+    async def check_handshake(self, ip, port, node_id=None, network=None, block_version=None):
+        """
+        Run the P2P secret connection handshake, read the NodeInfo of the peer and check it.
+        Unlike check_connection() this proves that a CometBFT node holding the key of
+        node_id answers on the port. Needs the cryptography package.
+        :param ip: IP address
+        :param port: P2P port
+        :param node_id: Expected node ID, from the id@ prefix of the peer entry
+        :param network: Expected chain ID, None to accept any
+        :param block_version: Expected block protocol version, None to accept any
+        :return: Whether the peer passed, the handshake time in seconds, and a dictionary with
+                 its node_id, moniker, network and version and, if it did not pass, the error
+        """
+        if not self._may_dial(ip, port):
+            return False, None, {'error': 'backing off'}
+        timeout, _ = self._connect_timeouts(ip)
+        async with self.slot(ip):
+            try:
+                node_info, authenticated_id, connect_time, handshake_time = await p2p_handshake(ip, port, self.node_key, timeout, recorder=self.recorder)
+            except PROBE_ERRORS + HANDSHAKE_ERRORS as e:
+                self._dial_failed(ip, port)
+                return False, None, {'error': f"{e.__class__.__name__} {e}".strip()}
+        self._observe_connect(ip, connect_time)
+        details = {'node_id': authenticated_id, 'moniker': node_info['moniker'], 'network': node_info['network'], 'version': node_info['version']}
+        error = check_node_info(node_info, authenticated_id, node_id, network, block_version)
+        if error is not None:
+            # Reachable, but not the peer we are looking for
+            self._dial_failed(ip, port)
+            details['error'] = error
+            return False, handshake_time, details
+        self._dial_succeeded(ip, port)
+        return True, handshake_time, details
+
+    async def check_rpc(self, ip, rpc_port):
+        """
+        Open a keep-alive connection to the RPC endpoint and leave it in the pool for
+        the following /status and /net_info requests.
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :return: Whether the connection is successful and the connection time in seconds
+        """
+        if not self._may_dial(ip, rpc_port):
+            return False, None
+        timeout, hedge_after = self._connect_timeouts(ip)
+        async with self.slot(ip):
+            try:
+                conn = await hedged(lambda: self.pool.acquire(ip, rpc_port, timeout), timeout, hedge_after, RpcConnection.close)
+            except PROBE_ERRORS:
+                self._dial_failed(ip, rpc_port)
+                return False, None
+            self.pool.release(conn)
+            if not conn.reused:
+                self._observe_connect(ip, conn.connect_time)
+            self._dial_succeeded(ip, rpc_port)
+            return True, conn.connect_time
+
+    def _may_dial(self, ip, port):
+        return self.negative_cache is None or self.negative_cache.should_probe(ip, port)
+
+    def _dial_failed(self, ip, port):
+        if self.negative_cache is not None:
+            self.negative_cache.record_failure(ip, port)
+
+    def _dial_succeeded(self, ip, port):
+        if self.negative_cache is not None:
+            self.negative_cache.record_success(ip, port)
+
+    async def get_json(self, ip, port, path):
+        """
+        Fetch a JSON document over plain HTTP, reusing a pooled connection to the host.
+        :param ip: IP address
+        :param port: Port number
+        :param path: Request path, e.g. /status
+        :return: Decoded JSON or None if the request failed
+        """
+        async with self.slot(ip):
+            try:
+                status, body = await self._fetch(ip, port, path)
+                if status != 200:
+                    return None
+                with span(self.recorder, 'parse', ip):
+                    return json.loads(body)
+            except PROBE_ERRORS:
+                return None
+
+    async def download(self, ip, port, path, max_bytes, timeout):
+        """
+        Fetch a response body and time its transfer, for throughput measurements.
+        The body is counted and dropped as it arrives, so large responses cost no memory.
+        :param ip: IP address
+        :param port: Port number
+        :param path: Request path, e.g. /block?height=1
+        :param max_bytes: Body bytes after which the transfer is cut
+        :param timeout: Timeout in seconds for the whole transfer
+        :return: Status code or None if the request failed, body bytes received, seconds to the
+                 first body byte or None, and seconds until the transfer ended
+        """
+        received = 0
+        first_byte = None
+        status = None
+        start_time = None
+
+        def count(data):
+            nonlocal received, first_byte
+            if first_byte is None:
+                first_byte = time.monotonic() - start_time
+            received += len(data)
+
+        async with self.slot(ip):
+            # Timed from here, waiting for a slot is not part of the transfer
+            start_time = time.monotonic()
+            try:
+                status, _ = await asyncio.wait_for(self._request(ip, port, path, sink=count, max_body=max_bytes), timeout)
+            except PROBE_ERRORS:
+                pass
+        if status in THROTTLE_STATUSES:
+            self.scheduler.slow_down(ip)
+        return status, received, first_byte, time.monotonic() - start_time
+
+    async def _fetch(self, ip, port, path, body=None, sink=None, max_body=MAX_BODY_BYTES):
+        """
+        Run one request with the adaptive timeout of the host. A host answering 429 or 503
+        slows down the scheduler and is asked again once it is paced.
+        :return: Status code and body bytes, see RpcConnection.request()
+        """
+        for attempt in range(THROTTLE_RETRIES + 1):
+            start_time = time.perf_counter()
+            response = await asyncio.wait_for(self._request(ip, port, path, body, sink, max_body), self._request_timeout(ip))
+            if self.timeouts is not None:
+                self.timeouts.request_times.observe(ip, time.perf_counter() - start_time)
+            if response[0] not in THROTTLE_STATUSES:
+                break
+            self.scheduler.slow_down(ip)
+            if attempt < THROTTLE_RETRIES:
+                await self.scheduler.pace(ip)
+        return response
+
+    async def _request(self, ip, port, path, body=None, sink=None, max_body=MAX_BODY_BYTES):
+        started = False
+
+        def forward(data):
+            nonlocal started
+            started = True
+            sink(data)
+
+        while True:
+            conn = await self.pool.acquire(ip, port)
+            try:
+                status, response = await conn.request(path, body, forward if sink is not None else None, max_body)
+            except BaseException as e:
+                conn.close()
+                # The host may have dropped an idle connection, retry once on a fresh one
+                # unless part of the body already went to the sink
+                if conn.reused and not started and isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+                    continue
+                raise
+            self.pool.release(conn)
+            return status, response
+
+    def close_host(self, ip, port):
+        """
+        Drop the pooled connections of a host once it has been fully probed.
+        :param ip: IP address
+        :param port: Port number
+        """
+        self.pool.discard(ip, port)
+
+    async def get_status(self, ip, rpc_port):
+        """
+        Get the sync status from the specified IP address and RPC port.
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :return: Dictionary with height, moniker, catching_up, latest_block_time and network, or None if failed
+        """
+        return parse_status(await self.get_json(ip, rpc_port, '/status'))
+
+    async def get_latest_block_height(self, ip, rpc_port):
+        """
+        Get the latest block height from the specified IP address and RPC port.
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :return: Latest block height (int) and moniker, or None and "" if failed
+        """
+        status = await self.get_status(ip, rpc_port)
+        if status is None:
+            return None, ""
+        return status['height'], status['moniker']
+
+    async def get_peer_info(self, ip, rpc_port):
+        """
+        Get the peer information from the specified IP address and RPC port.
+        The response is parsed as it arrives and only the peer addresses are decoded;
+        a response cut by the size cap, the timeout or the host yields the peers read before.
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :return: List of Peers
+        """
+        extractor = NetInfoExtractor()
+        status = None
+        async with self.slot(ip):
+            try:
+                status, body = await self._fetch(ip, rpc_port, '/net_info', None, extractor.feed, MAX_NET_INFO_BYTES)
+            except PROBE_ERRORS:
+                body = None
+        extractor.close(body is not None)
+        peer_info = []
+        if status in (None, 200):
+            if extractor.extracted:
+                peer_info = extractor.peers
+            elif extractor.complete:
+                # Not laid out like CometBFT, decode the whole document
+                try:
+                    peer_info = parse_peer_info(json.loads(extractor.residual))
+                except ValueError:
+                    pass
+        logging.info(f"Number of peers for {ip}:{rpc_port} is {len(peer_info)}")
+        return peer_info
+
+    async def get_status_and_peers(self, ip, rpc_port):
+        """
+        Get the sync status and the peer information in one JSON-RPC batch POST,
+        whose net_info part is parsed as it arrives like in get_peer_info().
+        Endpoints that reject batches, e.g. behind a GET-only proxy, are remembered
+        and queried with two separate GET requests from then on.
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :return: Status dictionary or None, and list of Peers
+        """
+        key = (ip, rpc_port)
+        if self.batch_support.get(key, True):
+            extractor = NetInfoExtractor()
+            async with self.slot(ip):
+                try:
+                    status, body = await self._fetch(ip, rpc_port, '/', STATUS_NET_INFO_BATCH, extractor.feed, MAX_NET_INFO_BYTES)
+                except PROBE_ERRORS:
+                    return None, []
+            extractor.close(body is not None)
+            if status == 200 and not extractor.complete:
+                # Cut at the size cap, the status may be missing but the peers read so far are kept
+                status = await self.get_status(ip, rpc_port)
+                return status, extractor.peers if status is not None else []
+            # The residual is the batch with an empty peers list if the peers were extracted
+            responses = parse_batch(status, extractor.residual, 2)
+            if responses is not None:
+                self.batch_support[key] = True
+                peer_info = extractor.peers if extractor.extracted else parse_peer_info(responses[1])
+                logging.info(f"Number of peers for {ip}:{rpc_port} is {len(peer_info)}")
+                return parse_status(responses[0]), peer_info
+            logging.info(f"{ip}:{rpc_port} does not accept JSON-RPC batches, falling back to GET requests.")
+            self.batch_support[key] = False
+        status = await self.get_status(ip, rpc_port)
+        if status is None:
+            return None, []
+        return status, await self.get_peer_info(ip, rpc_port)
+
+    async def map(self, items, func):
+        """
+        Run func(item) for every item concurrently and log progress as they finish.
+        Items not finished when the deadline expires are cancelled.
+        :param items: List of items to process
+        :param func: Coroutine function called with each item
+        """
+        total = len(items)
+        done = 0
+        tasks = [asyncio.ensure_future(func(item)) for item in items]
+        try:
+            for task in asyncio.as_completed(tasks, timeout=self.remaining()):
+                await task
+                done += 1
+                logging.info(f"Processed {done}/{total} entries.")
+        except asyncio.TimeoutError:
+            logging.warning(f"Deadline of {self.deadline}s reached after {done}/{total} entries, keeping the results found so far.")
+        finally:
+            # Stop the probes still in flight at the deadline
+            for task in tasks:
+                task.cancel()
+
+    def run(self, items, func):
+        """
+        Blocking wrapper around map() for the command line tools.
+        :param items: List of items to process
+        :param func: Coroutine function called with each item
+        """
+        self.run_async(self.map(items, func))
+
+    def run_async(self, coro):
+        """
+        Run a coroutine on a new event loop and close the pooled connections afterwards.
+        :param coro: Coroutine to run
+        :return: Result of the coroutine
+        """
+        self.scheduler.reset()
+        self.dns.reset()
+        self._pool = None
+        return asyncio.run(self._run(coro))
+
+    async def _run(self, coro):
+        try:
+            return await coro
+        finally:
+            self.pool.close()
+            if self.negative_cache is not None:
+                self.negative_cache.save()
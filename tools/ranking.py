@@ -0,0 +1,135 @@
+import heapq
+import itertools
+
+# Score weights, expressed in milliseconds of round trip time so they can be compared
+# Cost of one block behind the observed network tip
+LAG_WEIGHT_MS = 100
+# Cost of a peer reporting catching_up = true
+CATCHING_UP_PENALTY_MS = 10000
+# Cost of a peer that failed every probe so far, scaled by its failure rate
+FAILURE_PENALTY_MS = 2000
+# Round trip time assumed for peers without a latency sample
+UNKNOWN_RTT_MS = 1000
+# Cost of a sampled peer that stopped advancing or whose latest block is stale
+STALLED_PENALTY_MS = 10000
+# Seconds over which a sampled peer syncing slower than the network is projected to fall behind
+SYNC_HORIZON = 60
+
+
+def connection_fields(conn):
+    """
+    Unpack a connection tuple of the form
+    (peer, block height[, rtt[, catching_up[, failure rate[, rate deficit[, stalled[, transfer delay]]]]]]]).
+    Rate deficit and stalled are only set for peers whose sync rate was sampled, see
+    syncrate.py, the transfer delay for peers whose block downloads were timed, see throughput.py.
+    :param conn: Connection tuple
+    :return: Tuple of (peer, block height, rtt in seconds or None, catching_up, failure rate,
+             blocks per second slower than the network, stalled, seconds of transfer delay)
+    """
+    padded = tuple(conn) + (None, False, 0.0, 0.0, False, 0.0)[len(conn) - 2:]
+    return padded[:8]
+
+
+def peer_goodness(height, rtt=None, catching_up=False, failure_rate=0.0, rate_deficit=0.0, stalled=False, transfer_delay=0.0):
+    """
+    Score a peer, higher is better.
+    The block height is weighted linearly, so the ordering of two peers does not
+    depend on the network tip and the score never has to be recomputed when a
+    higher tip is observed.
+    :param height: Latest block height
+    :param rtt: Median round trip time in seconds, None if unknown
+    :param catching_up: Whether the peer reports catching_up
+    :param failure_rate: Share of failed probes in the peer history, 0 to 1
+    :param rate_deficit: Blocks per second the peer syncs slower than the network, costed as
+                         the blocks it falls behind within SYNC_HORIZON
+    :param stalled: Whether the peer stopped advancing or its latest block is stale
+    :param transfer_delay: Seconds the peer takes longer than a typical one to send a batch of
+                           blocks, costed at most STALLED_PENALTY_MS as a peer that cannot push
+                           blocks is no better than a stalled one
+    :return: Goodness in milliseconds
+    """
+    rtt_ms = UNKNOWN_RTT_MS if rtt is None else rtt * 1000
+    goodness = height * LAG_WEIGHT_MS - rtt_ms - (failure_rate or 0.0) * FAILURE_PENALTY_MS
+    goodness -= (rate_deficit or 0.0) * SYNC_HORIZON * LAG_WEIGHT_MS
+    if catching_up:
+        goodness -= CATCHING_UP_PENALTY_MS
+    if stalled:
+        goodness -= STALLED_PENALTY_MS
+    goodness -= min(STALLED_PENALTY_MS, (transfer_delay or 0.0) * 1000)
+    return goodness
+
+
+class TopN:
+    """
+    Keep the N best peers of a stream of results in a bounded min-heap.
+    Each push is O(log N), so ranking n peers costs O(n log N) instead of a full sort.
+    Pushing a peer again replaces its earlier result. Peers evicted earlier are not
+    recalled when a kept peer gets worse, so rebuild the ranking for each new scan.
+    """
+
+    def __init__(self, n):
+        """
+        :param n: Number of peers to keep
+        """
+        self.n = n
+        self.tip = 0
+        self._heap = []
+        # Peer -> its live heap entry; replaced entries stay in the heap as stale until popped
+        self._current = {}
+        self._stale = 0
+        self._counter = itertools.count()
+
+    def push(self, conn):
+        """
+        Add or update a result.
+        :param conn: Connection tuple, see connection_fields()
+        """
+        peer, height = conn[0], conn[1]
+        self.tip = max(self.tip, height)
+        if self._current.pop(peer, None) is not None:
+            self._stale += 1
+        entry = (peer_goodness(*connection_fields(conn)[1:]), next(self._counter), peer, tuple(conn))
+        self._current[peer] = entry
+        heapq.heappush(self._heap, entry)
+        # Evict the worst live entries beyond n
+        while len(self._heap) - self._stale > self.n:
+            evicted = heapq.heappop(self._heap)
+            if self._current.get(evicted[2]) is evicted:
+                del self._current[evicted[2]]
+            else:
+                self._stale -= 1
+        if self._stale > self.n:
+            self._heap = list(self._current.values())
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def __len__(self):
+        return len(self._current)
+
+    def score(self, conn):
+        """
+        Score of a result relative to the tip observed so far, lower is better.
+        :param conn: Connection tuple
+        :return: Score in milliseconds, 0 for a peer at tip with zero latency
+        """
+        return self.tip * LAG_WEIGHT_MS - peer_goodness(*connection_fields(conn)[1:])
+
+    def best(self):
+        """
+        :return: The kept connection tuples, best first
+        """
+        return [e[3] for e in sorted(self._current.values(), key=lambda e: (-e[0], e[1]))]
+
+
+def rank_connections(connections, top_n):
+    """
+    Select the top N connections by composite score of height lag, latency,
+    catching_up status, failure history and, where measured, sync rate and throughput.
+    :param connections: List of connection tuples
+    :param top_n: Number of connections to keep
+    :return: TopN holding the selected connections
+    """
+    top = TopN(top_n)
+    for conn in connections:
+        top.push(conn)
+    return top
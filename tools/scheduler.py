@@ -0,0 +1,286 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from timeouts import subnet_key
+
+# Network operations per second started towards one IP address
+DEFAULT_HOST_RATE = 10
+
+# Network operations per second started towards one /24 (IPv4) or /48 (IPv6) network
+DEFAULT_SUBNET_RATE = 200
+
+# Seconds of the rate a bucket may spend at once after being idle
+BURST_SECONDS = 1
+
+# HTTP status codes of a host asking us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# Lowest share of its configured rate a throttled bucket is slowed down to
+MIN_RATE_SHARE = 1 / 16
+
+# Share of the configured rate a slowed down bucket recovers per second
+RECOVERY_PER_SECOND = 0.02
+
+# Seconds after slowing down a bucket during which further requests to slow down are ignored,
+# so the answers to one burst halve the rate only once
+SLOW_DOWN_HOLD = 1
+
+# Host and subnet buckets tracked, the least recently used are forgotten first
+MAX_TRACKED = 65536
+
+# Priority of the operations of the current task, lower goes first; the crawler sets it per peer
+PRIORITY = ContextVar('probe_priority', default=0)
+
+
+class TokenBucket:
+    """
+    Allow `rate` operations per second on average and bursts of BURST_SECONDS worth of them.
+    """
+    __slots__ = ('base', 'rate', 'capacity', 'tokens', 'stamp', 'slowed_at')
+
+    def __init__(self, rate, now):
+        self.base = rate
+        self.rate = rate
+        self.capacity = max(1.0, rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.stamp = now
+        self.slowed_at = None
+
+    def wait(self, now):
+        """
+        :param now: time.monotonic() value
+        :return: Seconds until a token is available, 0 if one is
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        if self.rate < self.base:
+            # Additive increase after a slow-down
+            self.rate = min(self.base, self.rate + self.base * RECOVERY_PER_SECOND * (now - self.stamp))
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def slow_down(self, now):
+        """
+        Halve the rate and drop the burst, like TCP congestion control backs off on loss.
+        :param now: time.monotonic() value
+        :return: Whether the bucket was slowed down, False within SLOW_DOWN_HOLD of the last time
+        """
+        if self.slowed_at is not None and now - self.slowed_at < SLOW_DOWN_HOLD:
+            return False
+        self.wait(now)
+        self.slowed_at = now
+        self.rate = max(self.base * MIN_RATE_SHARE, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        return True
+
+
+class RateLimits:
+    """
+    Rate limits of a ProbeScheduler, in network operations per second; None for no limit.
+    """
+
+    def __init__(self, host_rate=DEFAULT_HOST_RATE, subnet_rate=DEFAULT_SUBNET_RATE, global_rate=None):
+        """
+        :param host_rate: Operations per second towards one IP address
+        :param subnet_rate: Operations per second towards one /24 or /48 network
+        :param global_rate: Operations per second in total
+        """
+        self.host_rate = host_rate or None
+        self.subnet_rate = subnet_rate or None
+        self.global_rate = global_rate or None
+
+    def split(self, processes):
+        """
+        :param processes: Number of processes sharing the limits, each probing its own subnets
+        :return: RateLimits of one process; only the global rate is divided
+        """
+        return RateLimits(self.host_rate, self.subnet_rate, self.global_rate / processes if self.global_rate else None)
+
+
+class ProbeScheduler:
+    """
+    Admit network operations by priority within a concurrency limit and token buckets
+    per IP address, per subnet and in total.
+    Hosting providers rate-limit or firewall a scanner that bursts into many of their
+    hosts, which makes live peers look dead, so operations are paced instead. Waiters
+    held back by the bucket of their host or subnet are parked until it refills, so
+    they do not block operations towards other networks. A host answering 429 or 503
+    halves the rate of its host and subnet buckets, which recover linearly over time.
+    """
+
+    def __init__(self, concurrency, limits=None):
+        """
+        :param concurrency: Maximum number of operations in flight
+        :param limits: RateLimits, defaults to RateLimits()
+        """
+        self.concurrency = concurrency
+        self.limits = limits if limits is not None else RateLimits()
+        self.in_flight = 0
+        self.throttled = 0
+        self._global = None
+        self._hosts = OrderedDict()
+        self._subnets = OrderedDict()
+        # Heap of (priority, seq, ip, future) of the operations waiting for a slot
+        self._waiting = []
+        # Bucket key -> waiters parked until the bucket refills, and heap of (time, key) to unpark them
+        self._parked = {}
+        self._wakeups = []
+        self._order = itertools.count()
+        self._timer = None
+
+    def reset(self):
+        """
+        Forget the waiters of a finished event loop; the buckets are kept.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self.in_flight = 0
+        self._waiting = []
+        self._parked = {}
+        self._wakeups = []
+
+    @staticmethod
+    def _bucket(buckets, key, rate, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, now)
+            if len(buckets) > MAX_TRACKED:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def _buckets(self, ip, now):
+        """
+        :return: List of (key, TokenBucket) limiting the host, from the most specific
+        """
+        limits = self.limits
+        buckets = []
+        if limits.host_rate:
+            buckets.append((ip, self._bucket(self._hosts, ip, limits.host_rate, now)))
+        if limits.subnet_rate:
+            subnet = subnet_key(ip)
+            buckets.append((subnet, self._bucket(self._subnets, subnet, limits.subnet_rate, now)))
+        return buckets
+
+    def _global_wait(self, now):
+        if not self.limits.global_rate:
+            return 0.0
+        if self._global is None:
+            self._global = TokenBucket(self.limits.global_rate, now)
+        return self._global.wait(now)
+
+    def _blocked(self, ip, now):
+        """
+        :return: Key of the bucket holding the host back the longest and its wait in seconds, or None
+        """
+        blocking = None
+        for key, bucket in self._buckets(ip, now):
+            wait = bucket.wait(now)
+            if wait > 0 and (blocking is None or wait > blocking[1]):
+                blocking = (key, wait)
+        return blocking
+
+    def _grant(self, ip):
+        for _, bucket in self._buckets(ip, time.monotonic()):
+            bucket.take()
+        if self._global is not None:
+            self._global.take()
+        self.in_flight += 1
+
+    async def acquire(self, ip, priority=None):
+        """
+        Wait until an operation towards the host may start.
+        :param ip: Host the operation talks to
+        :param priority: Priority, lower goes first; defaults to PRIORITY of the current task
+        """
+        now = time.monotonic()
+        if not self._waiting and not self._parked and self.in_flight < self.concurrency \
+                and not self._global_wait(now) and self._blocked(ip, now) is None:
+            self._grant(ip)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (PRIORITY.get() if priority is None else priority, next(self._order), ip, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted at the moment the waiter was cancelled, give the slot back
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """
+        End an operation started with acquire().
+        """
+        self.in_flight -= 1
+        if self._waiting or self._parked:
+            self._dispatch()
+
+    async def pace(self, ip):
+        """
+        Wait for the host and subnet buckets to allow one more operation within a slot
+        that is already held, e.g. to send a throttled request again.
+        :param ip: Host the operation talks to
+        """
+        while True:
+            blocking = self._blocked(ip, time.monotonic())
+            if blocking is None:
+                break
+            await asyncio.sleep(blocking[1])
+        for _, bucket in self._buckets(ip, time.monotonic()):
+            bucket.take()
+
+    def slow_down(self, ip):
+        """
+        Slow down the buckets of a host that asked us to, e.g. with HTTP 429.
+        :param ip: Host
+        """
+        self.throttled += 1
+        now = time.monotonic()
+        for key, bucket in self._buckets(ip, now):
+            if bucket.slow_down(now):
+                logging.info(f"{ip} asked to slow down, pacing {key} at {bucket.rate:.1f} operations/s.")
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._wakeups and self._wakeups[0][0] <= now:
+            _, key = heapq.heappop(self._wakeups)
+            for entry in self._parked.pop(key, ()):
+                heapq.heappush(self._waiting, entry)
+        wake_at = self._wakeups[0][0] if self._wakeups else None
+        while self._waiting and self.in_flight < self.concurrency:
+            priority, seq, ip, future = entry = self._waiting[0]
+            if future.done():
+                heapq.heappop(self._waiting)
+                continue
+            wait = self._global_wait(now)
+            if wait:
+                # Nothing may start before the global bucket refills
+                wake_at = now + wait if wake_at is None else min(wake_at, now + wait)
+                break
+            heapq.heappop(self._waiting)
+            blocking = self._blocked(ip, now)
+            if blocking is not None:
+                key, wait = blocking
+                if key not in self._parked:
+                    self._parked[key] = []
+                    heapq.heappush(self._wakeups, (now + wait, key))
+                    wake_at = now + wait if wake_at is None else min(wake_at, now + wait)
+                self._parked[key].append(entry)
+                continue
+            self._grant(ip)
+            future.set_result(None)
+        if wake_at is not None and self.in_flight < self.concurrency:
+            self._timer = asyncio.get_running_loop().call_later(max(0.0, wake_at - now), self._dispatch)
@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from endpoints import format_host_port, parse_peer, split_peer_list
+from netinfo import MAX_NET_INFO_BYTES, NetInfoExtractor
+from probe import parse_peer_info
+
+# File keeping the ETag, Last-Modified date and body of every fetched peer list
+DEFAULT_SEED_CACHE_FILE = 'seed_cache.json'
+
+# Seconds to wait for a peer list or /net_info response
+FETCH_TIMEOUT = 30
+
+# Peer lists downloaded at the same time
+MAX_FETCH_WORKERS = 8
+
+# Characters read from an address book at a time
+ADDRBOOK_CHUNK = 64 * 1024
+
+# Longest address book entry in characters; a longer one means the file is not an address book
+MAX_ADDRBOOK_ENTRY = 64 * 1024
+
+ADDRS_START = re.compile(r'"addrs"\s*:\s*\[')
+ENTRY_SEPARATOR = re.compile(r'[\s,]*')
+
+_decoder = json.JSONDecoder()
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def read_addrbook(filename):
+    """
+    Stream the peers of a CometBFT address book (config/addrbook.json) without loading the file.
+    Entries are decoded one at a time, so memory stays at one chunk however large the book is.
+    :param filename: Address book file
+    :return: Generator of id@ip:port entries
+    """
+    with open(filename, 'r', encoding='utf-8', errors='replace') as file:
+        text = ''
+        pos = 0
+        in_addrs = False
+        eof = False
+        while not eof:
+            chunk = file.read(ADDRBOOK_CHUNK)
+            eof = not chunk
+            text = text[pos:] + chunk
+            pos = 0
+            if not in_addrs:
+                match = ADDRS_START.search(text)
+                if match is None:
+                    # Keep enough text to find a key split across two chunks
+                    pos = max(0, len(text) - 16)
+                    continue
+                in_addrs = True
+                pos = match.end()
+            while True:
+                pos = ENTRY_SEPARATOR.match(text, pos).end()
+                if pos < len(text) and text[pos] == ']':
+                    return
+                try:
+                    entry, end = _decoder.raw_decode(text, pos)
+                except ValueError:
+                    if eof or len(text) - pos > MAX_ADDRBOOK_ENTRY:
+                        logging.warning(f"Stopped reading {filename} at an entry that does not parse.")
+                        return
+                    # The entry continues in the next chunk
+                    break
+                pos = end
+                try:
+                    addr = entry['addr']
+                    yield f"{addr['id']}@{format_host_port(addr['ip'], addr['port'])}"
+                except (KeyError, TypeError):
+                    continue
+        logging.warning(f"{filename} has no addrs list, it is not an address book.")
+
+
+def read_net_info(rpc_url, timeout=FETCH_TIMEOUT):
+    """
+    Read the peers a node is connected to from its RPC /net_info, parsing the response as it arrives.
+    :param rpc_url: RPC URL, e.g. http://localhost:26657
+    :param timeout: Seconds to wait for the response
+    :return: List of id@ip:port entries with the P2P ports of the peers
+    """
+    extractor = NetInfoExtractor()
+    received = 0
+    complete = True
+    with requests.get(rpc_url.rstrip('/') + '/net_info', stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(ADDRBOOK_CHUNK):
+            extractor.feed(chunk)
+            received += len(chunk)
+            if received > MAX_NET_INFO_BYTES:
+                complete = False
+                break
+    extractor.close(complete)
+    if extractor.extracted:
+        peers = extractor.peers
+    elif extractor.complete:
+        peers = parse_peer_info(json.loads(extractor.residual))
+    else:
+        peers = []
+    return [peer.key for peer in peers]
+
+
+class PeerListFetcher:
+    """
+    Download peer lists with conditional requests.
+    The ETag and Last-Modified date of every list are kept with its body, so a list
+    that did not change since the last run costs a 304 answer instead of the whole
+    download. A list that cannot be fetched falls back to the copy from the last run.
+    """
+
+    def __init__(self, path=None, timeout=FETCH_TIMEOUT):
+        """
+        :param path: Optional JSON file the cache is loaded from and saved to, in memory only without
+        :param timeout: Seconds to wait for a response
+        """
+        self.path = path
+        self.timeout = timeout
+        # URL -> {'etag': ..., 'last_modified': ..., 'body': ...}
+        self.entries = {}
+        self.not_modified = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable seed cache {path}: {e}")
+
+    def fetch(self, url):
+        """
+        :param url: URL of the peer list
+        :return: Body of the list, the cached one if it did not change
+        """
+        cached = self.entries.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        try:
+            response = requests.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached is not None:
+                self.not_modified += 1
+                logging.info(f"{url} did not change since the last run.")
+                return cached['body']
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            logging.warning(f"Could not fetch {url}, using the copy from the last run: {e}")
+            return cached['body']
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if etag or last_modified:
+            self.entries[url] = {'etag': etag, 'last_modified': last_modified, 'body': response.text}
+        else:
+            self.entries.pop(url, None)
+        return response.text
+
+    def fetch_all(self, urls):
+        """
+        Download several peer lists at the same time.
+        :param urls: List of URLs
+        :return: List of (url, body) tuples, body None if the list could not be fetched
+        """
+        def fetch(url):
+            try:
+                return url, self.fetch(url)
+            except requests.RequestException as e:
+                logging.error(f"Could not fetch {url}: {e}")
+                return url, None
+
+        if not urls:
+            return []
+        with ThreadPoolExecutor(min(len(urls), MAX_FETCH_WORKERS)) as pool:
+            return list(pool.map(fetch, urls))
+
+    def save(self):
+        """
+        Write the cache to its file.
+        """
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.path)
+
+
+def read_peer_source(source, fetcher=None):
+    """
+    Read the peer entries of one seed source.
+    :param source: http(s) URL of a peer list such as peers.txt, an address book ending in .json,
+        or a file with a peer list separated by commas or newlines
+    :param fetcher: Optional PeerListFetcher downloading URLs with conditional requests
+    :return: Iterable of peer entries
+    """
+    if is_url(source):
+        if fetcher is not None:
+            return split_peer_list(fetcher.fetch(source))
+        response = requests.get(source, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+        return split_peer_list(response.text)
+    if source.endswith('.json'):
+        return read_addrbook(source)
+    with open(source, 'r') as file:
+        return split_peer_list(file.read())
+
+
+class SeedCollector:
+    """
+    Merge the seed entries of several sources and drop duplicates before any probing.
+    Entries are keyed by host and port, so the same node listed by peers.txt, the address
+    book and /net_info is probed once; an entry with a node ID replaces one without.
+    """
+
+    def __init__(self, fetcher=None):
+        """
+        :param fetcher: Optional PeerListFetcher for the URL sources
+        """
+        self.fetcher = fetcher
+        # (host, port) -> normalized entry, in the order the sources were added
+        self._entries = {}
+        self.duplicates = 0
+        self.invalid = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def entries(self):
+        """
+        :return: List of the unique entries, id@host:port or host:port without a node ID
+        """
+        return list(self._entries.values())
+
+    def add(self, entry):
+        """
+        :param entry: Peer entry of the form [id@]host:port
+        :return: Whether the entry was new
+        """
+        parsed = parse_peer(entry)
+        if parsed is None:
+            self.invalid += 1
+            return False
+        node_id, host, port = parsed
+        key = (host, port)
+        address = format_host_port(host, port)
+        existing = self._entries.get(key)
+        if existing is not None:
+            self.duplicates += 1
+            if node_id is not None and '@' not in existing:
+                self._entries[key] = f"{node_id}@{address}"
+            return False
+        self._entries[key] = f"{node_id}@{address}" if node_id is not None else address
+        return True
+
+    def add_entries(self, entries, source):
+        """
+        :param entries: Iterable of peer entries
+        :param source: Name of the source for the log
+        :return: Number of new entries
+        """
+        added = sum(self.add(entry) for entry in entries)
+        logging.info(f"{source}: {added} new seeds, {len(self._entries)} in total.")
+        return added
+
+    def add_source(self, source):
+        """
+        Add the entries of a peer list file or URL, or of an address book; see read_peer_source().
+        :param source: File path or URL
+        :return: Number of new entries, 0 if the source could not be read
+        """
+        try:
+            return self.add_entries(read_peer_source(source, self.fetcher), source)
+        except (OSError, requests.RequestException) as e:
+            logging.error(f"Could not read seeds from {source}: {e}")
+            return 0
+
+    def add_urls(self, urls):
+        """
+        Add the entries of several peer list URLs, downloaded at the same time.
+        :param urls: List of URLs
+        :return: Number of new entries
+        """
+        fetcher = self.fetcher if self.fetcher is not None else PeerListFetcher()
+        added = 0
+        for url, body in fetcher.fetch_all(urls):
+            if body is not None:
+                added += self.add_entries(split_peer_list(body), url)
+        return added
+
+    def add_net_info(self, rpc_url):
+        """
+        Add the peers a node is connected to.
+        :param rpc_url: RPC URL of the node, e.g. http://localhost:26657
+        :return: Number of new entries, 0 if the node did not answer
+        """
+        try:
+            return self.add_entries(read_net_info(rpc_url), f"{rpc_url}/net_info")
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"Could not read the peers of {rpc_url}: {e}")
+            return 0
+
+    def collect(self, sources=(), rpc_urls=()):
+        """
+        Add every kind of source and save the fetcher's cache. URLs are downloaded at the same time.
+        :param sources: Peer list files, URLs or address books, see read_peer_source()
+        :param rpc_urls: RPC URLs whose /net_info peers are added
+        :return: List of the unique entries
+        """
+        for source in sources:
+            if not is_url(source):
+                self.add_source(source)
+        self.add_urls([source for source in sources if is_url(source)])
+        for rpc_url in rpc_urls:
+            self.add_net_info(rpc_url)
+        if self.fetcher is not None:
+            self.fetcher.save()
+        logging.info(f"Collected {len(self._entries)} unique seeds, {self.duplicates} duplicates and {self.invalid} invalid entries dropped.")
+        return self.entries
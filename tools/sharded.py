@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import zlib
+from crawler import Crawler, probe_peer
+from peerdb import DEFAULT_FRESH_FOR
+from probe import ProbeEngine
+from scheduler import PRIORITY
+from timeouts import subnet_key
+from tracing import PhaseRecorder
+
+
+def default_processes():
+    return os.cpu_count() or 1
+
+
+def make_crawler(engine, processes=1, **kwargs):
+    """
+    Create a single-process Crawler or, for more than one process, a ShardedCrawler.
+    :param engine: ProbeEngine used for the probes
+    :param processes: Number of worker processes, 0 for one per CPU core
+    :param kwargs: Crawler keyword arguments
+    :return: Crawler
+    """
+    if processes == 1 or (processes == 0 and default_processes() == 1):
+        return Crawler(engine, **kwargs)
+    return ShardedCrawler(engine, processes or default_processes(), **kwargs)
+
+
+def _shard_main(tasks, results, concurrency, connect_timeout, http_timeout, record_phases=False, limits=None):
+    """
+    Entry point of a worker process: probe the peers sent by the coordinator until it sends None.
+    :param tasks: multiprocessing.Queue of (task_id, ip, rpc_port, expand_only, expand, priority) tuples
+    :param results: multiprocessing.Queue receiving (task_id, outcome, error, spans) tuples
+    :param concurrency: Number of network operations in flight in this process
+    :param connect_timeout: Timeout in seconds for a TCP connect
+    :param http_timeout: Timeout in seconds for a whole RPC request
+    :param record_phases: Time the phases of the probes and send the spans along with the results
+    :param limits: RateLimits of this process
+    """
+    engine = ProbeEngine(concurrency, connect_timeout, http_timeout, recorder=PhaseRecorder(keep_spans=True) if record_phases else None, limits=limits)
+    try:
+        engine.run_async(_shard_loop(engine, tasks, results))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _shard_loop(engine, tasks, results):
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def probe(task_id, ip, rpc_port, expand_only, expand, priority):
+        PRIORITY.set(priority)
+        try:
+            outcome = await probe_peer(engine, ip, rpc_port, expand_only, expand)
+        except Exception as e:
+            outcome, error = None, str(e)
+        else:
+            error = None
+        # The spans of all probes finished since the last result, the coordinator merges them
+        spans = engine.recorder.drain() if engine.recorder is not None else None
+        results.put((task_id, outcome, error, spans))
+
+    while True:
+        task = await loop.run_in_executor(None, tasks.get)
+        if task is None:
+            break
+        future = asyncio.ensure_future(probe(*task))
+        pending.add(future)
+        future.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+
+
+class ShardedCrawler(Crawler):
+    """
+    Crawler that spreads the probes over a pool of worker processes, for peer lists
+    too large for one CPU core. Each worker runs its own asyncio probe loop and decodes
+    the /net_info responses; the coordinator keeps the global frontier, deduplication,
+    peer database, negative cache and top-N ranking. Peers are assigned to workers by
+    subnet, so all requests to one host come from the same process and the latencies
+    a worker learns for a subnet apply to all its hosts.
+    """
+
+    def __init__(self, engine, processes=None, max_depth=1, max_peers=None, db=None, fresh_for=DEFAULT_FRESH_FOR, stream=None, target=None):
+        """
+        :param engine: ProbeEngine whose concurrency and timeouts apply to every worker process
+        :param processes: Number of worker processes, defaults to the number of CPU cores
+        :param max_depth: Number of /net_info hops to expand from the seeds
+        :param max_peers: Maximum number of peers admitted to the frontier, None for no limit
+        :param db: Optional PeerDB, its known peers are seeds and fresh entries are not probed again
+        :param fresh_for: Freshness window in seconds for entries of the database
+        :param stream: Optional StreamingOutput receiving every result as soon as it is known
+        :param target: Optional QualityTarget, the crawl stops once it is met
+        """
+        super().__init__(engine, max_depth, max_peers, db, fresh_for, stream, target)
+        self.processes = processes or default_processes()
+        self.parallel = engine.concurrency * self.processes
+        self._tasks = []
+        self._results = None
+        self._futures = {}
+        self._task_ids = itertools.count()
+
+    async def crawl(self):
+        """
+        Start the worker processes, crawl from the seeds until the frontier is empty and stop the workers.
+        :return: List of (peer, block height, rtt, catching_up, failure rate) tuples
+        """
+        context = multiprocessing.get_context('spawn')
+        self._results = context.Queue()
+        self._tasks = [context.Queue() for _ in range(self.processes)]
+        workers = [context.Process(target=_shard_main, daemon=True,
+                                   args=(tasks, self._results, self.engine.concurrency, self.engine.connect_timeout, self.engine.http_timeout,
+                                         self.engine.recorder is not None, self.engine.scheduler.limits.split(self.processes)))
+                   for tasks in self._tasks]
+        for worker in workers:
+            worker.start()
+        logging.info(f"Started {self.processes} probe processes with {self.engine.concurrency} probes in flight each.")
+        reader = asyncio.ensure_future(self._read_results())
+        try:
+            return await super().crawl()
+        finally:
+            for tasks in self._tasks:
+                tasks.put(None)
+            # Wake up the reader so it can exit
+            self._results.put(None)
+            await reader
+            loop = asyncio.get_running_loop()
+            for worker in workers:
+                # Past the deadline or once the target is met the probes still running in the workers are not waited for
+                if not self.expired and not self.satisfied:
+                    await loop.run_in_executor(None, worker.join, 5)
+                if worker.is_alive():
+                    worker.terminate()
+
+    async def _read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self._results.get)
+            if message is None:
+                break
+            task_id, outcome, error, spans = message
+            if spans:
+                self.engine.recorder.extend(spans)
+            future = self._futures.pop(task_id, None)
+            if future is None or future.done():
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(outcome)
+
+    async def _probe(self, ip, rpc_port, expand_only, expand):
+        negative_cache = self.engine.negative_cache
+        if negative_cache is not None and not negative_cache.should_probe(ip, rpc_port):
+            return False, None, None, []
+        task_id = next(self._task_ids)
+        future = self._futures[task_id] = asyncio.get_running_loop().create_future()
+        self._tasks[zlib.crc32(subnet_key(ip).encode()) % self.processes].put((task_id, ip, rpc_port, expand_only, expand, PRIORITY.get()))
+        outcome = await future
+        if negative_cache is not None:
+            if outcome[0]:
+                negative_cache.record_success(ip, rpc_port)
+            else:
+                negative_cache.record_failure(ip, rpc_port)
+        return outcome
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import time
+from endpoints import format_host_port
+from output import write_atomic
+from probe import ProbeEngine
+from ranking import rank_connections
+
+# Best peers of the snapshot tested as state sync RPC servers
+DEFAULT_CANDIDATES = 32
+
+# Blocks below the tip the trust height is taken at; the snapshot the node restores must be above it
+DEFAULT_TRUST_OFFSET = 2000
+
+# RPC servers written to the [statesync] block; CometBFT needs at least two
+DEFAULT_SERVERS = 4
+MIN_SERVERS = 2
+
+# Trusting period written to the [statesync] block, shorter than the unbonding period of the chain
+DEFAULT_TRUST_PERIOD = '168h0m0s'
+
+# Candidates tested at the same time
+DEFAULT_CHECKS = 16
+
+
+def parse_earliest_height(response):
+    """
+    :param response: Decoded /status JSON-RPC response
+    :return: Lowest block height the node still stores, or None if unknown
+    """
+    try:
+        return int(response['result']['sync_info']['earliest_block_height'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_block_hash(response, height):
+    """
+    :param response: Decoded /block JSON-RPC response
+    :param height: Requested height
+    :return: Hash of the block at the height in upper case hex, or None if the response holds another block
+    """
+    try:
+        if int(response['result']['block']['header']['height']) != height:
+            return None
+        return response['result']['block_id']['hash'].upper()
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+def parse_commit_hash(response, height):
+    """
+    :param response: Decoded /commit JSON-RPC response
+    :param height: Requested height
+    :return: Block hash the commit at the height signs in upper case hex, or None if invalid
+    """
+    try:
+        commit = response['result']['signed_header']['commit']
+        if int(commit['height']) != height:
+            return None
+        return commit['block_id']['hash'].upper()
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+def format_statesync(config):
+    """
+    :param config: Dictionary with rpc_servers, trust_height, trust_hash and trust_period
+    :return: [statesync] block for config.toml
+    """
+    return (
+        "[statesync]\n"
+        "enable = true\n"
+        f"rpc_servers = \"{','.join(config['rpc_servers'])}\"\n"
+        f"trust_height = {config['trust_height']}\n"
+        f"trust_hash = \"{config['trust_hash']}\"\n"
+        f"trust_period = \"{config['trust_period']}\"\n"
+    )
+
+
+class StateSyncFinder:
+    """
+    Find RPC servers a new node can state sync from.
+    The light client of state sync verifies the snapshot against a trusted header: it
+    fetches /block and /commit at the trust height from the RPC servers and needs every
+    server to agree on its hash. Pruned nodes fail the first and nodes on a fork or
+    behind a broken proxy the second, so the best candidates of the snapshot are asked
+    for both at a height a little below the tip. Servers holding the height and signing
+    the hash most of them agree on are ranked by the time they took to answer.
+    """
+
+    def __init__(self, filename, candidates=DEFAULT_CANDIDATES, trust_offset=DEFAULT_TRUST_OFFSET, servers=DEFAULT_SERVERS, trust_period=DEFAULT_TRUST_PERIOD, checks=DEFAULT_CHECKS):
+        """
+        :param filename: File the [statesync] block is written to
+        :param candidates: Number of the best peers of the snapshot to test
+        :param trust_offset: Blocks below the tip the trust height is taken at
+        :param servers: Number of RPC servers written to the [statesync] block
+        :param trust_period: Trusting period written to the [statesync] block
+        :param checks: Candidates tested at the same time
+        """
+        self.filename = filename
+        self.candidates = candidates
+        self.trust_offset = trust_offset
+        self.servers = max(MIN_SERVERS, servers)
+        self.trust_period = trust_period
+        self.checks = checks
+        # Peer -> dictionary with earliest, hash, seconds and error of the test
+        self.results = {}
+        self.config = None
+
+    async def check(self, engine, ip, rpc_port, trust_height):
+        """
+        Test one RPC server at the trust height.
+        :param engine: ProbeEngine used for the requests
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :param trust_height: Trust height
+        :return: Dictionary with earliest, hash, seconds and error, error None if the server qualifies
+        """
+        result = {'earliest': None, 'hash': None, 'seconds': None, 'error': None}
+        try:
+            status = await engine.get_json(ip, rpc_port, '/status')
+            result['earliest'] = parse_earliest_height(status) if status is not None else None
+            if result['earliest'] is not None and result['earliest'] > trust_height:
+                result['error'] = 'pruned'
+                return result
+            start_time = time.monotonic()
+            block, commit = await asyncio.gather(engine.get_json(ip, rpc_port, f'/block?height={trust_height}'),
+                                                 engine.get_json(ip, rpc_port, f'/commit?height={trust_height}'))
+            result['seconds'] = round(time.monotonic() - start_time, 4)
+        finally:
+            engine.close_host(ip, rpc_port)
+        block_hash = parse_block_hash(block, trust_height) if block is not None else None
+        commit_hash = parse_commit_hash(commit, trust_height) if commit is not None else None
+        if block_hash is None:
+            result['error'] = 'no block'
+        elif commit_hash is None:
+            result['error'] = 'no commit'
+        elif block_hash != commit_hash:
+            result['error'] = 'commit mismatch'
+        else:
+            result['hash'] = block_hash
+        return result
+
+    def run(self, connections, endpoints, engine=None):
+        """
+        Test the best candidates and write the [statesync] settings to the file.
+        :param connections: List of connection tuples of a snapshot
+        :param endpoints: Dictionary of peer -> (ip, rpc_port), peers without an entry are not tested
+        :param engine: Optional ProbeEngine of the run; the tests keep its rate limits, recorder,
+                       negative cache and deadline
+        :return: Dictionary with rpc_servers, trust_height, trust_hash and trust_period, or None if
+                 fewer than two servers qualify
+        """
+        ranking = rank_connections(connections, self.candidates)
+        candidates = [conn for conn in ranking.best() if conn[0] in endpoints]
+        trust_height = ranking.tip - self.trust_offset
+        if len(candidates) < MIN_SERVERS or trust_height < 1:
+            logging.warning(f"Not enough candidates or blocks for state sync: {len(candidates)} candidates, tip {ranking.tip}.")
+            return None
+        budget = engine.remaining() if engine is not None else None
+        if budget is not None and budget < 1:
+            logging.warning("No time left for state sync discovery.")
+            return None
+        engine = engine.spawn(self.checks, http_timeout=5) if engine is not None else ProbeEngine(self.checks, http_timeout=5)
+        logging.info(f"Testing {len(candidates)} RPC servers for state sync at trust height {trust_height}.")
+
+        async def check_all():
+            return await asyncio.gather(*(self.check(engine, *endpoints[conn[0]], trust_height) for conn in candidates))
+
+        self.results = dict(zip((conn[0] for conn in candidates), engine.run_async(check_all())))
+        # Hash -> peers signing it
+        hashes = {}
+        for peer, result in self.results.items():
+            if result['hash'] is not None:
+                hashes.setdefault(result['hash'], []).append(peer)
+        for peer, result in self.results.items():
+            if result['error'] is not None:
+                logging.info(f"{peer} cannot serve state sync: {result['error']}.")
+        if not hashes:
+            logging.warning(f"No RPC server serves block {trust_height}.")
+            return None
+        trust_hash, agreeing = max(hashes.items(), key=lambda item: len(item[1]))
+        for block_hash, peers in hashes.items():
+            if block_hash != trust_hash:
+                logging.warning(f"{', '.join(peers)} report hash {block_hash} for block {trust_height}, {len(agreeing)} others report {trust_hash}.")
+                for peer in peers:
+                    self.results[peer]['error'] = 'hash mismatch'
+        if len(agreeing) < MIN_SERVERS:
+            logging.warning(f"Only {len(agreeing)} RPC server serves block {trust_height} with hash {trust_hash}, state sync needs {MIN_SERVERS}.")
+            return None
+        agreeing.sort(key=lambda peer: self.results[peer]['seconds'])
+        servers = []
+        for peer in agreeing[:self.servers]:
+            ip, rpc_port = endpoints[peer]
+            servers.append(f"http://{format_host_port(ip, rpc_port)}")
+            logging.info(f"State sync server {servers[-1]} ({peer}) answered in {self.results[peer]['seconds']}s, earliest block {self.results[peer]['earliest']}.")
+        self.config = {'rpc_servers': servers, 'trust_height': trust_height, 'trust_hash': trust_hash, 'trust_period': self.trust_period}
+        self.write()
+        return self.config
+
+    def write(self):
+        """
+        Write the [statesync] block of the last run and log it.
+        """
+        if self.config is None:
+            return
+        text = format_statesync(self.config)
+        write_atomic(self.filename, text)
+        for line in text.splitlines():
+            logging.info(line)
+        logging.info(f"Wrote the state sync settings to {self.filename}.")
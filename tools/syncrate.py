@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import re
+import statistics
+import time
+from datetime import datetime
+from probe import DEFAULT_CONCURRENCY, ProbeEngine
+from ranking import connection_fields, rank_connections
+
+# Seconds over which the /status of every candidate is polled
+DEFAULT_SAMPLE_WINDOW = 10
+
+# Seconds between two polls of one peer
+DEFAULT_SAMPLE_INTERVAL = 2
+
+# Candidates sampled per peer kept in the output, taken from the ranking by a single snapshot
+DEFAULT_CANDIDATE_FACTOR = 3
+
+# Peers within this many blocks of the tip give the sync rate of the network
+NEAR_TIP_BLOCKS = 2
+
+# A latest block this many seconds older than the newest block seen marks a peer as stalled
+STALE_BLOCK_AGE = 60
+
+BLOCK_TIME = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)$')
+
+
+def parse_block_time(value):
+    """
+    :param value: RFC 3339 time with up to nanosecond precision, as in latest_block_time
+    :return: Seconds since the epoch, or None if invalid
+    """
+    match = BLOCK_TIME.match(value or '')
+    if match is None:
+        return None
+    base, fraction, zone = match.groups()
+    try:
+        moment = datetime.fromisoformat(base + ('+00:00' if zone == 'Z' else zone))
+    except ValueError:
+        return None
+    return moment.timestamp() + (float('0.' + fraction) if fraction else 0.0)
+
+
+def blocks_per_second(samples):
+    """
+    :param samples: List of (time, height) tuples, oldest first
+    :return: Blocks per second between the first and the last sample, None for fewer than two samples
+    """
+    if len(samples) < 2:
+        return None
+    (first_time, first_height), (last_time, last_height) = samples[0], samples[-1]
+    if last_time <= first_time:
+        return None
+    return max(0.0, (last_height - first_height) / (last_time - first_time))
+
+
+def assess(observations):
+    """
+    Compare the sync progress of peers with the network they were observed in.
+    The tip is the highest height seen, the network rate the median rate of the peers
+    near the tip and block staleness is measured against the newest latest_block_time
+    seen, so the local clock does not matter.
+    :param observations: Dictionary of peer -> (list of (time, height) samples, catching_up, latest_block_time)
+    :return: Dictionary of peer -> dictionary with height, lag, blocks_per_second, rate_deficit,
+             catching_up, block_age and stalled
+    """
+    heights = {peer: samples[-1][1] for peer, (samples, _, _) in observations.items() if samples}
+    if not heights:
+        return {}
+    tip = max(heights.values())
+    rates = {peer: blocks_per_second(samples) for peer, (samples, _, _) in observations.items()}
+    spans = {peer: samples[-1][0] - samples[0][0] for peer, (samples, _, _) in observations.items() if samples}
+    near_tip = [rates[peer] for peer, height in heights.items() if tip - height <= NEAR_TIP_BLOCKS and rates[peer] is not None]
+    network_rate = statistics.median(near_tip) if near_tip else 0.0
+    block_times = {peer: parse_block_time(block_time) for peer, (_, _, block_time) in observations.items()}
+    newest_block = max((t for t in block_times.values() if t is not None), default=None)
+    results = {}
+    for peer, (samples, catching_up, _) in observations.items():
+        if not samples:
+            continue
+        rate = rates[peer]
+        # Heights move in whole blocks, so one block less within the window is no deficit
+        deficit = 0.0 if rate is None else max(0.0, network_rate - rate - 1 / spans[peer])
+        block_age = None
+        if newest_block is not None and block_times[peer] is not None:
+            block_age = newest_block - block_times[peer]
+        stalled = (rate == 0 and network_rate > 0) or (block_age is not None and block_age > STALE_BLOCK_AGE)
+        results[peer] = {
+            'height': heights[peer],
+            'lag': tip - heights[peer],
+            'blocks_per_second': None if rate is None else round(rate, 3),
+            'rate_deficit': round(deficit, 3),
+            'catching_up': bool(catching_up),
+            'block_age': None if block_age is None else round(block_age, 1),
+            'stalled': stalled,
+        }
+    return results
+
+
+def with_sync(conn, result):
+    """
+    :param conn: Connection tuple, see ranking.connection_fields()
+    :param result: Sync result of the peer from assess()
+    :return: Connection tuple with the sampled height, catching_up, rate deficit and stalled flag
+    """
+    peer, _, rtt, _, failure_rate, _, _, transfer_delay = connection_fields(conn)
+    return peer, result['height'], rtt, result['catching_up'], failure_rate, result['rate_deficit'], result['stalled'], transfer_delay
+
+
+async def poll_status(engine, ip, rpc_port, window, interval):
+    """
+    Poll /status of one peer at a fixed interval.
+    :param engine: ProbeEngine used for the requests
+    :param ip: IP address
+    :param rpc_port: RPC port
+    :param window: Seconds to poll for
+    :param interval: Seconds between two polls
+    :return: List of (time, status dictionary) tuples of the successful polls
+    """
+    samples = []
+    start = time.monotonic()
+    polls = int(window // interval) + 1
+    for i in range(polls):
+        status = await engine.get_status(ip, rpc_port)
+        if status is not None:
+            samples.append((time.monotonic(), status))
+        if i + 1 < polls:
+            await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.monotonic()))
+    engine.close_host(ip, rpc_port)
+    return samples
+
+
+class SyncSampler:
+    """
+    Rank the best candidates of a snapshot by how they advance with the chain.
+    A single /status only shows where a peer is, so a peer that stalled, or syncs
+    slower than the network, ranks well while it happens to be near the tip. The
+    sampler polls /status of the candidates over a short window, computes their
+    blocks per second, lag behind the observed tip and latest_block_time staleness,
+    and feeds the results into the ranking.
+    """
+
+    def __init__(self, candidates, window=DEFAULT_SAMPLE_WINDOW, interval=DEFAULT_SAMPLE_INTERVAL, concurrency=DEFAULT_CONCURRENCY):
+        """
+        :param candidates: Number of the best peers of the snapshot to sample
+        :param window: Seconds over which each candidate is polled
+        :param interval: Seconds between two polls of one candidate
+        :param concurrency: Number of requests in flight at the same time
+        """
+        self.candidates = candidates
+        self.window = window
+        self.interval = interval
+        self.concurrency = concurrency
+        self.results = {}
+
+    async def sample(self, engine, endpoints, window):
+        """
+        :param engine: ProbeEngine used for the requests
+        :param endpoints: Dictionary of peer -> (ip, rpc_port)
+        :param window: Seconds to poll for
+        :return: Dictionary of peer -> sync result, see assess()
+        """
+        peers = list(endpoints)
+        polls = await asyncio.gather(*(poll_status(engine, ip, rpc_port, window, self.interval) for ip, rpc_port in endpoints.values()))
+        observations = {}
+        for peer, samples in zip(peers, polls):
+            last = samples[-1][1] if samples else {}
+            observations[peer] = ([(t, status['height']) for t, status in samples], last.get('catching_up'), last.get('latest_block_time'))
+        results = assess(observations)
+        for peer in peers:
+            if peer not in results:
+                logging.info(f"Sync sampling of {peer} failed, it is left out.")
+        return results
+
+    def run(self, connections, endpoints, stream=None, engine=None):
+        """
+        Sample the best candidates and return the connections with their sync results.
+        :param connections: List of connection tuples of a snapshot
+        :param endpoints: Dictionary of peer -> (ip, rpc_port), peers without an entry are not sampled
+        :param stream: Optional StreamingOutput receiving one record per sampled peer
+        :param engine: Optional ProbeEngine of the run; the sampling keeps its rate limits, recorder and
+                       negative cache, and the window is shortened to fit its deadline
+        :return: List of connection tuples; sampled peers carry their sync results, candidates that
+                 stopped answering are dropped
+        """
+        budget = engine.remaining() if engine is not None else None
+        window = self.window if budget is None else min(self.window, budget)
+        if window < self.interval:
+            logging.warning("No time left for sync sampling, keeping the snapshot ranking.")
+            return connections
+        candidates = [conn for conn in rank_connections(connections, self.candidates).best() if conn[0] in endpoints]
+        engine = engine.spawn(self.concurrency) if engine is not None else ProbeEngine(self.concurrency)
+        logging.info(f"Sampling the sync rate of {len(candidates)} peers for {window:.0f}s.")
+        self.results = engine.run_async(self.sample(engine, {conn[0]: endpoints[conn[0]] for conn in candidates}, window))
+        sampled = {}
+        for conn in candidates:
+            result = self.results.get(conn[0])
+            if result is None:
+                if stream is not None:
+                    # Demote it in the streamed ranking as well
+                    stream.add({'peer': conn[0], 'ok': False, 'sync': True}, connection_fields(conn)[:5] + (0.0, True))
+                continue
+            sampled[conn[0]] = with_sync(conn, result)
+            if result['stalled'] or result['rate_deficit']:
+                logging.info(f"{conn[0]} advances at {result['blocks_per_second']} blocks/s, {result['lag']} behind, block age {result['block_age']}s{', stalled' if result['stalled'] else ''}.")
+            if stream is not None:
+                stream.add(dict({'peer': conn[0], 'ok': True, 'sync': True}, **result), sampled[conn[0]])
+        candidate_peers = {conn[0] for conn in candidates}
+        return list(sampled.values()) + [conn for conn in connections if conn[0] not in candidate_peers]
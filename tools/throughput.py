@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import statistics
+from probe import ProbeEngine
+from ranking import connection_fields, rank_connections
+
+# Recent blocks downloaded from each candidate
+DEFAULT_BLOCKS = 3
+
+# Bytes downloaded per run over all candidates, split evenly between them
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Seconds allowed for the download of one block
+DEFAULT_TRANSFER_TIMEOUT = 10
+
+# Candidates downloading at the same time, few enough not to saturate the local link
+DEFAULT_DOWNLOADS = 8
+
+# Bytes whose download time is compared between peers, about a batch of blocks fetched during block sync
+REFERENCE_BYTES = 1024 * 1024
+
+# Peers sending at less than this share of the median rate of the candidates are costed for the difference
+SLOW_RATE_SHARE = 0.5
+
+# Transfer delay recorded for a peer that sent nothing in time
+MAX_TRANSFER_DELAY = 60
+
+
+def summarize(transfers):
+    """
+    Combine the block downloads of one peer.
+    Bytes per second are taken over the whole time of the requests, time to first byte
+    included, which is the rate block sync sees when fetching block after block.
+    :param transfers: List of (status, bytes, seconds to first byte, seconds) tuples, see ProbeEngine.download()
+    :return: Dictionary with bytes, blocks, ttfb and bytes_per_second; bytes_per_second is None
+             if the peer does not serve blocks and 0 if no byte arrived in time
+    """
+    counted = [t for t in transfers if t[0] == 200 or (t[0] is None and t[1])]
+    failed = [t for t in transfers if t[0] is None and not t[1]]
+    received = sum(t[1] for t in counted)
+    elapsed = sum(t[3] for t in counted + failed)
+    first_bytes = [t[2] for t in counted if t[2] is not None]
+    if counted and elapsed > 0:
+        rate = received / elapsed
+    elif failed:
+        # Connections failed or timed out before the first byte
+        rate = 0.0
+    else:
+        rate = None
+    return {
+        'bytes': received,
+        'blocks': sum(1 for t in counted if t[0] == 200),
+        'ttfb': round(statistics.median(first_bytes), 4) if first_bytes else None,
+        'bytes_per_second': None if rate is None else round(rate),
+    }
+
+
+def transfer_delay(rate, median_rate):
+    """
+    Recent blocks are small, so the rates of healthy peers differ mostly by their latency;
+    only a peer clearly slower than the typical one is costed.
+    :param rate: Bytes per second of a peer, None if unknown
+    :param median_rate: Median bytes per second of the peers measured
+    :return: Seconds the peer takes longer to send REFERENCE_BYTES than a peer at SLOW_RATE_SHARE
+             of the median rate, 0 if faster or unknown
+    """
+    if rate is None or not median_rate:
+        return 0.0
+    if rate <= 0:
+        return MAX_TRANSFER_DELAY
+    delay = REFERENCE_BYTES / rate - REFERENCE_BYTES / (median_rate * SLOW_RATE_SHARE)
+    return round(min(MAX_TRANSFER_DELAY, max(0.0, delay)), 3)
+
+
+def with_throughput(conn, result):
+    """
+    :param conn: Connection tuple, see ranking.connection_fields()
+    :param result: Throughput result of the peer from summarize() with its transfer_delay
+    :return: Connection tuple with the transfer delay
+    """
+    return connection_fields(conn)[:7] + (result['transfer_delay'],)
+
+
+class ThroughputProbe:
+    """
+    Rank the best candidates of a snapshot by how fast they push blocks.
+    Block sync is bound by throughput more than by connect latency, so the probe
+    downloads a few recent blocks from the RPC of each candidate with /block?height=,
+    measures bytes per second and time to first byte, and feeds into the ranking how
+    much longer than a typical candidate the slow ones take to send a batch of blocks.
+    The bytes downloaded per run are capped and split between the candidates.
+    """
+
+    def __init__(self, candidates, blocks=DEFAULT_BLOCKS, max_bytes=DEFAULT_MAX_BYTES, timeout=DEFAULT_TRANSFER_TIMEOUT, downloads=DEFAULT_DOWNLOADS):
+        """
+        :param candidates: Number of the best peers of the snapshot to measure
+        :param blocks: Recent blocks downloaded from each candidate
+        :param max_bytes: Bytes downloaded per run over all candidates
+        :param timeout: Seconds allowed for the download of one block
+        :param downloads: Candidates downloading at the same time
+        """
+        self.candidates = candidates
+        self.blocks = blocks
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.downloads = downloads
+        self.results = {}
+
+    async def measure(self, engine, ip, rpc_port, height, budget, timeout):
+        """
+        Download recent blocks of one peer one after the other, newest first.
+        :param engine: ProbeEngine used for the requests
+        :param ip: IP address
+        :param rpc_port: RPC port
+        :param height: Latest block height of the peer
+        :param budget: Bytes the peer may send in total
+        :param timeout: Seconds allowed for the download of one block
+        :return: Throughput result, see summarize()
+        """
+        transfers = []
+        for i in range(self.blocks):
+            if budget <= 0 or height - i < 1:
+                break
+            transfer = await engine.download(ip, rpc_port, f'/block?height={height - i}', budget, timeout)
+            transfers.append(transfer)
+            budget -= transfer[1]
+            if transfer[0] is None:
+                break
+        engine.close_host(ip, rpc_port)
+        return summarize(transfers)
+
+    def run(self, connections, endpoints, stream=None, engine=None):
+        """
+        Measure the best candidates and return the connections with their throughput.
+        :param connections: List of connection tuples of a snapshot
+        :param endpoints: Dictionary of peer -> (ip, rpc_port), peers without an entry are not measured
+        :param stream: Optional StreamingOutput receiving one record per measured peer
+        :param engine: Optional ProbeEngine of the run; the downloads keep its rate limits, recorder and
+                       negative cache, and the per-block timeout is shortened to fit its deadline
+        :return: List of connection tuples; measured peers carry their transfer delay
+        """
+        budget = engine.remaining() if engine is not None else None
+        timeout = self.timeout if budget is None else min(self.timeout, budget / self.blocks)
+        if timeout < 1:
+            logging.warning("No time left for throughput probing, keeping the snapshot ranking.")
+            return connections
+        candidates = [conn for conn in rank_connections(connections, self.candidates).best() if conn[0] in endpoints]
+        if not candidates:
+            return connections
+        share = self.max_bytes // len(candidates)
+        engine = engine.spawn(self.downloads) if engine is not None else ProbeEngine(self.downloads)
+        logging.info(f"Downloading up to {self.blocks} blocks from each of {len(candidates)} peers, at most {share} bytes per peer.")
+
+        async def measure_all():
+            return await asyncio.gather(*(self.measure(engine, *endpoints[conn[0]], conn[1], share, timeout) for conn in candidates))
+
+        self.results = dict(zip((conn[0] for conn in candidates), engine.run_async(measure_all())))
+        rates = [result['bytes_per_second'] for result in self.results.values() if result['bytes_per_second'] is not None]
+        median_rate = statistics.median(rates) if rates else None
+        measured = {}
+        for conn in candidates:
+            result = self.results[conn[0]]
+            result['transfer_delay'] = transfer_delay(result['bytes_per_second'], median_rate)
+            measured[conn[0]] = with_throughput(conn, result)
+            if result['bytes_per_second'] is None:
+                logging.info(f"{conn[0]} serves no blocks over RPC, its throughput is unknown.")
+            else:
+                logging.info(f"{conn[0]} sent {result['bytes']} bytes at {result['bytes_per_second']} bytes/s, first byte after {result['ttfb']}s, {result['transfer_delay']}s slower than typical.")
+            if stream is not None:
+                stream.add(dict({'peer': conn[0], 'ok': True, 'throughput': True}, **result), measured[conn[0]])
+        return list(measured.values()) + [conn for conn in connections if conn[0] not in measured]
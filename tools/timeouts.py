@@ -0,0 +1,142 @@
+import ipaddress
+import math
+from collections import OrderedDict, deque
+
+# A timeout is the 95th percentile of the observed latencies times this factor
+DEFAULT_TIMEOUT_FACTOR = 3
+
+# Bounds of the learned timeouts in seconds
+DEFAULT_TIMEOUT_FLOOR = 1
+DEFAULT_TIMEOUT_CEILING = 10
+
+# A hedged second connect starts once a connect takes this many times the 95th percentile
+HEDGE_FACTOR = 2
+
+# Shortest delay in seconds before a hedged second attempt is started
+MIN_HEDGE_DELAY = 0.05
+
+# Latency samples kept per host and per subnet
+MAX_SAMPLES = 32
+
+# Number of samples a subnet needs before its estimate is used for unseen hosts
+MIN_SUBNET_SAMPLES = 3
+
+# Hosts and subnets tracked, the least recently updated are forgotten first
+MAX_TRACKED = 65536
+
+
+def subnet_key(ip):
+    """
+    Group an address with its neighbours, which usually share a route and a hosting provider.
+    :param ip: IP address or host name
+    :return: The /24 network for IPv4, the /48 network for IPv6, host names unchanged
+    """
+    if ip.replace('.', '').isdigit():
+        return ip.rpartition('.')[0] + '.0/24'
+    try:
+        return str(ipaddress.ip_network(f"{ip}/48", strict=False))
+    except ValueError:
+        return ip
+
+
+def percentile(samples, p):
+    """
+    :param samples: Non-empty collection of numbers
+    :param p: Percentile, 0 to 100
+    :return: Nearest-rank percentile of the samples
+    """
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+class LatencyEstimator:
+    """
+    Recent latency samples per host and per subnet in bounded ring buffers.
+    """
+
+    def __init__(self):
+        self.hosts = OrderedDict()
+        self.subnets = OrderedDict()
+
+    def observe(self, ip, seconds):
+        """
+        Record the latency of a successful operation.
+        :param ip: IP address
+        :param seconds: Latency in seconds
+        """
+        for store, key in ((self.hosts, ip), (self.subnets, subnet_key(ip))):
+            samples = store.get(key)
+            if samples is None:
+                samples = store[key] = deque(maxlen=MAX_SAMPLES)
+                if len(store) > MAX_TRACKED:
+                    store.popitem(last=False)
+            else:
+                store.move_to_end(key)
+            samples.append(seconds)
+
+    def p95(self, ip):
+        """
+        :param ip: IP address
+        :return: 95th percentile latency of the host, else of its subnet, or None if neither is known
+        """
+        samples = self.hosts.get(ip)
+        if not samples:
+            samples = self.subnets.get(subnet_key(ip))
+            if samples is None or len(samples) < MIN_SUBNET_SAMPLES:
+                return None
+        return percentile(samples, 95)
+
+
+class AdaptiveTimeouts:
+    """
+    Connect and request timeouts learned from the latencies observed so far.
+    Hosts, or hosts of subnets, with known latencies get a connect timeout of
+    p95 x factor within [floor, ceiling], so dead peers in fast networks fail early.
+    A connect running longer than twice the p95 gets a hedged second connect, which
+    covers a lost SYN without waiting for the kernel to retransmit it.
+    Request timeouts only grow above the default, since a slow answer from a host
+    that accepted the connection is usually load rather than a dead peer, and a
+    duplicate request would only add to that load. Unknown hosts get the fixed
+    defaults and no hedging.
+    """
+
+    def __init__(self, connect_timeout, http_timeout, factor=DEFAULT_TIMEOUT_FACTOR, floor=DEFAULT_TIMEOUT_FLOOR, ceiling=DEFAULT_TIMEOUT_CEILING):
+        """
+        :param connect_timeout: Connect timeout in seconds for unknown hosts
+        :param http_timeout: Request timeout in seconds for unknown hosts
+        :param factor: Multiplier applied to the 95th percentile latency
+        :param floor: Shortest timeout in seconds
+        :param ceiling: Longest timeout in seconds
+        """
+        self.connect_timeout = connect_timeout
+        self.http_timeout = http_timeout
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.connect_times = LatencyEstimator()
+        self.request_times = LatencyEstimator()
+
+    def connect(self, ip):
+        """
+        :param ip: IP address
+        :return: Connect timeout in seconds and the delay before a hedged attempt, None for no hedging
+        """
+        p95 = self.connect_times.p95(ip)
+        if p95 is None:
+            return self.connect_timeout, None
+        timeout = min(self.ceiling, max(self.floor, p95 * self.factor))
+        hedge_after = max(MIN_HEDGE_DELAY, p95 * HEDGE_FACTOR)
+        return timeout, hedge_after if hedge_after < timeout else None
+
+    def request(self, ip):
+        """
+        :param ip: IP address
+        :return: Request timeout in seconds
+        """
+        p95 = self.request_times.p95(ip)
+        if p95 is None:
+            # No request finished yet, allow at least a few round trips of a far-away host
+            p95 = self.connect_times.p95(ip)
+            if p95 is None:
+                return self.http_timeout
+        return min(self.ceiling, max(self.http_timeout, p95 * self.factor))
@@ -0,0 +1,222 @@
+import heapq
+import json
+import logging
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds of the histogram buckets, slower operations fall in a last open bucket
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Hosts listed in the report, the ones that took the most time first
+DEFAULT_TOP_HOSTS = 10
+
+# Phases in report order, others follow in the order they were first seen
+PHASES = ('queue', 'dns', 'connect', 'handshake', 'ttfb', 'body', 'parse')
+
+# Shared by every span taken without a recorder
+NO_SPAN = nullcontext()
+
+
+def span(recorder, phase, host):
+    """
+    :param recorder: PhaseRecorder or None
+    :param phase: Name of the phase
+    :param host: Host the operation talks to
+    :return: Context manager timing its block as one span of the phase, doing nothing without a recorder
+    """
+    if recorder is None:
+        return NO_SPAN
+    return recorder.span(phase, host)
+
+
+def format_bucket(index):
+    bound = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+    label = f"{bound * 1000:g}ms" if bound < 1 else f"{bound:g}s"
+    return f"<={label}" if index < len(BUCKETS) else f">{label}"
+
+
+class PhaseHistogram:
+    """
+    Durations of one phase in fixed logarithmic buckets, so memory does not grow with the scan.
+    """
+    __slots__ = ('count', 'failures', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds, ok=True):
+        self.count += 1
+        self.failures += not ok
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, p):
+        """
+        :param p: Percentile, 0 to 100
+        :return: Upper bound of the bucket holding the percentile, the maximum for the last bucket
+        """
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+class PhaseRecorder:
+    """
+    Time every network phase of the probes with the monotonic perf_counter clock.
+    Each span is added to a histogram per phase and to the total of its host; with
+    keep_spans the spans are kept as well, to be written as a trace showing the
+    concurrency over time.
+    """
+
+    def __init__(self, keep_spans=False):
+        """
+        :param keep_spans: Keep every span for write_trace(), memory grows with the scan
+        """
+        self.keep_spans = keep_spans
+        self.origin = time.perf_counter()
+        # List of (phase, host, start, end, ok) tuples in perf_counter seconds
+        self.spans = []
+        self.phases = {phase: PhaseHistogram() for phase in PHASES}
+        # Host -> seconds spent in all phases
+        self.hosts = {}
+
+    @contextmanager
+    def span(self, phase, host):
+        """
+        Time the block as one span; it counts as failed if the block raises.
+        :param phase: Name of the phase
+        :param host: Host the operation talks to
+        """
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.add(phase, host, start, time.perf_counter(), ok)
+
+    def add(self, phase, host, start, end, ok=True):
+        """
+        Record one span.
+        :param phase: Name of the phase
+        :param host: Host the operation talks to
+        :param start: perf_counter value at the start
+        :param end: perf_counter value at the end
+        :param ok: Whether the operation succeeded
+        """
+        histogram = self.phases.get(phase)
+        if histogram is None:
+            histogram = self.phases[phase] = PhaseHistogram()
+        histogram.add(end - start, ok)
+        if phase != 'queue':
+            self.hosts[host] = self.hosts.get(host, 0.0) + end - start
+        if self.keep_spans:
+            self.spans.append((phase, host, start, end, ok))
+
+    def extend(self, spans):
+        """
+        Record the spans of another recorder, e.g. of a worker process. perf_counter is
+        system-wide on the supported platforms, so the spans share one time line.
+        :param spans: List of (phase, host, start, end, ok) tuples
+        """
+        for phase, host, start, end, ok in spans:
+            self.add(phase, host, start, end, ok)
+
+    def drain(self):
+        """
+        :return: The spans kept since the last call, which are forgotten here
+        """
+        spans, self.spans = self.spans, []
+        return spans
+
+    def report(self, top_hosts=DEFAULT_TOP_HOSTS):
+        """
+        :param top_hosts: Number of hosts listed
+        :return: List of report lines with the statistics and histogram of every phase and the slowest hosts
+        """
+        lines = [f"{'phase':<10} {'count':>8} {'failed':>7} {'total s':>9} {'mean ms':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"]
+        histograms = [(phase, h) for phase, h in self.phases.items() if h.count]
+        for phase, h in histograms:
+            lines.append(f"{phase:<10} {h.count:>8} {h.failures:>7} {h.total:>9.2f} {h.total / h.count * 1000:>8.1f} "
+                         f"{h.percentile(50) * 1000:>8.1f} {h.percentile(90) * 1000:>8.1f} {h.percentile(99) * 1000:>8.1f} {h.max * 1000:>8.1f}")
+        for phase, h in histograms:
+            lines.append(f"{phase}: " + ', '.join(f"{format_bucket(i)} {n}" for i, n in enumerate(h.buckets) if n))
+        slowest = heapq.nlargest(top_hosts, self.hosts.items(), key=lambda item: item[1])
+        if slowest:
+            lines.append('Slowest hosts: ' + ', '.join(f"{host} {seconds:.2f}s" for host, seconds in slowest))
+        return lines
+
+    def finish(self, trace_file=None):
+        """
+        Log the report at the end of a run and write the trace file.
+        :param trace_file: Optional trace file name, see write_trace()
+        """
+        for line in self.report():
+            logging.info(line)
+        if trace_file:
+            self.write_trace(trace_file)
+            logging.info(f"Wrote {len(self.spans)} spans to {trace_file}.")
+
+    def write_trace(self, filename):
+        """
+        Write the kept spans. A .json file gets the Chrome trace event format, viewable in
+        chrome://tracing or Perfetto, with one lane per operation in flight and a counter of
+        the operations in flight; any other file gets one JSON object per span and line.
+        :param filename: Trace file name
+        """
+        spans = sorted(self.spans, key=lambda s: s[2])
+        with open(filename, 'w') as file:
+            if not filename.endswith('.json'):
+                for phase, host, start, end, ok in spans:
+                    file.write(json.dumps({'phase': phase, 'host': host, 'start': round(start - self.origin, 6),
+                                           'duration': round(end - start, 6), 'ok': ok}) + '\n')
+                return
+            file.write('{"traceEvents": [\n')
+            file.write(json.dumps({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'probes'}}))
+            file.write(',\n' + json.dumps({'name': 'process_name', 'ph': 'M', 'pid': 2, 'args': {'name': 'waiting for a slot'}}))
+            # Lane per process: heap of (end, lane) in use and free lanes
+            busy = {1: [], 2: []}
+            free = {1: [], 2: []}
+            lanes = {1: 0, 2: 0}
+            changes = []
+            for phase, host, start, end, ok in spans:
+                pid = 2 if phase == 'queue' else 1
+                while busy[pid] and busy[pid][0][0] <= start:
+                    heapq.heappush(free[pid], heapq.heappop(busy[pid])[1])
+                if free[pid]:
+                    lane = heapq.heappop(free[pid])
+                else:
+                    lanes[pid] += 1
+                    lane = lanes[pid]
+                heapq.heappush(busy[pid], (end, lane))
+                if pid == 1:
+                    changes.append((start, 1))
+                    changes.append((end, -1))
+                file.write(',\n' + json.dumps({'name': phase, 'cat': 'probe', 'ph': 'X', 'pid': pid, 'tid': lane,
+                                               'ts': round((start - self.origin) * 1e6, 1), 'dur': round((end - start) * 1e6, 1),
+                                               'args': {'host': host, 'ok': ok}}))
+            in_flight = 0
+            # Changes within the same microsecond are coalesced into the value after the last of them
+            pending_ts = None
+            for moment, delta in sorted(changes):
+                ts = round((moment - self.origin) * 1e6)
+                if pending_ts is not None and ts != pending_ts:
+                    file.write(',\n' + json.dumps({'name': 'in flight', 'ph': 'C', 'pid': 1, 'ts': pending_ts, 'args': {'operations': in_flight}}))
+                in_flight += delta
+                pending_ts = ts
+            if pending_ts is not None:
+                file.write(',\n' + json.dumps({'name': 'in flight', 'ph': 'C', 'pid': 1, 'ts': pending_ts, 'args': {'operations': in_flight}}))
+            file.write('\n]}\n')